@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import json
 import logging
 
 from app.db import session, crud, models
 from app.schemas import user as user_schema
+from app.services import bulk_users, circuit_breaker
+from app.services.cache_registry import CacheNotSupported, caches
+from app.services.metrics import metrics
+from app.services.prompt_compiler import prompt_compiler
+from app.services.response_cache import response_cache
 from app.api import deps
 
 router = APIRouter()
@@ -12,10 +19,21 @@ logger = logging.getLogger(__name__)
 
 @router.get("/users", response_model=List[user_schema.User])
 def read_users(
+    after: Optional[str] = Query(None, description="Return users whose code sorts after this one"),
+    limit: int = Query(100, ge=1, le=500),
+    q: Optional[str] = Query(None, description="Search by name or phone"),
     db: Session = Depends(session.get_db),
     current_admin: models.User = Depends(deps.get_current_active_admin)
 ):
-    return crud.get_users(db)
+    return crud.get_users_page(db, after_code=after, limit=limit, search=q)
+
+@router.get("/users/count")
+def count_users(
+    q: Optional[str] = Query(None, description="Search by name or phone"),
+    db: Session = Depends(session.get_db),
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    return {"count": crud.count_users(db, search=q)}
 
 @router.post("/users", response_model=user_schema.User)
 def create_user(
@@ -28,6 +46,65 @@ def create_user(
         raise HTTPException(status_code=400, detail="User already exists")
     return crud.create_user(db, **user_in.dict())
 
+async def _read_bulk_rows(request: Request) -> list:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Missing 'file' field")
+        raw, content_type = await upload.read(), upload.content_type or upload.filename or ""
+    else:
+        raw = await request.body()
+    try:
+        rows = bulk_users.parse_rows(raw, content_type)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse upload: {e}")
+    if not rows:
+        raise HTTPException(status_code=400, detail="No rows found in upload")
+    return rows
+
+def _ndjson(reports, on_done=None):
+    for report in reports:
+        yield json.dumps(report, ensure_ascii=False) + "\n"
+    if on_done:
+        on_done()
+
+@router.post("/users/bulk")
+async def bulk_create_users(
+    request: Request,
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    """Create many users from a CSV/JSON body or file upload; streams an NDJSON row report."""
+    rows = await _read_bulk_rows(request)
+    logger.info("admin_bulk_create_users admin=%s rows=%s", current_admin.code, len(rows))
+    return StreamingResponse(_ndjson(bulk_users.import_users(rows)), media_type="application/x-ndjson")
+
+@router.post("/users/locations/bulk")
+async def bulk_set_user_locations(
+    request: Request,
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    """Replace location assignments for many users; streams an NDJSON row report."""
+    rows = await _read_bulk_rows(request)
+    logger.info("admin_bulk_set_user_locations admin=%s rows=%s", current_admin.code, len(rows))
+    return StreamingResponse(
+        _ndjson(bulk_users.import_user_locations(rows), on_done=prompt_compiler.invalidate),
+        media_type="application/x-ndjson",
+    )
+
+@router.get("/users/export")
+def export_users(
+    format: str = Query("csv", pattern="^(csv|json)$"),
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    if format == "csv":
+        return StreamingResponse(
+            bulk_users.export_users("csv"), media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=users.csv"},
+        )
+    return StreamingResponse(bulk_users.export_users("json"), media_type="application/x-ndjson")
+
 @router.put("/users/{user_code}", response_model=user_schema.User)
 def update_user(
     user_code: str,
@@ -58,6 +135,7 @@ def delete_user(
     current_admin: models.User = Depends(deps.get_current_active_admin)
 ):
     if crud.delete_user(db, user_code):
+        prompt_compiler.invalidate(user_code)
         return {"msg": "User deleted"}
     raise HTTPException(status_code=404, detail="User not found")
 
@@ -75,3 +153,53 @@ def reset_user_secret(
         raise HTTPException(status_code=404, detail="User not found")
     logger.info("admin_reset_user_secret admin=%s target=%s", current_admin.code, user_code)
     return {"msg": "User secret reset successfully"}
+
+@router.get("/metrics")
+def read_metrics(
+    top: int = Query(20, ge=1, le=200, description="Rows returned for per-location / per-user breakdowns"),
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    snapshot = metrics.snapshot(top=top)
+    snapshot["circuit_breakers"] = circuit_breaker.snapshot_all()
+    return snapshot
+
+@router.get("/response-cache")
+def read_response_cache(
+    top: int = Query(20, ge=1, le=200),
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    return response_cache.stats(top=top)
+
+@router.delete("/response-cache")
+def clear_response_cache(
+    current_admin: models.User = Depends(deps.get_current_active_admin)
+):
+    response_cache.clear()
+    logger.info("admin_clear_response_cache admin=%s", current_admin.code)
+    return {"msg": "Response cache cleared"}
+
+@router.get("/caches")
+def read_caches(current_admin: models.User = Depends(deps.get_current_active_admin)):
+    return caches.stats()
+
+def _cache_action(action, name, admin):
+    try:
+        result = getattr(caches, action)(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown cache '{name}'")
+    except CacheNotSupported as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Cache {action} failed for '{name}': {e}")
+        raise HTTPException(status_code=503, detail=f"Could not {action} cache '{name}': {e}")
+    logger.info("admin_cache_%s admin=%s cache=%s", action, admin.code, name)
+    return result
+
+@router.post("/caches/{name}/invalidate")
+def invalidate_cache(name: str, current_admin: models.User = Depends(deps.get_current_active_admin)):
+    return _cache_action("invalidate", name, current_admin)
+
+@router.post("/caches/{name}/warm")
+def warm_cache(name: str, current_admin: models.User = Depends(deps.get_current_active_admin)):
+    """Reload a cache now (single-flight for the taxonomy: concurrent callers share one Sheets read)."""
+    return _cache_action("warm", name, current_admin)
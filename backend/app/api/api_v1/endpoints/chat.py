@@ -1,56 +1,275 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Header, WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import threading
+import time
 
 from app.db import session, models
 from app.schemas import chat as chat_schema
 from app.services import ai_service, sheets_service, classifier
+from app.services.idempotency import TURN, idempotency
+from app.services.metrics import metrics
+from app.services.order_events import order_events
+from app.services.order_parser import OrderStreamParser
+from app.services.prompt_compiler import prompt_compiler
+from app.services.response_cache import response_cache
+from app.services.speculative_classifier import ReadyItemFilter, extract_ready_items, speculative_classifier
+from app.core.config import settings
 from app.api import deps # We'll create this to get current user
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+SAVE_ERROR_REPLY = "❌ حدث خطأ أثناء حفظ الطلب. يرجى المحاولة لاحقاً."
+
 @router.post("/", response_model=chat_schema.ChatResponse)
 def chat(
     req: chat_schema.ChatRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(session.get_db),
-    current_user: models.User = Depends(deps.get_current_user)
+    current_user: models.User = Depends(deps.get_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=128),
 ):
-    # Determine locations for this user
-    LOCATIONS = [loc.name for loc in current_user.locations]
-    
-    history = req.history
-    history.append(f"العميل: {req.message}")
-    
-    # Trim history after last order
-    last_order_idx = -1
-    for i, msg in enumerate(history):
-        if "تم تسجيل طلبك بنجاح" in msg or "رقم الطلب:" in msg:
-            last_order_idx = i
-    if last_order_idx >= 0:
-        history = history[last_order_idx + 1:]
-        
-    # Get Taxonomy - simplified for now
-    tax_summary = ""
-    if sheets_service.worksheet:
-        tax_summary = classifier.get_taxonomy_summary(sheets_service.worksheet.spreadsheet)
-    
-    ai_reply = ai_service.get_ai_response(history, current_user, LOCATIONS, tax_summary)
-    
-    order_data = ai_service.extract_order_data(ai_reply, LOCATIONS)
-    
-    order_placed = False
-    if order_data:
-        summary = ai_reply.split("###DATA_START###")[0].strip()
-        order_num = sheets_service.save_to_sheet(order_data, summary, current_user, background_tasks)
-        if order_num:
-            ai_reply = f"{summary}\n\n✅ تم تسجيل طلبك بنجاح! رقم الطلب: **{order_num}**\nراح نتواصل معك قريب."
-            order_placed = True
-        else:
-            ai_reply = "❌ حدث خطأ أثناء حفظ الطلب. يرجى المحاولة لاحقاً."
-
-    # Remove data block before returning
-    if "###DATA_START###" in ai_reply:
-        ai_reply = ai_reply.split("###DATA_START###")[0].strip()
-
-    return {"reply": ai_reply, "order_placed": order_placed}
+    key = req.idempotency_key or idempotency_key
+    if not key:
+        return _chat_turn(req, background_tasks, current_user)
+    # A retried turn gets the first response back instead of another Gemini call and order save.
+    # Error replies are not kept, so retrying after one tries again.
+    response, _ = idempotency.run(
+        TURN, current_user.code, key,
+        lambda: _chat_turn(req, background_tasks, current_user, key),
+        keep=_is_final,
+    )
+    return response
+
+def _is_final(response):
+    return response["reply"] not in ai_service.FALLBACK_REPLIES and response["reply"] != SAVE_ERROR_REPLY
+
+class ChatTurn:
+    """Per-turn inputs shared by the HTTP and WebSocket chat."""
+
+    def __init__(self, history, message, current_user, idempotency_key=None):
+        self.idempotency_key = idempotency_key
+        # Determine locations for this user (cached with the user's pre-rendered prompt)
+        self.locations = prompt_compiler.locations(current_user)
+
+        history = list(history)
+        history.append(f"العميل: {message}")
+
+        # Trim history after last order
+        last_order_idx = -1
+        for i, msg in enumerate(history):
+            if "تم تسجيل طلبك بنجاح" in msg or "رقم الطلب:" in msg:
+                last_order_idx = i
+        if last_order_idx >= 0:
+            history = history[last_order_idx + 1:]
+        self.history = history
+
+        # Only the taxonomy rows relevant to the recent customer messages go into the prompt
+        self.tax_summary = ""
+        self.ws = sheets_service.get_worksheet()
+        if self.ws:
+            recent_customer = [msg for msg in history if msg.startswith("العميل:")][-3:]
+            self.tax_summary = classifier.get_relevant_taxonomy(self.ws.spreadsheet, "\n".join(recent_customer))
+
+        # Opening turns ("السلام عليكم", "ابي اطلب", ...) are answered from the cache when possible
+        self.cache_key = response_cache.key_for(message, history[:-1], classifier.get_taxonomy_version(), self.locations)
+
+    def cached_reply(self):
+        return response_cache.get(self.cache_key)
+
+    def finish(self, ai_reply, current_user, background_tasks, cached=False):
+        """Save the order if the reply carries one; returns the ChatResponse dict."""
+        if not cached and ai_reply not in ai_service.FALLBACK_REPLIES:
+            response_cache.put(self.cache_key, ai_reply, current_user)
+
+        # Items whose specs are complete start classifying now; the order save picks the results up
+        ai_reply, ready_items = extract_ready_items(ai_reply)
+        if ready_items and self.ws and settings.SPECULATIVE_CLASSIFICATION:
+            speculative_classifier.schedule(current_user.code, self.ws.spreadsheet, ready_items)
+
+        order_data = ai_service.extract_order_data(ai_reply, self.locations)
+
+        order_placed = False
+        if order_data:
+            summary = ai_reply.split("###DATA_START###")[0].strip()
+            # A retry of this turn (same key, or same history without one) gets the first order number back
+            order_num = sheets_service.save_to_sheet(
+                order_data, summary, current_user, background_tasks,
+                idempotency_key=self.idempotency_key, history=self.history,
+            )
+            if order_num:
+                ai_reply = f"{summary}\n\n✅ تم تسجيل طلبك بنجاح! رقم الطلب: **{order_num}**\nراح نتواصل معك قريب."
+                order_placed = True
+            else:
+                ai_reply = SAVE_ERROR_REPLY
+
+        # Remove data block before returning
+        if "###DATA_START###" in ai_reply:
+            ai_reply = ai_reply.split("###DATA_START###")[0].strip()
+
+        return {"reply": ai_reply, "order_placed": order_placed}
+
+def _chat_turn(req, background_tasks, current_user, idempotency_key=None):
+    start = time.perf_counter()
+    turn = ChatTurn(req.history, req.message, current_user, idempotency_key)
+    ai_reply = turn.cached_reply()
+    cached = ai_reply is not None
+    if not cached:
+        ai_reply = ai_service.get_ai_response(turn.history, current_user, turn.locations, turn.tax_summary)
+    response = turn.finish(ai_reply, current_user, background_tasks, cached)
+    metrics.observe("chat", time.perf_counter() - start)
+    return response
+
+
+# ---------------------------------------------------------------------------
+# WebSocket chat
+#
+# Client -> server (JSON):
+#   {"type": "auth", "token": "<JWT>", "history": [...]}   first message; history is optional
+#   {"type": "message", "text": "...", "idempotency_key": "..."}
+#   {"type": "reset"}                                        start a new conversation
+# Server -> client:
+#   {"type": "ready", "locations": [...]}
+#   {"type": "delta", "text": "..."}                          visible reply text as it streams
+#   {"type": "reply", "reply": "...", "order_placed": bool}   final reply, replaces the deltas
+#   {"type": "order_saved", "order_num": n, "items": n}
+#   {"type": "classification_complete", "order_num": n, "classified": n, "total": n}
+#   {"type": "error", "detail": "..."}
+# Order events are pushed for every order of the user, also ones placed over HTTP.
+# ---------------------------------------------------------------------------
+
+WS_UNAUTHORIZED = 4401
+
+_ws_task_pool = None
+_ws_task_pool_lock = threading.Lock()
+
+class _BackgroundThreads:
+    """BackgroundTasks stand-in for WebSocket turns, which have no response to run tasks after."""
+
+    def add_task(self, func, *args, **kwargs):
+        global _ws_task_pool
+        if _ws_task_pool is None:
+            with _ws_task_pool_lock:
+                if _ws_task_pool is None:
+                    _ws_task_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ws-task")
+        _ws_task_pool.submit(func, *args, **kwargs)
+
+def _ws_authenticate(token):
+    """The user for this token with locations loaded, or None."""
+    session.ensure_db()
+    db = session.SessionLocal()
+    try:
+        user = deps.get_user_from_token(db, token)
+        prompt_compiler.locations(user)
+        return user
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+def _ws_turn(state, text, idempotency_key, push):
+    """One chat turn on a WebSocket: streams deltas through push() and returns the ChatResponse dict."""
+    start = time.perf_counter()
+    session.ensure_db()
+    db = session.SessionLocal()
+    try:
+        # A primary-key read, so admin changes to the user (name, locations, deletion) apply mid-connection
+        current_user = db.get(models.User, state["user_code"])
+        if current_user is None:
+            return None
+        prompt_compiler.locations(current_user)
+    finally:
+        db.close()
+
+    def run():
+        turn = ChatTurn(state["history"], text, current_user, idempotency_key)
+        ai_reply = turn.cached_reply()
+        cached = ai_reply is not None
+        if not cached:
+            parser, ready = OrderStreamParser(), ReadyItemFilter()
+            chunks = []
+            for chunk in ai_service.stream_ai_response(turn.history, current_user, turn.locations, turn.tax_summary):
+                chunks.append(chunk)
+                visible = ready.feed(parser.feed(chunk))
+                if visible:
+                    push({"type": "delta", "text": visible})
+            tail = ready.feed(parser.flush()) + ready.flush()
+            if tail:
+                push({"type": "delta", "text": tail})
+            ai_reply = "".join(chunks)
+        response = turn.finish(ai_reply, current_user, _BackgroundThreads(), cached)
+        state["history"] = (turn.history + [f"البائع: {response['reply']}"])[-settings.WS_MAX_HISTORY:]
+        return response
+
+    if idempotency_key:
+        response, replayed = idempotency.run(TURN, current_user.code, idempotency_key, run, keep=_is_final)
+        if replayed:
+            # run() did not execute on this connection, so record the turn as it would have
+            state["history"] = (state["history"] + [f"العميل: {text}", f"البائع: {response['reply']}"])[-settings.WS_MAX_HISTORY:]
+    else:
+        response = run()
+    metrics.observe("chat.ws", time.perf_counter() - start)
+    return response
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket):
+    """Chat over one connection: history is kept server-side, replies stream, order events are pushed."""
+    await websocket.accept()
+    try:
+        auth = await asyncio.wait_for(websocket.receive_json(), timeout=settings.WS_AUTH_TIMEOUT_SECONDS)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        await websocket.close(code=WS_UNAUTHORIZED)
+        return
+    user = None
+    if isinstance(auth, dict) and auth.get("type") == "auth" and auth.get("token"):
+        user = await run_in_threadpool(_ws_authenticate, auth["token"])
+    if user is None:
+        await websocket.close(code=WS_UNAUTHORIZED)
+        return
+
+    history = [str(m) for m in auth.get("history") or []][-settings.WS_MAX_HISTORY:]
+    state = {"user_code": user.code, "history": history}
+    loop = asyncio.get_running_loop()
+    outbox = asyncio.Queue()  # turn deltas and pushed order events, sent in order
+    order_events.subscribe(user.code, loop, outbox)
+    metrics.incr("ws.connections")
+
+    def push(event):
+        loop.call_soon_threadsafe(outbox.put_nowait, event)
+
+    async def sender():
+        while True:
+            await websocket.send_json(await outbox.get())
+
+    send_task = asyncio.create_task(sender())
+    try:
+        await outbox.put({"type": "ready", "locations": prompt_compiler.locations(user)})
+        while True:
+            msg = await websocket.receive_json()
+            kind = msg.get("type") if isinstance(msg, dict) else None
+            if kind == "reset":
+                state["history"] = []
+            elif kind == "message" and str(msg.get("text") or "").strip():
+                key = str(msg["idempotency_key"])[:128] if msg.get("idempotency_key") else None
+                try:
+                    response = await run_in_threadpool(_ws_turn, state, str(msg["text"]), key, push)
+                except Exception as e:
+                    logger.error(f"WebSocket chat turn failed for {user.code}: {e}")
+                    response = {"reply": ai_service.AI_ERROR_REPLY, "order_placed": False}
+                if response is None:
+                    await websocket.close(code=WS_UNAUTHORIZED)
+                    return
+                await outbox.put({"type": "reply", **response})
+            else:
+                await outbox.put({"type": "error", "detail": "Expected {\"type\": \"message\", \"text\": ...}"})
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        order_events.unsubscribe(user.code, outbox)
+        send_task.cancel()
@@ -4,6 +4,7 @@ from typing import List
 
 from app.db import session, crud, models
 from app.schemas import location as loc_schema
+from app.services.prompt_compiler import prompt_compiler
 from app.api import deps
 
 router = APIRouter()
@@ -30,6 +31,7 @@ def delete_location(
     current_admin: models.User = Depends(deps.get_current_active_admin)
 ):
     if crud.delete_location(db, location_id):
+        prompt_compiler.invalidate()
         return {"msg": "Location deleted"}
     raise HTTPException(status_code=404, detail="Location not found")
 
@@ -40,7 +42,9 @@ def set_user_locations(
     db: Session = Depends(session.get_db),
     current_admin: models.User = Depends(deps.get_current_active_admin)
 ):
-    return crud.set_user_locations(db, user_code, loc_data.location_ids)
+    updated = crud.set_user_locations(db, user_code, loc_data.location_ids)
+    prompt_compiler.invalidate(user_code)
+    return updated
 
 @router.get("/my-locations", response_model=List[loc_schema.Location])
 def get_my_locations(
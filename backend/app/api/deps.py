@@ -14,6 +14,10 @@ def get_current_user(
     db: Session = Depends(session.get_db), 
     token: str = Depends(reusable_oauth2)
 ) -> models.User:
+    return get_user_from_token(db, token)
+
+def get_user_from_token(db: Session, token: str) -> models.User:
+    """The user a JWT belongs to; raises HTTPException (also used by the chat WebSocket)."""
     try:
         payload = jwt.decode(
             token, settings.JWT_SECRET_KEY, algorithms=[settings.ALGORITHM]
@@ -21,11 +21,60 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: Optional[str] = None
     GOOGLE_CREDENTIALS_JSON: Optional[str] = None
     GOOGLE_SHEET_NAME: str = "الشات والتصنيفات"
+    WARMUP_ON_STARTUP: bool = True  # init DB/Sheets/Gemini in a background thread at startup
+    SHEETS_INIT_RETRY_SECONDS: int = 30  # wait before retrying a failed Sheets init
+
+    # Order storage: comma-separated sinks, first is primary, the rest replicate in the background
+    # ("sheets", "sql", "jsonl"), e.g. "sql,sheets" commits locally and replicates to Sheets.
+    ORDER_SINKS: str = "sheets"
+    ORDER_SINK_JSONL_PATH: str = "orders.jsonl"
+    IDEMPOTENCY_WINDOW_SECONDS: int = 1800  # a repeated Idempotency-Key within this returns the first result
+    IDEMPOTENCY_RETRY_SECONDS: int = 300  # same order from the same turn without a key (a client retry) within this
+    IDEMPOTENCY_WAIT_SECONDS: int = 120  # max wait for the in-flight request with the same key
+
+    # Chat prompt
+    CHAT_HISTORY_TOKEN_BUDGET: int = 4000  # estimated tokens of verbatim history per prompt
+    ORDER_OUTPUT_FORMAT: str = "json"  # "json" (schema-validated) or "pipe" (legacy)
+    TAXONOMY_TOP_K: int = 15  # taxonomy rows injected per chat turn / classification
+    CLASSIFY_WORKERS: int = 4  # concurrent Gemini classification calls; keep within the API quota
+    TAXONOMY_LEARN_BATCH_SIZE: int = 20  # learned sub-categories per "الاساسي" append
+    TAXONOMY_LEARN_FLUSH_SECONDS: float = 10.0  # max delay before learned rows are written
+    SPECULATIVE_CLASSIFICATION: bool = True  # classify items as soon as the chat marks them complete
+    SPECULATIVE_TTL_SECONDS: int = 1800  # unclaimed speculative results are dropped after this
+    RESPONSE_CACHE_MAX_ENTRIES: int = 500  # cached replies for opening turns (0 disables)
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    RESPONSE_CACHE_MAX_HISTORY: int = 2  # earlier messages allowed for a turn to be cacheable
+    TAXONOMY_CACHE_TTL_SECONDS: int = 300  # jittered +/-10% so workers do not refresh together
+    TAXONOMY_CACHE_STALE_SECONDS: int = 600  # stale taxonomy served while one background refresh runs
+    PROMPT_CACHE_MAX_USERS: int = 1000  # users whose rendered prompt suffix is kept
+    PROMPT_CACHE_TTL_SECONDS: int = 300  # bounds staleness of cached locations across workers
+
+    # Upstream circuit breakers (Gemini, Sheets)
+    BREAKER_FAILURE_THRESHOLD: int = 5  # consecutive failures before the circuit opens
+    BREAKER_RESET_SECONDS: float = 30.0  # open time before a half-open probe
+    DEGRADED_ORDER_MODE: bool = True  # store orders locally while Sheets is down, replay later
+
+    # Gemini transport: "live", "record" (live, and save every response) or "replay" (offline, from the recordings)
+    LLM_MODE: str = "live"
+    LLM_RECORDINGS_PATH: str = "llm_recordings.jsonl"  # prompt hash -> response, one JSON object per line
+    LLM_REPLAY_LATENCY_MS: float = 0  # simulated model latency in replay mode
+
+    # Chat WebSocket
+    WS_AUTH_TIMEOUT_SECONDS: float = 10.0  # the auth message must arrive within this after connecting
+    WS_MAX_HISTORY: int = 200  # conversation messages kept server-side per connection
     
     # Admin
     ADMIN_BOOTSTRAP_CODE: Optional[str] = None
     ADMIN_OTP_EMAIL: Optional[str] = None
 
+    # Bulk import
+    BULK_CHUNK_SIZE: int = 200
+    BULK_HASH_WORKERS: Optional[int] = None  # defaults to CPU count
+
+    # Admin metrics (in-memory, per process)
+    METRICS_SAMPLE_SIZE: int = 512  # latency samples kept per operation
+    METRICS_WINDOW_HOURS: int = 48  # hourly order buckets kept
+
     # Email (Gmail SMTP)
     SMTP_HOST: str = "smtp.gmail.com"
     SMTP_PORT: int = 587
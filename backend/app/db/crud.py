@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, selectinload
 from app.db import models
 from app.core.security import get_password_hash
 from app.core.config import settings
@@ -13,6 +14,23 @@ def get_user_by_code(db: Session, code: str):
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
+def _users_query(db: Session, search: str = None):
+    query = db.query(models.User)
+    if search:
+        pattern = f"%{search.strip()}%"
+        query = query.filter(or_(models.User.name.ilike(pattern), models.User.phone.ilike(pattern)))
+    return query
+
+def get_users_page(db: Session, after_code: str = None, limit: int = 100, search: str = None):
+    """Keyset page of users ordered by code, with locations eager-loaded in one extra query."""
+    query = _users_query(db, search).options(selectinload(models.User.locations))
+    if after_code:
+        query = query.filter(models.User.code > after_code)
+    return query.order_by(models.User.code).limit(limit).all()
+
+def count_users(db: Session, search: str = None) -> int:
+    return _users_query(db, search).count()
+
 def create_user(db: Session, code: str, name: str, phone: str, is_admin: int = 0):
     db_user = models.User(
         code=code,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.db.session import Base
 
@@ -28,3 +28,90 @@ class Location(Base):
     name = Column(String, unique=True, nullable=False)
 
     users = relationship("User", secondary=user_locations, back_populates="locations")
+
+# Local mirrors of the append-only Google Sheets worksheets.
+# sheet_row is the 1-based row in the worksheet; NULL until a local insert is pushed.
+class SheetOrderRow(Base):
+    __tablename__ = "sheet_orders"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sheet_row = Column(Integer, unique=True, nullable=True)
+    order_num = Column(Integer, index=True)
+    timestamp = Column(String, index=True)
+    customer_name = Column(String)
+    phone = Column(String)
+    location = Column(String)
+    summary = Column(Text)
+    category = Column(String)
+    short_desc = Column(Text)
+    quantity = Column(String)
+    unit = Column(String)
+    tech_desc = Column(Text)
+    synced = Column(Integer, default=1, index=True)
+
+class SheetClassificationRow(Base):
+    __tablename__ = "sheet_classifications"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sheet_row = Column(Integer, unique=True, nullable=True)
+    item_id = Column(String, index=True)
+    original = Column(Text)
+    basic_ar = Column(String)
+    basic_en = Column(String)
+    main_ar = Column(String)
+    main_en = Column(String)
+    sub_ar = Column(String)
+    sub_en = Column(String)
+    sub_key = Column(String, index=True)  # taxonomy_learner.sub_key(sub_en), as in the code index
+    spec1_name = Column(String)
+    spec1_val = Column(String)
+    spec2_name = Column(String)
+    spec2_val = Column(String)
+    spec3_name = Column(String)
+    spec3_val = Column(String)
+    code = Column(String, index=True)
+    classified_at = Column(String, index=True)
+    synced = Column(Integer, default=1, index=True)
+
+class SheetSyncState(Base):
+    __tablename__ = "sheet_sync_state"
+
+    worksheet = Column(String, primary_key=True)
+    last_row = Column(Integer, default=1)  # last worksheet row mirrored (1 = header)
+    last_synced_at = Column(String, nullable=True)
+
+# Canonical product codes: one stable base code per sub-category and one final
+# code per (base code, normalized spec values). Filled by backfill_codes.py and
+# by classification as new products appear.
+class ProductBaseCode(Base):
+    __tablename__ = "product_base_codes"
+
+    sub_key = Column(String, primary_key=True)  # normalized sub_en
+    sub_en = Column(String)
+    base_code = Column(String, unique=True, nullable=False)
+    created_at = Column(String)
+
+class ProductCode(Base):
+    __tablename__ = "product_codes"
+    __table_args__ = (UniqueConstraint("base_code", "spec_key", name="uq_product_codes_base_specs"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    base_code = Column(String, nullable=False)
+    spec_key = Column(String, nullable=False)  # normalized spec1|spec2|spec3 values
+    code = Column(String, index=True, nullable=False)
+    created_at = Column(String)
+
+# First result of an order save or chat turn, so a retried submission gets it back
+# instead of writing again. kind "order": key is the content hash of the extracted
+# order and value its order number; kind "turn": key is the client's Idempotency-Key
+# and value the JSON chat response.
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+    __table_args__ = (UniqueConstraint("kind", "user_code", "key", name="uq_idempotency_kind_user_key"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    user_code = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    value = Column(Text)
+    created_at = Column(String, index=True)
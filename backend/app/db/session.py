@@ -1,4 +1,5 @@
 import logging
+import threading
 from pathlib import Path
 
 from sqlalchemy import event, create_engine
@@ -55,7 +56,32 @@ def ensure_schema():
         # Existing DBs might need manual migration depending on the engine.
         logger.exception("ensure_schema_failed")
 
+_db_ready = False
+_db_ready_lock = threading.Lock()
+
+def ensure_db():
+    """
+    Schema checks, create_all and seed data, run once on first use instead of at import.
+    A failure leaves the flag unset so the next request retries.
+    """
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_ready_lock:
+        if _db_ready:
+            return
+        from app.db import crud, models
+        ensure_schema()
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            crud.init_db_data(db)
+        finally:
+            db.close()
+        _db_ready = True
+
 def get_db():
+    ensure_db()
     db = SessionLocal()
     try:
         yield db
@@ -1,9 +1,13 @@
+import logging
+import threading
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 from app.api.api_v1.api import api_router
 from app.core.config import settings
-from app.db import session, crud, models
-from app.services.sheets_service import init_google_sheets
+from app.db import session
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -21,20 +25,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database Setup (Create tables if they don't exist)
-session.ensure_schema()
-models.Base.metadata.create_all(bind=session.engine)
+def warmup():
+    """Initialize the database, Sheets and Gemini ahead of the first request that needs them.
+
+    Each of these is also initialized lazily on first use, so a cold start can
+    serve requests before (or without) this finishing.
+    """
+    from app.services import ai_service, sheets_service
+    steps = [
+        ("database", session.ensure_db),
+        ("sheets", sheets_service.get_worksheet),
+        ("gemini", ai_service.get_model),
+    ]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Warmup step '{name}' failed: {e}")
 
 @app.on_event("startup")
 def on_startup():
-    # Seed data
-    db = session.SessionLocal()
-    try:
-        crud.init_db_data(db)
-        # Init services
-        init_google_sheets()
-    finally:
-        db.close()
+    if settings.WARMUP_ON_STARTUP:
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
 
 # Include API Router
 app.include_router(api_router, prefix=settings.API_V1_STR)
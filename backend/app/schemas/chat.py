@@ -1,9 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 class ChatRequest(BaseModel):
     message: str
     history: List[str]
+    # Same key on a retry returns the first response (also accepted as the Idempotency-Key header)
+    idempotency_key: Optional[str] = Field(None, max_length=128)
 
 class ChatResponse(BaseModel):
     reply: str
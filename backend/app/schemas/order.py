@@ -0,0 +1,63 @@
+from typing import List
+from pydantic import BaseModel, Field, field_validator
+
+# Order block emitted by the chat model between ###DATA_START### and ###DATA_END###
+class OrderItem(BaseModel):
+    category: str = ""
+    product: str
+    spec1_name: str = ""
+    spec1_value: str = ""
+    spec2_name: str = ""
+    spec2_value: str = ""
+    spec3_name: str = ""
+    spec3_value: str = ""
+    quantity: str = ""
+    unit: str = ""
+    tech_desc: str = ""
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def coerce_text(cls, v):
+        # Models sometimes emit quantities as numbers or null specs
+        if v is None:
+            return ""
+        if isinstance(v, bool):
+            raise ValueError("expected text or a number, got a boolean")
+        if isinstance(v, int):
+            return str(v)
+        if isinstance(v, float):
+            # Plain decimal, never scientific notation: 1000000.0 -> "1000000", 2.50 -> "2.5"
+            return format(v, "f").rstrip("0").rstrip(".") or "0"
+        return str(v).strip()
+
+    @field_validator("product")
+    @classmethod
+    def product_required(cls, v: str) -> str:
+        if not v:
+            raise ValueError("product is required")
+        return v
+
+class Order(BaseModel):
+    items: List[OrderItem] = Field(min_length=1)
+    location: str = Field(min_length=3)
+
+    @field_validator("location", mode="before")
+    @classmethod
+    def strip_location(cls, v):
+        return str(v or "").strip()
+
+    def to_order_data(self) -> dict:
+        """Convert to the dict shape consumed by sheets_service.save_to_sheet."""
+        items = []
+        for it in self.items:
+            tech_desc = it.tech_desc or " ".join(
+                x for x in [it.product, it.spec1_value, it.spec2_value, it.spec3_value, it.quantity, it.unit] if x
+            )
+            items.append({
+                "cat": it.category, "item": it.product,
+                "s1_n": it.spec1_name, "s1_v": it.spec1_value,
+                "s2_n": it.spec2_name, "s2_v": it.spec2_value,
+                "s3_n": it.spec3_name, "s3_v": it.spec3_value,
+                "qty": it.quantity, "unit": it.unit, "tech_desc": tech_desc,
+            })
+        return {"items": items, "c": {"a": self.location}}
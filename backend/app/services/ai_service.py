@@ -1,22 +1,46 @@
-import google.generativeai as genai
 import logging
 import re
-import os
+import threading
 import time
 from app.core.config import settings
+from app.services.chat_context import history_window
+from app.services.circuit_breaker import CircuitOpenError, gemini_breaker
+from app.services.llm_transport import REPLAY, wrap_model
+from app.services.metrics import metrics, is_rate_limit_error
+from app.services.order_parser import OrderStreamParser
+from app.services.prompt_compiler import prompt_compiler
 
 logger = logging.getLogger(__name__)
 
 model = None
-
-try:
-    if settings.GEMINI_API_KEY:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-    else:
-        logger.warning("⚠️ GEMINI_API_KEY not found. AI features will be disabled.")
-except Exception as e:
-    logger.error(f"❌ Failed to initialize Gemini: {e}")
+_model_lock = threading.Lock()
+_model_checked = False
+
+def get_model():
+    """Shared Gemini model, configured on first use (importing the SDK alone takes ~1s).
+
+    Wrapped for LLM_MODE: responses are recorded, or replayed without the SDK or an API key.
+    """
+    global model, _model_checked
+    if _model_checked:
+        return model
+    with _model_lock:
+        if _model_checked:
+            return model
+        try:
+            if settings.LLM_MODE == REPLAY:
+                logger.info(f"LLM_MODE=replay: Gemini responses come from {settings.LLM_RECORDINGS_PATH}")
+            elif settings.GEMINI_API_KEY:
+                import google.generativeai as genai
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                model = genai.GenerativeModel('gemini-2.5-flash')
+            else:
+                logger.warning("⚠️ GEMINI_API_KEY not found. AI features will be disabled.")
+            model = wrap_model(model)
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize Gemini: {e}")
+        _model_checked = True
+    return model
 
 SYSTEM_PROMPT = """أنت بائع سعودي محترف خبير في مواد البناء، الأدوات المكتبية، أجهزة الكمبيوتر، والأجهزة اللاسلكية. أسلوبك ودود ومختصر.
 
@@ -41,6 +65,9 @@ SYSTEM_PROMPT = """أنت بائع سعودي محترف خبير في مواد
 8. أدمج **كل** ما ذكره العميل (الأساسية + الإضافية) في خانة "وصف_فني_كامل".
 9. **طلبات متعددة:** لو العميل طلب أكثر من منتج في نفس المحادثة، اجمع مواصفات كل منتج على حدة (واحد واحد)، وعند اكتمال كل صنف (المواصفات + الكمية) اسأله: "هل لديك أي طلبات لمواد أخرى تود إضافتها قبل تحديد الموقع؟". إذا قال "لا"، اطلب الموقع.
 10. سجّر **كل الأصناف** التي تم جمعها في صيغة الحفظ النهائية (كل صنف في سطر منفصل داخل ITEMS).
+11. **إشارة اكتمال الصنف (مخفية عن العميل):** في الرسالة التي تكتمل فيها مواصفات صنف (كل المواصفات الأساسية + الكمية) لأول مرة، أضف في آخر رسالتك سطراً مستقلاً لكل صنف اكتمل بالشكل:
+   `###ITEM_READY### [وصف_فني_كامل]`
+   واكتب فيه نفس الوصف الفني الكامل الذي ستضعه لهذا الصنف في صيغة الحفظ حرفياً. لا تكرر السطر لنفس الصنف في الرسائل التالية، ولا تضعه في رسالة الحفظ النهائية.
 
 **ممنوعات:**
 - ممنوع ذكر الأسعار أو طلب الاسم أو الجوال من العميل (متوفران تلقائياً).
@@ -79,7 +106,10 @@ SYSTEM_PROMPT = """أنت بائع سعودي محترف خبير في مواد
 👤 [الاسم] | [الجوال] | [الموقع]
 ```
 
-**صيغة الحفظ الإلزامية — ضعها مباشرة بعد الملخص في نفس الرسالة دون فاصل (يجب أن لا تُغفل هذه الخطوة أبداً):**
+"""
+
+# Legacy save format: pipe-separated ITEMS lines plus a CUSTOMER block
+PIPE_SAVE_FORMAT = """**صيغة الحفظ الإلزامية — ضعها مباشرة بعد الملخص في نفس الرسالة دون فاصل (يجب أن لا تُغفل هذه الخطوة أبداً):**
 ###DATA_START###
 ITEMS:
 فئة|منتج|اسم_مواصفة1|قيمة_مواصفة1|اسم_مواصفة2|قيمة_مواصفة2|اسم_مواصفة3|قيمة_مواصفة3|كمية|وحدة|وصف_فني_كامل
@@ -92,39 +122,116 @@ CUSTOMER:
 ###DATA_END###
 """
 
+# Structured save format: one JSON object validated against app.schemas.order.Order
+JSON_SAVE_FORMAT = """**صيغة الحفظ الإلزامية — ضعها مباشرة بعد الملخص في نفس الرسالة دون فاصل (يجب أن لا تُغفل هذه الخطوة أبداً):**
+بين العلامتين ضع كائن JSON واحد صالح فقط (بدون ``` وبدون أي نص آخر)، كل صنف عنصر في items، و location هو اسم الموقع من القائمة حرفياً:
+###DATA_START###
+{"items": [{"category": "بناء", "product": "ماسورة", "spec1_name": "خامة", "spec1_value": "PVC", "spec2_name": "قطر", "spec2_value": "4 بوصة", "spec3_name": "الضغط", "spec3_value": "10 بار", "quantity": "10", "unit": "حبة", "tech_desc": "ماسورة PVC قطر 4 بوصة ضغط 10 بار طول 6 متر"}, {"category": "مكتبي", "product": "ورق", "spec1_name": "مقاس", "spec1_value": "A4", "spec2_name": "نوع", "spec2_value": "60 جرام", "spec3_name": "", "spec3_value": "", "quantity": "10", "unit": "كرتون", "tech_desc": "ورق تصوير A4 60 جرام أبيض"}], "location": "[اسم الموقع من القائمة]"}
+###DATA_END###
+"""
+
+SAVE_FORMATS = {"pipe": PIPE_SAVE_FORMAT, "json": JSON_SAVE_FORMAT}
+
+AI_UNAVAILABLE_REPLY = "AI Unavailable"
+AI_ERROR_REPLY = "معليش، صار خطأ في النظام. يرجى إعادة محاولة الجملة الأخيرة 🙏"
+AI_BUSY_REPLY = "معليش، النظام مشغول حالياً. جرّب بعد دقيقة 🙏"
+FALLBACK_REPLIES = (AI_UNAVAILABLE_REPLY, AI_ERROR_REPLY, AI_BUSY_REPLY)
+
+
+def _build_conversation(history, user_info, allowed_locations, taxonomy_summary):
+    # Keep recent turns verbatim within the token budget; older ones are folded into a running summary
+    history_summary, recent_history = history_window.build(user_info.code, history)
+
+    # The per-user part of the prompt (locations, save format, customer info) is pre-rendered and cached
+    return prompt_compiler.build(
+        user_info, allowed_locations, taxonomy_summary, history_summary, recent_history, settings.ORDER_OUTPUT_FORMAT
+    )
+
+
 def get_ai_response(history, user_info, allowed_locations=None, taxonomy_summary=""):
-    customer_info_for_prompt = f"الاسم: {user_info.name}\nالجوال: {user_info.phone}\n"
-    
-    current_prompt = SYSTEM_PROMPT.replace("{{TAXONOMY_SUMMARY}}", taxonomy_summary or "لا توجد قيود إضافية.")
-    
-    if allowed_locations:
-        allowed_str = ", ".join(allowed_locations)
-        current_prompt = current_prompt.replace("{{ALLOWED_LOCATIONS}}", allowed_str)
-    else:
-        current_prompt = current_prompt.replace("{{ALLOWED_LOCATIONS}}", "لا توجد مواقع مقيدة")
-    
-    MAX_HISTORY = 40
-    trimmed_history = history[-MAX_HISTORY:] if len(history) > MAX_HISTORY else history
-    
-    conversation = current_prompt + "\n" + customer_info_for_prompt + "\n".join(trimmed_history) + "\nالبائع:"
+    conversation = _build_conversation(history, user_info, allowed_locations, taxonomy_summary)
     
     max_retries = 3
     retry_delay = 2
     
     for attempt in range(max_retries):
         try:
-            if not model: return "AI Unavailable"
+            model = get_model()
+            if not model: return AI_UNAVAILABLE_REPLY
             
-            gen_config = genai.types.GenerationConfig(max_output_tokens=10240, temperature=0.5)
-            response = model.generate_content(conversation, generation_config=gen_config)
+            gen_config = {"max_output_tokens": 10240, "temperature": 0.5}
+            with metrics.timed("gemini.chat"):
+                response = gemini_breaker.call(model.generate_content, conversation, generation_config=gen_config)
             return response.text.strip()
+        except CircuitOpenError as e:
+            # Gemini is failing: answer now instead of tying up the worker with retries
+            logger.warning(f"AI fast-fail: {e}")
+            return AI_BUSY_REPLY
         except Exception as e:
             logger.error(f"AI Error (Attempt {attempt+1}): {e}")
+            if is_rate_limit_error(e):
+                metrics.incr("gemini.429")
             if attempt < max_retries -1:
                 time.sleep(retry_delay)
                 retry_delay += 2
                 continue
-            return "معليش، صار خطأ في النظام. يرجى إعادة محاولة الجملة الأخيرة 🙏"
+            return AI_ERROR_REPLY
+
+def stream_ai_response(history, user_info, allowed_locations=None, taxonomy_summary=""):
+    """Like get_ai_response, but yields the reply in chunks as Gemini produces them.
+
+    Retries only happen before the first chunk. Fallback replies are yielded
+    as a single chunk; a stream that breaks halfway ends early.
+    """
+    conversation = _build_conversation(history, user_info, allowed_locations, taxonomy_summary)
+    gen_config = {"max_output_tokens": 10240, "temperature": 0.5}
+    retry_delay = 2
+
+    for attempt in range(3):
+        emitted = False
+        try:
+            model = get_model()
+            if not model:
+                yield AI_UNAVAILABLE_REPLY
+                return
+            if not gemini_breaker.allow():
+                raise CircuitOpenError(gemini_breaker.name, gemini_breaker.retry_in())
+            # Errors while iterating count as breaker failures too: a failing upstream often
+            # accepts the request and only breaks once the stream is read
+            with metrics.timed("gemini.chat"):
+                try:
+                    response = model.generate_content(conversation, generation_config=gen_config, stream=True)
+                    for chunk in response:
+                        try:
+                            text = chunk.text
+                        except ValueError:
+                            continue  # chunk without text parts (e.g. the final one with the finish reason)
+                        if text:
+                            if not emitted:
+                                gemini_breaker.record_success()
+                            emitted = True
+                            yield text
+                except Exception:
+                    gemini_breaker.record_failure()
+                    raise
+            if not emitted:
+                gemini_breaker.record_success()
+            return
+        except CircuitOpenError as e:
+            logger.warning(f"AI fast-fail: {e}")
+            yield AI_BUSY_REPLY
+            return
+        except Exception as e:
+            logger.error(f"AI stream error (Attempt {attempt+1}): {e}")
+            if is_rate_limit_error(e):
+                metrics.incr("gemini.429")
+            if emitted:
+                return
+            if attempt < 2:
+                time.sleep(retry_delay)
+                retry_delay += 2
+                continue
+            yield AI_ERROR_REPLY
 
 def normalize_arabic(text):
     text = re.sub("[إأآا]", "ا", text)
@@ -134,53 +241,6 @@ def normalize_arabic(text):
     return text
 
 def extract_order_data(text: str, allowed_locations: list = None) -> dict:
-    try:
-        if "###DATA_START###" not in text: return None
-        data_block = text.split("###DATA_START###")[1].split("###DATA_END###")[0].strip()
-        
-        items = []
-        parts = data_block.split("CUSTOMER:")
-        if len(parts) < 2: return None
-
-        items_part = parts[0].replace("ITEMS:", "").strip()
-        cust_part = parts[1].strip()
-        
-        for line in items_part.split("\n"):
-            if "|" in line and "فئة|" not in line:
-                p = [x.strip() for x in line.split("|")]
-                if len(p) >= 5:
-                    cat = p[0]
-                    item = p[1]
-                    s1_name = p[2] if len(p) > 2 else ""
-                    s1_val = p[3] if len(p) > 3 else ""
-                    s2_name = p[4] if len(p) > 4 else ""
-                    s2_val = p[5] if len(p) > 5 else ""
-                    s3_name = p[6] if len(p) > 6 else ""
-                    s3_val = p[7] if len(p) > 7 else ""
-                    qty = p[8] if len(p) >= 9 else ""
-                    unit = p[9] if len(p) >= 10 else ""
-                    
-                    if len(p) >= 11:
-                        full_tech_desc = " ".join([part.strip() for part in p[10:] if part.strip()]).strip()
-                    else:
-                        parts_list = [item, s1_val, s2_val]
-                        if s3_val: parts_list.append(s3_val)
-                        parts_list.extend([qty, unit])
-                        full_tech_desc = " ".join([x for x in parts_list if x]).strip()
-                    
-                    items.append({
-                        "cat": cat, "item": item, 
-                        "s1_n": s1_name, "s1_v": s1_val, 
-                        "s2_n": s2_name, "s2_v": s2_val, 
-                        "s3_n": s3_name, "s3_v": s3_val,
-                        "qty": qty, "unit": unit, "tech_desc": full_tech_desc
-                    })
-        
-        addr = re.search(r"العنوان:\s*(.+)", cust_part)
-        if addr and items and len(addr.group(1).strip()) > 2:
-            location = addr.group(1).strip()
-            return {"items": items, "c": {"a": location}}
-        return None
-    except Exception as e: 
-        logger.error(f"Extract error: {e}")
-        return None
+    parser = OrderStreamParser()
+    parser.feed(text)
+    return parser.finish(allowed_locations)
@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy import delete, insert
+
+from app.core.config import settings
+from app.core.security import get_password_hash
+from app.db import models, session
+from app.schemas import user as user_schema
+
+logger = logging.getLogger(__name__)
+
+_hash_pool = None
+
+CSV_FIELDS = ["code", "name", "phone", "is_admin", "locations"]
+
+
+def _get_hash_pool():
+    """bcrypt releases the GIL while hashing, so a thread pool scales with cores."""
+    global _hash_pool
+    if _hash_pool is None:
+        workers = settings.BULK_HASH_WORKERS or os.cpu_count() or 4
+        _hash_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-hash")
+    return _hash_pool
+
+
+def _split_locations(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [v for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).replace(";", "|").split("|") if v.strip()]
+
+
+def parse_rows(raw: bytes, content_type: str) -> list:
+    """Parse an uploaded CSV or JSON payload into a list of row dicts."""
+    text = raw.decode("utf-8-sig")
+    if "json" in (content_type or "") or text.lstrip().startswith(("[", "{")):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("users") or data.get("rows") or []
+        if not isinstance(data, list):
+            raise ValueError("JSON payload must be a list of rows")
+        return [row for row in data if isinstance(row, dict)]
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def _resolve_locations(db, rows) -> dict:
+    """Map location names and ids mentioned in rows to Location ids, in one query."""
+    by_name, by_id = {}, {}
+    for loc in db.query(models.Location).all():
+        by_name[loc.name.strip()] = loc.id
+        by_id[str(loc.id)] = loc.id
+    resolved = {}
+    for ref in {str(v).strip() for row in rows for v in _split_locations(row.get("locations") or row.get("location_ids"))}:
+        if ref in by_name:
+            resolved[ref] = by_name[ref]
+        elif ref in by_id:
+            resolved[ref] = by_id[ref]
+    return resolved
+
+
+def _location_ids(row, resolved):
+    refs = [str(v).strip() for v in _split_locations(row.get("locations") or row.get("location_ids"))]
+    ids = sorted({resolved[r] for r in refs if r in resolved})
+    missing = [r for r in refs if r not in resolved]
+    return ids, missing
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def import_users(rows: list, chunk_size: int = None):
+    """Create users (and their location links) in chunked transactions.
+
+    Yields one report dict per input row, then a final summary dict.
+    """
+    chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+    counts = {"created": 0, "skipped": 0, "error": 0}
+    seen = set()
+    db = session.SessionLocal()
+    try:
+        resolved = _resolve_locations(db, rows)
+        indexed = list(enumerate(rows, start=1))
+        for chunk in _chunks(indexed, chunk_size):
+            valid, reports = [], {}
+            for row_num, row in chunk:
+                try:
+                    user_in = user_schema.UserCreate(
+                        code=str(row.get("code") or "").strip(),
+                        name=str(row.get("name") or "").strip(),
+                        phone=str(row.get("phone") or "").strip(),
+                        is_admin=int(row.get("is_admin") or 0),
+                    )
+                except ValidationError as e:
+                    err = e.errors()[0]
+                    field = ".".join(str(p) for p in err.get("loc", ()))
+                    reports[row_num] = {"row": row_num, "code": row.get("code"), "status": "error", "detail": f"{field}: {err.get('msg')}"}
+                    continue
+                except ValueError as e:
+                    reports[row_num] = {"row": row_num, "code": row.get("code"), "status": "error", "detail": str(e)}
+                    continue
+                if not user_in.code:
+                    reports[row_num] = {"row": row_num, "code": "", "status": "error", "detail": "Missing code"}
+                elif user_in.code in seen:
+                    reports[row_num] = {"row": row_num, "code": user_in.code, "status": "skipped", "detail": "Duplicate code in upload"}
+                else:
+                    seen.add(user_in.code)
+                    valid.append((row_num, row, user_in))
+
+            codes = [u.code for _, _, u in valid]
+            existing = {c for (c,) in db.query(models.User.code).filter(models.User.code.in_(codes))} if codes else set()
+            to_create = []
+            for row_num, row, user_in in valid:
+                if user_in.code in existing:
+                    reports[row_num] = {"row": row_num, "code": user_in.code, "status": "skipped", "detail": "User already exists"}
+                else:
+                    to_create.append((row_num, row, user_in))
+
+            hashes = list(_get_hash_pool().map(get_password_hash, [u.code for _, _, u in to_create]))
+            user_values, link_values = [], []
+            for (row_num, row, user_in), secret_hash in zip(to_create, hashes):
+                user_values.append({**user_in.model_dump(), "secret_hash": secret_hash})
+                loc_ids, missing = _location_ids(row, resolved)
+                link_values.extend({"user_code": user_in.code, "location_id": loc_id} for loc_id in loc_ids)
+                report = {"row": row_num, "code": user_in.code, "status": "created", "locations": loc_ids}
+                if missing:
+                    report["detail"] = f"Unknown locations: {', '.join(missing)}"
+                reports[row_num] = report
+
+            if user_values:
+                try:
+                    db.execute(insert(models.User), user_values)
+                    if link_values:
+                        db.execute(insert(models.user_locations), link_values)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    logger.exception("bulk_import_chunk_failed")
+                    for row_num, _, user_in in to_create:
+                        reports[row_num] = {"row": row_num, "code": user_in.code, "status": "error", "detail": f"Write failed: {e.__class__.__name__}"}
+
+            for row_num, _ in chunk:
+                report = reports[row_num]
+                counts[report["status"]] += 1
+                yield report
+    finally:
+        db.close()
+    yield {"summary": {"total": len(rows), **counts}}
+
+
+def import_user_locations(rows: list, chunk_size: int = None):
+    """Replace location assignments for many users, one transaction per chunk.
+
+    Yields one report dict per input row, then a final summary dict.
+    """
+    chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+    counts = {"updated": 0, "error": 0}
+    db = session.SessionLocal()
+    try:
+        resolved = _resolve_locations(db, rows)
+        indexed = list(enumerate(rows, start=1))
+        for chunk in _chunks(indexed, chunk_size):
+            codes = [str(row.get("code") or "").strip() for _, row in chunk]
+            existing = {c for (c,) in db.query(models.User.code).filter(models.User.code.in_(codes))}
+            reports, updated_codes, link_values = {}, [], []
+            for (row_num, row), code in zip(chunk, codes):
+                if code not in existing:
+                    reports[row_num] = {"row": row_num, "code": code, "status": "error", "detail": "User not found"}
+                    continue
+                loc_ids, missing = _location_ids(row, resolved)
+                updated_codes.append(code)
+                link_values.extend({"user_code": code, "location_id": loc_id} for loc_id in loc_ids)
+                report = {"row": row_num, "code": code, "status": "updated", "locations": loc_ids}
+                if missing:
+                    report["detail"] = f"Unknown locations: {', '.join(missing)}"
+                reports[row_num] = report
+
+            if updated_codes:
+                try:
+                    db.execute(delete(models.user_locations).where(models.user_locations.c.user_code.in_(updated_codes)))
+                    if link_values:
+                        db.execute(insert(models.user_locations), link_values)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    logger.exception("bulk_locations_chunk_failed")
+                    for row_num, _ in chunk:
+                        if reports[row_num]["status"] == "updated":
+                            reports[row_num] = {"row": row_num, "code": reports[row_num]["code"], "status": "error", "detail": f"Write failed: {e.__class__.__name__}"}
+
+            for row_num, _ in chunk:
+                report = reports[row_num]
+                counts[report["status"]] += 1
+                yield report
+    finally:
+        db.close()
+    yield {"summary": {"total": len(rows), **counts}}
+
+
+def export_users(fmt: str = "csv", page_size: int = 500):
+    """Stream every user with their location names, walking the keyset index."""
+    from app.db import crud
+
+    db = session.SessionLocal()
+    try:
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(CSV_FIELDS)
+            yield buf.getvalue()
+        after = None
+        while True:
+            page = crud.get_users_page(db, after_code=after, limit=page_size)
+            if not page:
+                break
+            for u in page:
+                loc_names = [loc.name for loc in u.locations]
+                if fmt == "csv":
+                    buf = io.StringIO()
+                    csv.writer(buf).writerow([u.code, u.name, u.phone, u.is_admin, "|".join(loc_names)])
+                    yield buf.getvalue()
+                else:
+                    yield json.dumps({"code": u.code, "name": u.name, "phone": u.phone,
+                                      "is_admin": u.is_admin, "locations": loc_names}, ensure_ascii=False) + "\n"
+            after = page[-1].code
+            db.expunge_all()
+    finally:
+        db.close()
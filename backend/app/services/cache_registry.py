@@ -0,0 +1,128 @@
+import logging
+import threading
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CacheNotSupported(Exception):
+    """The cache does not support the requested operation (e.g. warming)."""
+
+
+class CacheEntry:
+    def __init__(self, name, stats, invalidate, warm=None, metric=None, description=""):
+        self.name = name
+        self.description = description
+        self._stats = stats
+        self._invalidate = invalidate
+        self._warm = warm
+        self.metric = metric  # name passed to metrics.cache(), for the hit rate
+
+    def stats(self):
+        stats = {"description": self.description, **self._stats()}
+        if self.metric:
+            stats.update(metrics.cache_stats(self.metric))
+        stats["warmable"] = self._warm is not None
+        return stats
+
+
+class CacheRegistry:
+    """Named in-process caches that admins can inspect, invalidate and warm.
+
+    Entries are registered on first use with lazy imports, so looking at the
+    registry does not pull in the services it describes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def register(self, name, stats, invalidate, warm=None, metric=None, description=""):
+        self._entries[name] = CacheEntry(name, stats, invalidate, warm, metric, description)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                _register_defaults(self)
+                self._loaded = True
+
+    def get(self, name):
+        """The entry for name; raises KeyError for unknown caches."""
+        self._ensure_loaded()
+        return self._entries[name]
+
+    def stats(self):
+        self._ensure_loaded()
+        return {name: entry.stats() for name, entry in self._entries.items()}
+
+    def invalidate(self, name):
+        entry = self.get(name)
+        entry._invalidate()
+        metrics.incr(f"cache.{name}.invalidated")
+        logger.info(f"Cache '{name}' invalidated")
+        return entry.stats()
+
+    def warm(self, name):
+        entry = self.get(name)
+        if entry._warm is None:
+            raise CacheNotSupported(f"Cache '{name}' cannot be warmed")
+        loaded = entry._warm()
+        logger.info(f"Cache '{name}' warmed ({loaded})")
+        return {"warmed": loaded, **entry.stats()}
+
+
+def _spreadsheet():
+    from app.services import sheets_service
+    ws = sheets_service.get_worksheet()
+    if ws is None:
+        raise RuntimeError("Google Sheets is not available")
+    return ws.spreadsheet
+
+
+def _register_defaults(registry):
+    from app.services import classifier, code_index, sheet_mirror
+    from app.services.idempotency import idempotency
+    from app.services.prompt_compiler import prompt_compiler
+    from app.services.response_cache import response_cache
+
+    def warm_taxonomy():
+        classifier.refresh_taxonomy(_spreadsheet())
+        return classifier.taxonomy_cache_stats()["rows"]
+
+    def classifications_ws():
+        return _spreadsheet().worksheet(sheet_mirror.CLASSIFICATIONS_WORKSHEET)
+
+    registry.register(
+        "taxonomy", classifier.taxonomy_cache_stats, classifier.invalidate_taxonomy, warm_taxonomy,
+        metric="taxonomy", description='"الاساسي" snapshot, summary and retrieval index',
+    )
+    registry.register(
+        "classifications",
+        lambda: sheet_mirror.stats(sheet_mirror.CLASSIFICATIONS_WORKSHEET),
+        lambda: sheet_mirror.resync(classifications_ws()),
+        lambda: sheet_mirror.pull(classifications_ws()),
+        description='Local mirror of "التصنيفات"; invalidate re-downloads it',
+    )
+    registry.register(
+        "users", prompt_compiler.stats, prompt_compiler.invalidate,
+        description="Per-user locations and pre-rendered prompt suffix",
+    )
+    registry.register(
+        "codes", code_index.cache_stats, code_index.invalidate, code_index.warm,
+        description="Canonical product code index lookups",
+    )
+    registry.register(
+        "responses", lambda: response_cache.stats(top=0), response_cache.clear,
+        metric="chat_response", description="Chat replies for stateless opening turns",
+    )
+    registry.register(
+        "idempotency", idempotency.stats, idempotency.clear,
+        description="Recent order and chat turn results by idempotency key (the database copy is kept)",
+    )
+
+
+caches = CacheRegistry()
@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from app.core.config import settings
+
+CUSTOMER_PREFIX = "العميل:"
+SELLER_PREFIX = "البائع:"
+
+# Seller confirmations follow the prompt's summary format: "📦 منتج | مواصفات | الكمية: 10"
+_SUMMARY_LINE_RE = re.compile(r"📦\s*(?P<product>[^|\n]+?)\s*\|\s*(?P<specs>[^\n]*?)\s*\|\s*الكمية:\s*(?P<qty>[^\n|]+)")
+# Customer list lines such as "ماسورة PVC 4 بوصة - 10" or "كابل 4مم × 100"
+_LIST_LINE_RE = re.compile(r"^\s*(?:(?:\d+[.)-]|[-•*])\s*)?(?P<text>.+?)(?:\s*[-×x:*]\s*(?P<qty>\d+(?:\.\d+)?)\s*(?P<unit>\S+)?)?\s*$")
+
+MAX_NOTES = 5
+MAX_NOTE_CHARS = 160
+MAX_CONVERSATIONS = 2000
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; Gemini averages roughly 3 characters per token for Arabic."""
+    return max(1, len(text) // 3)
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _item_key(product: str) -> str:
+    return re.sub(r"\s+", " ", product).strip().lower()
+
+
+class ConversationSummary:
+    """Running, structured summary of the turns that have fallen out of the window."""
+
+    def __init__(self):
+        self.items = OrderedDict()  # key -> {"product", "specs", "qty"}
+        self.notes = []
+        self.folded = 0
+        self.last_digest = None
+
+    def fold(self, message: str):
+        """Merge one older message into the summary."""
+        if message.startswith(SELLER_PREFIX):
+            for m in _SUMMARY_LINE_RE.finditer(message):
+                self._put(m.group("product"), m.group("specs"), m.group("qty"))
+            return
+
+        body = message[len(CUSTOMER_PREFIX):].strip() if message.startswith(CUSTOMER_PREFIX) else message.strip()
+        lines = [l for l in body.splitlines() if l.strip()]
+        if len(lines) > 1:
+            # Pasted bulk list: keep one compact entry per line
+            for line in lines:
+                m = _LIST_LINE_RE.match(line)
+                if not m:
+                    continue
+                qty = " ".join(p for p in (m.group("qty"), m.group("unit")) if p)
+                self._put(m.group("text"), "", qty)
+        elif body:
+            self.notes.append(body[:MAX_NOTE_CHARS])
+            del self.notes[:-MAX_NOTES]
+
+    def _put(self, product, specs, qty):
+        product = product.strip()
+        if not product:
+            return
+        key = _item_key(product)
+        entry = self.items.get(key, {"product": product, "specs": "", "qty": ""})
+        if specs and specs.strip():
+            entry["specs"] = specs.strip()
+        if qty and qty.strip():
+            entry["qty"] = qty.strip()
+        self.items[key] = entry
+        self.items.move_to_end(key)
+
+    def render(self) -> str:
+        if not self.items and not self.notes:
+            return ""
+        lines = ["ملخص ما سبق من المحادثة (أصناف تم جمعها):"]
+        for entry in self.items.values():
+            parts = [entry["product"]]
+            if entry["specs"]:
+                parts.append(entry["specs"])
+            if entry["qty"]:
+                parts.append(f"الكمية: {entry['qty']}")
+            lines.append("📦 " + " | ".join(parts))
+        if self.notes:
+            lines.append("رسائل سابقة من العميل: " + " / ".join(self.notes))
+        return "\n".join(lines)
+
+
+class HistoryWindow:
+    """Keeps the prompt history within a token budget.
+
+    The newest messages that fit the budget are sent verbatim; everything older
+    is folded once into a per-conversation ConversationSummary. On the next turn
+    only the messages that newly fell out of the window are folded, so the cost
+    per turn stays flat instead of re-summarizing the whole conversation.
+    """
+
+    def __init__(self, token_budget: int = None, max_conversations: int = MAX_CONVERSATIONS):
+        self.token_budget = token_budget or settings.CHAT_HISTORY_TOKEN_BUDGET
+        self.max_conversations = max_conversations
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state_for(self, key, history):
+        state = self._states.get(key)
+        if state is not None:
+            self._states.move_to_end(key)
+            # The client resends the full history; reuse the summary only if its prefix is unchanged
+            if state.folded > len(history) or (
+                state.folded and _digest(history[state.folded - 1]) != state.last_digest
+            ):
+                state = None
+        if state is None:
+            state = ConversationSummary()
+            self._states[key] = state
+            while len(self._states) > self.max_conversations:
+                self._states.popitem(last=False)
+        return state
+
+    def build(self, key, history):
+        """Return (summary_text, recent_messages) for this conversation."""
+        used = 0
+        split = len(history)
+        while split > 0:
+            cost = estimate_tokens(history[split - 1])
+            if used + cost > self.token_budget and split < len(history):
+                break
+            used += cost
+            split -= 1
+
+        with self._lock:
+            state = self._state_for(key, history)
+            split = max(split, state.folded)
+            for message in history[state.folded:split]:
+                state.fold(message)
+            if split > state.folded:
+                state.folded = split
+                state.last_digest = _digest(history[split - 1])
+            return state.render(), history[split:]
+
+    def reset(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+
+history_window = HistoryWindow()
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+
+from app.core.config import settings
+from app.services.metrics import is_rate_limit_error, metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open; retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Per-upstream circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast for reset_seconds. Then a single probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+
+    is_failure(error), if given, decides which exceptions from call() count as
+    failures; the others mean the upstream answered and count as successes.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0, is_failure=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.is_failure = is_failure
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(old_state, new_state) runs after every state change."""
+        self._listeners.append(callback)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def is_open(self):
+        """True while calls would fail fast (open and not yet due for a probe)."""
+        with self._lock:
+            return self._state == OPEN and time.time() - self._opened_at < self.reset_seconds
+
+    def _set_state(self, new_state):
+        # Caller holds self._lock; returns the transition for _notify
+        old_state, self._state = self._state, new_state
+        if new_state == OPEN:
+            self._opened_at = time.time()
+        return (old_state, new_state) if old_state != new_state else None
+
+    def _notify(self, transition):
+        if not transition:
+            return
+        old_state, new_state = transition
+        logger.warning(f"Circuit '{self.name}': {old_state} -> {new_state}")
+        metrics.incr(f"breaker.{self.name}.{new_state}")
+        for callback in self._listeners:
+            try:
+                callback(old_state, new_state)
+            except Exception as e:
+                logger.error(f"Circuit '{self.name}' listener failed: {e}")
+
+    def allow(self):
+        """Reserve a call. Returns False when the caller should fail fast."""
+        transition = None
+        with self._lock:
+            if self._state == OPEN:
+                if time.time() - self._opened_at < self.reset_seconds:
+                    allowed = False
+                else:
+                    transition = self._set_state(HALF_OPEN)
+                    self._probe_in_flight = True
+                    allowed = True
+            elif self._state == HALF_OPEN:
+                # Only one probe at a time
+                allowed = not self._probe_in_flight
+                self._probe_in_flight = True
+            else:
+                allowed = True
+        self._notify(transition)
+        if not allowed:
+            metrics.incr(f"breaker.{self.name}.fast_fail")
+        return allowed
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            transition = self._set_state(CLOSED)
+        self._notify(transition)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            transition = None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                transition = self._set_state(OPEN)
+        self._notify(transition)
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, self.reset_seconds - (time.time() - self._opened_at))
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the breaker; raises CircuitOpenError when open."""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure is None or self.is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "retry_in_seconds": round(max(0.0, self.reset_seconds - (time.time() - self._opened_at)), 1)
+                if self._state == OPEN else 0,
+            }
+
+
+def is_transient_sheets_error(error):
+    """True for Sheets errors worth opening the circuit for: HTTP 429/5xx, timeouts, connection errors.
+
+    Caller errors (missing worksheet, bad range, 4xx) say nothing about Sheets' health.
+    """
+    import gspread
+    import requests
+    from google.auth.exceptions import TransportError
+
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        return status is None or status == 429 or status >= 500 or is_rate_limit_error(error)
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                              TransportError, TimeoutError, ConnectionError))
+
+
+gemini_breaker = CircuitBreaker("gemini", settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_SECONDS)
+sheets_breaker = CircuitBreaker("sheets", settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_SECONDS,
+                                is_failure=is_transient_sheets_error)
+
+BREAKERS = {b.name: b for b in (gemini_breaker, sheets_breaker)}
+
+
+def snapshot_all():
+    return {name: breaker.snapshot() for name, breaker in BREAKERS.items()}
@@ -1,50 +1,120 @@
-import google.generativeai as genai
+import hashlib
 import json
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from app.core.config import settings
+from app.services import code_index, sheet_mirror
+from app.services.circuit_breaker import gemini_breaker
+from app.services.metrics import metrics, is_rate_limit_error, CLASSIFICATION_DONE, CLASSIFICATION_FAILED
+from app.services.sheet_rows import taxonomy_rows
+from app.services.taxonomy_index import TaxonomyIndex
+from app.services.taxonomy_learner import taxonomy_learner
+from app.services.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
-# Global variable for cached summary
-_SUMMARY_CACHE = ""
-_SUMMARY_CACHE_TIME = 0
+# Shared pool for Gemini classification calls, sized by CLASSIFY_WORKERS
+_CLASSIFY_POOL = None
+_CLASSIFY_POOL_LOCK = threading.Lock()
+
+class TaxonomySnapshot:
+    """Taxonomy rows with the prompt summary, retrieval index and version built from them."""
+
+    def __init__(self, rows):
+        # Format: BasicAr (BasicEn) > MainAr (MainEn) > SubAr (SubEn) | Needs: ...
+        self.rows = rows
+        self.index = TaxonomyIndex(rows)
+        self.summary = "\n".join(self.index.lines)  # the index formats the same rows
+        self.version = self._version()
+
+    def _version(self):
+        return hashlib.blake2b(self.summary.encode("utf-8"), digest_size=6).hexdigest()
+
+    def add(self, row):
+        """Add one learned row in place (index and summary patched, not rebuilt); returns self."""
+        self.rows.append(row)
+        line = self.index.add(row)
+        if line is not None:
+            self.summary = f"{self.summary}\n{line}" if self.summary else line
+            self.version = self._version()
+        return self
+
+_EMPTY_TAXONOMY = TaxonomySnapshot([])
 
 def get_taxonomy(sh=None):
     """Fetch taxonomy rows from 'الاساسي'"""
     if not sh: return []
     try:
-        ws = sh.worksheet("الاساسي")
-        rows = ws.get_all_values()
-        if len(rows) < 2: return []
-        return rows[1:] # skip header
+        return _read_taxonomy(sh)
     except Exception as e:
         logger.error(f"Error getting taxonomy: {e}")
         return []
 
+def _read_taxonomy(sh):
+    from app.services.sheets_service import _sheets_request_with_retry
+    ws = _sheets_request_with_retry(sh.worksheet, "الاساسي")
+    rows = _sheets_request_with_retry(ws.get_all_values)
+    if len(rows) < 2: return []
+    # Compact tuples with repeated names shared; the snapshot, index and learner all reference them
+    return taxonomy_rows(rows[1:]) # skip header
+
+def _load_taxonomy(sh):
+    if not sh:
+        raise RuntimeError("No spreadsheet to load the taxonomy from")
+    # Learned rows that are not written to the sheet yet stay in the snapshot
+    return TaxonomySnapshot(taxonomy_learner.merge(_read_taxonomy(sh)))
+
+_taxonomy = TTLCache(
+    "taxonomy", _load_taxonomy,
+    ttl_seconds=settings.TAXONOMY_CACHE_TTL_SECONDS,
+    stale_seconds=settings.TAXONOMY_CACHE_STALE_SECONDS,
+    default=_EMPTY_TAXONOMY,
+)
+
+def get_taxonomy_snapshot(sh=None):
+    return _taxonomy.get(sh)
+
 def get_taxonomy_summary(sh=None):
-    global _SUMMARY_CACHE, _SUMMARY_CACHE_TIME
-    import time
-    if _SUMMARY_CACHE and (time.time() - _SUMMARY_CACHE_TIME < 300):
-        return _SUMMARY_CACHE
-
-    rows = get_taxonomy(sh)
-    summary = []
-    for row in rows:
-        if len(row) >= 6:
-            # Format: BasicAr (BasicEn) > MainAr (MainEn) > SubAr (SubEn)
-            line = f"{row[0]} ({row[1]}) > {row[2]} ({row[3]}) > {row[4]} ({row[5]})"
-            needs = []
-            if len(row) > 6 and row[6]: needs.append(row[6].strip())
-            if len(row) > 7 and row[7]: needs.append(row[7].strip())
-            if len(row) > 8 and row[8]: needs.append(row[8].strip())
-            if needs:
-                line += f" | Needs: {' & '.join(needs)}"
-            summary.append(line)
-    
-    _SUMMARY_CACHE = "\n".join(summary)
-    _SUMMARY_CACHE_TIME = time.time()
-    return _SUMMARY_CACHE
+    return _taxonomy.get(sh).summary
+
+def refresh_taxonomy(sh=None):
+    """Reload the taxonomy from the sheet now (single-flight); raises if the read fails."""
+    return _taxonomy.refresh(sh).summary
+
+def invalidate_taxonomy():
+    """Expire the snapshot; it is served stale while one background refresh runs."""
+    _taxonomy.invalidate()
+
+def taxonomy_cache_stats():
+    snapshot = _taxonomy.peek(_EMPTY_TAXONOMY)
+    return {
+        "rows": len(snapshot.rows),
+        "version": snapshot.version,
+        "pending_learned_rows": taxonomy_learner.pending_count(),
+        **_taxonomy.stats(),
+    }
+
+def _apply_learned_row(row):
+    """Patch the cached snapshot with a newly learned row instead of re-downloading the sheet."""
+    record = taxonomy_rows([row])
+    if record:
+        _taxonomy.update(lambda snapshot: snapshot.add(record[0]))
+
+taxonomy_learner.add_listener(_apply_learned_row)
+
+def get_relevant_taxonomy(sh, query, k=None):
+    """Top-k taxonomy lines for this query instead of the whole catalog."""
+    k = k or settings.TAXONOMY_TOP_K
+    snapshot = _taxonomy.get(sh)
+    if len(snapshot.index) <= k:
+        return snapshot.summary
+    return "\n".join(snapshot.index.relevant_lines(query, k))
+
+def get_taxonomy_version():
+    return _taxonomy.peek(_EMPTY_TAXONOMY).version
 
 def generate_base_code(b_sh, m_sh, s_sh):
     """Generate base code from category shorthands (without specs)."""
@@ -139,20 +209,35 @@ def find_existing_code_in_classifications(sh, sub_en, spec1_val, spec2_val, spec
     This ensures the SAME product with the SAME specs always gets the SAME code.
     Matching is done on sub_en (product type) + spec values (not shorthands).
     """
+    from app.services.sheets_service import _sheets_request_with_retry
+
+    target_sub = (sub_en or "").strip().lower()
+    target_s1 = normalize_spec_value(spec1_val)
+    target_s2 = normalize_spec_value(spec2_val)
+    target_s3 = normalize_spec_value(spec3_val)
+
+    # Fast path: incremental pull into the local mirror, then an indexed lookup by sub-category
+    try:
+        sheet_mirror.pull(_sheets_request_with_retry(sh.worksheet, sheet_mirror.CLASSIFICATIONS_WORKSHEET))
+        for s1, s2, s3, row_code in sheet_mirror.find_classification_codes(sub_en):
+            if (normalize_spec_value(s1) == target_s1 and
+                normalize_spec_value(s2) == target_s2 and
+                normalize_spec_value(s3) == target_s3):
+                logger.info(f"✅ Found existing code '{row_code}' for {sub_en} [{spec1_val}, {spec2_val}, {spec3_val}]")
+                return row_code.strip()
+        return None
+    except Exception as e:
+        logger.error(f"Mirror lookup failed, scanning sheet instead: {e}")
+
     try:
-        ws = sh.worksheet("التصنيفات")
-        rows = ws.get_all_values()
+        ws = _sheets_request_with_retry(sh.worksheet, "التصنيفات")
+        rows = _sheets_request_with_retry(ws.get_all_values)
         
         # Column layout: [ID, Original, BasicAr, BasicEn, MainAr, MainEn, SubAr, SubEn, 
         #                  Spec1Name, Spec1Val, Spec2Name, Spec2Val, Spec3Name, Spec3Val, Code, Date]
         # Indices:         0    1        2        3        4        5       6      7
         #                  8          9          10         11         12         13       14   15
         
-        target_sub = (sub_en or "").strip().lower()
-        target_s1 = normalize_spec_value(spec1_val)
-        target_s2 = normalize_spec_value(spec2_val)
-        target_s3 = normalize_spec_value(spec3_val)
-        
         for row in rows[1:]:  # skip header
             if len(row) >= 15:
                 row_sub = (row[7] or "").strip().lower()
@@ -203,36 +288,23 @@ def build_final_code(base_code, spec1_sh, spec2_sh, spec3_sh):
 
 
 def add_new_item_to_taxonomy(sh, res):
-    """Add completely new category to 'الاساسي' sheet"""
+    """Add completely new category to 'الاساسي' sheet (batched and deduplicated by the learner)"""
     try:
         b_sh = res.get('basic_sh', '') or res.get('basic_en', '')[:3]
         m_sh = res.get('main_sh', '') or res.get('main_en', '')[:3]
         s_sh = res.get('sub_sh', '') or res.get('sub_en', '')[:4]
         code = generate_base_code(b_sh, m_sh, s_sh) # We don't save this in taxonomy sheet, but use it here to construct base
         
-        ws = sh.worksheet("الاساسي")
-        row = [
-            res.get('basic_ar', ''), res.get('basic_en', ''),
-            res.get('main_ar', ''), res.get('main_en', ''),
-            res.get('sub_ar', ''), res.get('sub_en', ''),
-            res.get('spec1_name', ''),
-            res.get('spec2_name', ''),
-            res.get('spec3_name', '')
-        ]
-        ws.append_row(row)
-        
-        # force clear cache
-        global _SUMMARY_CACHE_TIME
-        _SUMMARY_CACHE_TIME = 0
-        
-        logger.info(f"Learned new item and added to taxonomy: {res.get('sub_en')} without fixed base code")
+        # Cached snapshot is patched by the learner's listener; the sheet write is batched
+        _, created = taxonomy_learner.learn(sh, res)
+        if not created:
+            logger.info(f"Sub-category already learned, not adding again: {res.get('sub_en')}")
         return code
     except Exception as e:
         logger.error(f"Failed to learn new item: {e}")
         return None
 
 def classify_item_ai(item_desc, taxonomy_data_str):
-    if not settings.GEMINI_API_KEY: return None
     
     prompt = f"""
     Task: Classify item: "{item_desc}"
@@ -264,9 +336,14 @@ def classify_item_ai(item_desc, taxonomy_data_str):
     """
     
     try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt, generation_config={"temperature":0, "response_mime_type": "application/json"})
+        from app.services.ai_service import get_model
+        model = get_model()
+        if not model:
+            return None
+        with metrics.timed("gemini.classify"):
+            response = gemini_breaker.call(
+                model.generate_content, prompt, generation_config={"temperature":0, "response_mime_type": "application/json"}
+            )
         text = response.text.strip()
         if text.startswith('```json'): text = text[7:]
         elif text.startswith('```'): text = text[3:]
@@ -274,35 +351,96 @@ def classify_item_ai(item_desc, taxonomy_data_str):
         return json.loads(text.strip())
     except Exception as e:
         logger.error(f"Classification AI Error: {e}")
+        if is_rate_limit_error(e):
+            metrics.incr("gemini.429")
         return None
 
-def process_and_save_classification(sh, item_id, text):
-    tax_rows = get_taxonomy(sh)
-    tax_summary = get_taxonomy_summary(sh)
-    
-    # Simple retry block for the AI classification
-    import time
+def _get_classify_pool():
+    global _CLASSIFY_POOL
+    if _CLASSIFY_POOL is None:
+        with _CLASSIFY_POOL_LOCK:
+            if _CLASSIFY_POOL is None:
+                _CLASSIFY_POOL = ThreadPoolExecutor(
+                    max_workers=max(1, settings.CLASSIFY_WORKERS), thread_name_prefix="classify"
+                )
+    return _CLASSIFY_POOL
+
+def _classify_with_retries(item_id, text, tax_summary):
+    """Gemini classification with the simple retry block; returns the parsed JSON or None."""
     res = None
     for attempt in range(3):
         res = classify_item_ai(text, tax_summary)
         if res: break
+        if gemini_breaker.is_open():
+            # No point sleeping through retries while Gemini is failing
+            break
         logger.warning(f"Classification retry {attempt+1}/3 for item {item_id}")
         time.sleep(2)
-        
     if not res:
         logger.error(f"Failed to classifying item '{item_id}' after retries.")
-        return False
-    
+    return res
+
+def submit_classification(sh, item_id, text):
+    """Start the Gemini classification of one item on the shared pool; returns a Future of the AI result."""
+    return _get_classify_pool().submit(_classify_with_retries, item_id, text, get_relevant_taxonomy(sh, text))
+
+def process_order_classifications(sh, order_num, items, prefetched=None):
+    """Classify all items of one order in parallel and save them in item order.
+
+    items is a list of (item_id, text); prefetched maps item_id to a Future
+    from submit_classification started earlier (speculative classification
+    during the chat). The other Gemini calls run on the shared classification
+    pool. Rows are written to "التصنيفات" in one batch in the original item
+    order, and a new sub-category seen twice in the same order is only added
+    to "الاساسي" once. Returns the number of items saved.
+    """
+    start = time.perf_counter()
+    prefetched = prefetched or {}
+    futures = [prefetched.get(item_id) or submit_classification(sh, item_id, text) for item_id, text in items]
+    saved = _save_order_classifications(sh, items, futures)
+
+    elapsed = time.perf_counter() - start
+    metrics.observe("classification.order", elapsed)
+    logger.info(f"⏱️ Order {order_num}: classified {saved}/{len(items)} items in {elapsed:.1f}s "
+                f"({len(prefetched)} prefetched)")
+    return saved
+
+def _save_order_classifications(sh, items, futures):
+    # Loading the snapshot also refreshes what the learner knows is in the sheet
+    _taxonomy.get(sh)
+    rows = []
+    for (item_id, text), future in zip(items, futures):
+        try:
+            res = future.result()
+        except Exception as e:
+            logger.error(f"Classification worker error for item {item_id}: {e}")
+            res = None
+        row = _build_classification_row(sh, item_id, text, res) if res else None
+        if row:
+            rows.append(row)
+        else:
+            metrics.incr(CLASSIFICATION_FAILED)
+    if rows:
+        try:
+            from app.services.order_sinks import get_order_sink
+            get_order_sink().write_classifications(sh, rows)
+            metrics.incr(CLASSIFICATION_DONE, len(rows))
+        except Exception as e:
+            logger.error(f"Error appending {len(rows)} classifications to sheet: {e}")
+            metrics.incr(CLASSIFICATION_FAILED, len(rows))
+            rows = []
+    # New sub-categories from this order go to "الاساسي" in one append
+    taxonomy_learner.flush(sh)
+    return len(rows)
+
+def _build_classification_row(sh, item_id, text, res):
+    """Resolve taxonomy and code for one AI result; returns the "التصنيفات" row or None."""
     try:
         sub_en = (res.get('sub_en') or '').strip().lower()
         
-        # Build map for override check from الاساسي sheet
-        existing_map = {}
-        for row in tax_rows:
-            if len(row) >= 6 and row[5]:
-                existing_map[row[5].strip().lower()] = row
-                
-        is_truly_new = sub_en and (sub_en not in existing_map)
+        # Override check against الاساسي rows, including ones learned but not yet written
+        existing = taxonomy_learner.lookup(sub_en) if sub_en else None
+        is_truly_new = sub_en and existing is None
         
         if is_truly_new:
             # New category - add to الاساسي
@@ -315,7 +453,7 @@ def process_and_save_classification(sh, item_id, text):
         else:
             # Existing category - override AI details with sheet truth
             logger.info("Category exists, overriding AI data with Sheet facts.")
-            r = existing_map[sub_en]
+            r = existing
             
             res['basic_ar'] = r[0] if len(r) > 0 else res.get('basic_ar')
             res['basic_en'] = r[1] if len(r) > 1 else res.get('basic_en')
@@ -342,10 +480,21 @@ def process_and_save_classification(sh, item_id, text):
         spec2_val = res.get('spec2_val', '')
         spec3_val = res.get('spec3_val', '')
         
-        # Step 1: Check if the SAME product with SAME specs already has a code in التصنيفات
-        existing_code = find_existing_code_in_classifications(
-            sh, res.get('sub_en', ''), spec1_val, spec2_val, spec3_val
-        )
+        # Step 1: Canonical code index (stable base code per sub-category, O(1) lookups)
+        sub_name = res.get('sub_en', '')
+        canonical_base = code_index.get_base_code(sub_name)
+        indexed = False
+        if canonical_base:
+            existing_code = code_index.get_code(canonical_base, spec1_val, spec2_val, spec3_val)
+            indexed = existing_code is not None
+        else:
+            # Sub-category not indexed yet (new, or history not backfilled): check التصنيفات once
+            existing_code = find_existing_code_in_classifications(
+                sh, sub_name, spec1_val, spec2_val, spec3_val
+            )
+            proposed = code_index.base_of(existing_code, (spec1_val, spec2_val, spec3_val)) if existing_code else base_code
+            canonical_base = code_index.set_base_code(sub_name, proposed)
+        base_code = canonical_base or base_code
         
         if existing_code:
             # REUSE the existing code for consistency (same product + same specs = same code)
@@ -360,13 +509,15 @@ def process_and_save_classification(sh, item_id, text):
                 res.get('spec3_sh', '')
             )
             logger.info(f"🆕 Generated new code: {code} (base={base_code})")
+        if not indexed:
+            # Register the code; a concurrent classification of the same product may have won
+            code = code_index.set_code(base_code, spec1_val, spec2_val, spec3_val, code)
         
         # ========================================
-        # SAVE TO التصنيفات SHEET
+        # ROW FOR التصنيفات SHEET
         # ========================================
         from datetime import datetime
         
-        ws = sh.worksheet("التصنيفات")
         row = [
             item_id, text,
             res.get("basic_ar", ""), res.get("basic_en", ""),
@@ -378,12 +529,10 @@ def process_and_save_classification(sh, item_id, text):
             code,
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ]
-        ws.append_row(row)
-        logger.info(f"✅ Successfully saved classification for item {item_id} with code: {code}")
-        return True
+        return row
     except Exception as e:
-        logger.error(f"Error appending classification to sheet for item {item_id}: {e}")
-        return False
+        logger.error(f"Error resolving classification for item {item_id}: {e}")
+        return None
         
 def get_taxonomy_summary_static():
-    return _SUMMARY_CACHE or "Taxonomy data loading from sheet..."
+    return _taxonomy.peek(_EMPTY_TAXONOMY).summary or "Taxonomy data loading from sheet..."
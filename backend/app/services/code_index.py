@@ -0,0 +1,205 @@
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app.db import models, session
+from app.services.taxonomy_learner import sub_key
+
+logger = logging.getLogger(__name__)
+
+# Lookups that already hit the database; entries never change once written
+_base_codes = {}  # sub key -> base code
+_codes = {}  # (base code, spec key) -> code
+_cache_lock = threading.Lock()
+
+
+def spec_key(spec1_val, spec2_val, spec3_val):
+    from app.services.classifier import normalize_spec_value
+    return "|".join(normalize_spec_value(v) for v in (spec1_val, spec2_val, spec3_val))
+
+
+def base_of(code, spec_values):
+    """Strip the spec shorthands that build_final_code appended (one per non-empty spec value)."""
+    parts = [p for p in str(code or "").split("-") if p]
+    n_specs = sum(1 for v in spec_values if str(v or "").strip())
+    if len(parts) > n_specs:
+        parts = parts[:len(parts) - n_specs]
+    return "-".join(parts)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_base_code(sub_en):
+    """Canonical base code for a sub-category, or None if it is not indexed yet."""
+    key = sub_key(sub_en)
+    if not key:
+        return None
+    if key in _base_codes:
+        return _base_codes[key]
+    db = session.SessionLocal()
+    try:
+        row = db.get(models.ProductBaseCode, key)
+    finally:
+        db.close()
+    if row is None:
+        return None
+    with _cache_lock:
+        _base_codes[key] = row.base_code
+    return row.base_code
+
+
+def set_base_code(sub_en, proposed):
+    """Register the base code for a sub-category and return the canonical one.
+
+    If the sub-category was registered concurrently, that entry wins. If
+    another sub-category already owns the proposed base code, a numeric
+    suffix keeps the two apart.
+    """
+    key = sub_key(sub_en)
+    if not key or not proposed:
+        return proposed
+    db = session.SessionLocal()
+    try:
+        for n in range(1, 100):
+            candidate = proposed if n == 1 else f"{proposed}{n}"
+            db.add(models.ProductBaseCode(sub_key=key, sub_en=sub_en, base_code=candidate, created_at=_now()))
+            try:
+                db.commit()
+                base = candidate
+                break
+            except IntegrityError:
+                db.rollback()
+                existing = db.get(models.ProductBaseCode, key)
+                if existing is not None:
+                    base = existing.base_code
+                    break
+        else:
+            raise ValueError(f"No free base code for '{sub_en}' starting from '{proposed}'")
+    finally:
+        db.close()
+    if base != proposed:
+        logger.info(f"Canonical base code for '{sub_en}' is {base} (proposed {proposed})")
+    with _cache_lock:
+        _base_codes[key] = base
+    return base
+
+
+def get_code(base_code, spec1_val, spec2_val, spec3_val):
+    """Final code already assigned to this base code + spec values, or None."""
+    if not base_code:
+        return None
+    key = (base_code, spec_key(spec1_val, spec2_val, spec3_val))
+    if key in _codes:
+        return _codes[key]
+    db = session.SessionLocal()
+    try:
+        row = db.query(models.ProductCode.code).filter(
+            models.ProductCode.base_code == key[0],
+            models.ProductCode.spec_key == key[1],
+        ).first()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    with _cache_lock:
+        _codes[key] = row.code
+    return row.code
+
+
+def set_code(base_code, spec1_val, spec2_val, spec3_val, code):
+    """Register the final code for base code + spec values; returns the canonical one."""
+    key = (base_code, spec_key(spec1_val, spec2_val, spec3_val))
+    db = session.SessionLocal()
+    try:
+        db.add(models.ProductCode(base_code=key[0], spec_key=key[1], code=code, created_at=_now()))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Same product and specs registered concurrently; keep the first code
+            db.rollback()
+            code = db.query(models.ProductCode.code).filter(
+                models.ProductCode.base_code == key[0],
+                models.ProductCode.spec_key == key[1],
+            ).scalar()
+    finally:
+        db.close()
+    with _cache_lock:
+        _codes[key] = code
+    return code
+
+
+def cache_stats():
+    return {"base_codes": len(_base_codes), "codes": len(_codes)}
+
+
+def invalidate():
+    with _cache_lock:
+        _base_codes.clear()
+        _codes.clear()
+
+
+def warm():
+    """Load the whole index into the in-process caches. Returns the number of entries loaded."""
+    db = session.SessionLocal()
+    try:
+        bases = dict(db.query(models.ProductBaseCode.sub_key, models.ProductBaseCode.base_code))
+        codes = {(b, s): c for b, s, c in db.query(
+            models.ProductCode.base_code, models.ProductCode.spec_key, models.ProductCode.code
+        )}
+    finally:
+        db.close()
+    with _cache_lock:
+        _base_codes.update(bases)
+        _codes.update(codes)
+    return len(bases) + len(codes)
+
+
+def backfill(rows):
+    """Index existing classifications, given in sheet order as
+    (sub_en, spec1_val, spec2_val, spec3_val, code) tuples.
+
+    The first row of a sub-category fixes its base code and the first row of
+    a (sub-category, specs) combination fixes its code, the same rows that the
+    old sheet scan would have matched. Returns (base codes added, codes added).
+    """
+    db = session.SessionLocal()
+    try:
+        codes = {(base_code, s_key) for base_code, s_key in db.query(models.ProductCode.base_code, models.ProductCode.spec_key)}
+        existing_bases = {k: v for k, v in db.query(models.ProductBaseCode.sub_key, models.ProductBaseCode.base_code)}
+        used_base_codes = set(existing_bases.values())
+
+        new_bases, new_codes = [], []
+        for sub_en, s1, s2, s3, code in rows:
+            key = sub_key(sub_en)
+            code = (code or "").strip()
+            if not key or not code:
+                continue
+            if key not in existing_bases:
+                base = base_of(code, (s1, s2, s3))
+                candidate, n = base, 1
+                while candidate in used_base_codes:
+                    n += 1
+                    candidate = f"{base}{n}"
+                existing_bases[key] = candidate
+                used_base_codes.add(candidate)
+                new_bases.append({"sub_key": key, "sub_en": sub_en, "base_code": candidate, "created_at": _now()})
+            code_key = (existing_bases[key], spec_key(s1, s2, s3))
+            if code_key not in codes:
+                codes.add(code_key)
+                new_codes.append({"base_code": code_key[0], "spec_key": code_key[1], "code": code, "created_at": _now()})
+
+        if new_bases:
+            db.bulk_insert_mappings(models.ProductBaseCode, new_bases)
+        if new_codes:
+            db.bulk_insert_mappings(models.ProductCode, new_codes)
+        db.commit()
+        return len(new_bases), len(new_codes)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
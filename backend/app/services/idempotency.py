@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db import models, session
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ORDER = "order"
+TURN = "turn"
+
+# Item fields that identify an order; the summary text is left out because the
+# model words it differently on every retry.
+_ORDER_ITEM_FIELDS = ("cat", "item", "s1_n", "s1_v", "s2_n", "s2_v", "s3_n", "s3_v", "qty", "unit", "tech_desc")
+
+
+def _norm(value):
+    return re.sub(r"\s+", " ", str(value or "")).strip().lower()
+
+
+def order_fingerprint(data, scope=""):
+    """Content hash of an extracted order (its items in order and the location) within scope.
+
+    scope ties the hash to one chat turn, so the same items ordered again in
+    a later conversation are a new order.
+    """
+    canonical = {
+        "scope": scope,
+        "items": [[_norm(item.get(field)) for field in _ORDER_ITEM_FIELDS] for item in data.get("items", [])],
+        "location": _norm(data.get("c", {}).get("a")),
+    }
+    payload = json.dumps(canonical, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cutoff(seconds):
+    return (datetime.now() - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class IdempotencyStore:
+    """First result per (kind, user, key), kept for window_seconds.
+
+    run() returns the stored result when there is one and otherwise calls
+    func once: concurrent callers with the same key in this process wait for
+    it instead of repeating the work, and a successful (not None) result is
+    written to the database, so retries that reach another worker are
+    answered too. Recent results are also cached in-process. If the database
+    is unavailable the work runs unguarded rather than failing.
+    """
+
+    def __init__(self, window_seconds=1800, wait_seconds=120, max_cached=5000):
+        self.window_seconds = window_seconds
+        self.wait_seconds = wait_seconds
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._inflight = {}  # (kind, user, key) -> Event set when the first caller finishes
+        self._cache = OrderedDict()  # (kind, user, key) -> (value, stored at)
+        self._pruned_at = 0.0
+
+    def get(self, kind, user_code, key, window_seconds=None):
+        window_seconds = window_seconds or self.window_seconds
+        ck = (kind, user_code, key)
+        with self._lock:
+            cached = self._cache.get(ck)
+            if cached is not None:
+                if time.time() - cached[1] < window_seconds:
+                    return cached[0]
+                del self._cache[ck]
+        db = session.SessionLocal()
+        try:
+            record = db.query(models.IdempotencyRecord).filter(
+                models.IdempotencyRecord.kind == kind,
+                models.IdempotencyRecord.user_code == user_code,
+                models.IdempotencyRecord.key == key,
+                models.IdempotencyRecord.created_at >= _cutoff(window_seconds),
+            ).first()
+        finally:
+            db.close()
+        if record is None:
+            return None
+        value = json.loads(record.value)
+        self._remember(ck, value)
+        return value
+
+    def _remember(self, ck, value):
+        with self._lock:
+            self._cache[ck] = (value, time.time())
+            self._cache.move_to_end(ck)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def put(self, kind, user_code, key, value, window_seconds=None):
+        window_seconds = window_seconds or self.window_seconds
+        self._remember((kind, user_code, key), value)
+        db = session.SessionLocal()
+        try:
+            # An expired record for the same key is replaced
+            db.query(models.IdempotencyRecord).filter(
+                models.IdempotencyRecord.kind == kind,
+                models.IdempotencyRecord.user_code == user_code,
+                models.IdempotencyRecord.key == key,
+                models.IdempotencyRecord.created_at < _cutoff(window_seconds),
+            ).delete()
+            db.add(models.IdempotencyRecord(
+                kind=kind, user_code=user_code, key=key,
+                value=json.dumps(value, ensure_ascii=False),
+                created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Stored concurrently by another worker; the first result stays
+                db.rollback()
+            self._prune(db)
+        finally:
+            db.close()
+
+    def _prune(self, db):
+        now = time.time()
+        if now - self._pruned_at < self.window_seconds / 10:
+            return
+        self._pruned_at = now
+        deleted = db.query(models.IdempotencyRecord).filter(
+            models.IdempotencyRecord.created_at < _cutoff(self.window_seconds)
+        ).delete()
+        db.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} expired idempotency records")
+
+    def run(self, kind, user_code, key, func, keep=None, window_seconds=None):
+        """Returns (result, replayed); replayed is True when result came from an earlier call.
+
+        Only results that are not None and pass keep(result), if given, are stored.
+        window_seconds overrides the store's window for this key (at most that
+        long, since expired records are pruned by the store's window).
+        """
+        ck = (kind, user_code, key)
+        while True:
+            try:
+                value = self.get(kind, user_code, key, window_seconds)
+            except Exception as e:
+                logger.error(f"Idempotency lookup failed, running {kind} unguarded: {e}")
+                return func(), False
+            if value is not None:
+                metrics.incr(f"idempotency.{kind}.replayed")
+                return value, True
+            with self._lock:
+                event = self._inflight.get(ck)
+                if event is None:
+                    event = self._inflight[ck] = threading.Event()
+                    break
+            # Same key in flight here: wait for its result (or its failure, then try ourselves)
+            if not event.wait(self.wait_seconds):
+                logger.warning(f"Idempotent {kind} for {user_code} still running after {self.wait_seconds}s, not waiting")
+                return func(), False
+
+        try:
+            value = func()
+            if value is not None and (keep is None or keep(value)):
+                try:
+                    self.put(kind, user_code, key, value, window_seconds)
+                except Exception as e:
+                    logger.error(f"Could not store idempotency record for {kind}: {e}")
+            return value, False
+        finally:
+            with self._lock:
+                self._inflight.pop(ck, None)
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            return {"cached": len(self._cache), "in_flight": len(self._inflight), "window_seconds": self.window_seconds}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+idempotency = IdempotencyStore(settings.IDEMPOTENCY_WINDOW_SECONDS, settings.IDEMPOTENCY_WAIT_SECONDS)
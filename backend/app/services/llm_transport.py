@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from app.core.config import settings
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (LIVE, RECORD, REPLAY)
+
+
+class ReplayMissError(Exception):
+    """Replay mode got a prompt that is not in the recordings."""
+
+
+class ReplayResponse:
+    """Stands in for a Gemini response; callers only read .text."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def prompt_key(prompt, generation_config=None):
+    """Recording key: hash of the prompt and the generation config it was sent with."""
+    config = json.dumps(generation_config or {}, sort_keys=True)
+    return hashlib.sha256(f"{config}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class RecordingStore:
+    """Prompt key -> response text, kept as JSONL (one recording per line, last one wins)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses = None
+
+    def _load(self):
+        # Caller holds self._lock
+        if self._responses is None:
+            self._responses = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._responses[entry["key"]] = entry["response"]
+                logger.info(f"Loaded {len(self._responses)} LLM recordings from {self.path}")
+        return self._responses
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, key, response):
+        entry = {"key": key, "response": response, "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        with self._lock:
+            self._load()[key] = response
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+
+class RecordingModel:
+    """Calls the real model and records every response."""
+
+    def __init__(self, model, store):
+        self.model = model
+        self.store = store
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        response = self.model.generate_content(prompt, generation_config=generation_config, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(response, prompt_key(prompt, generation_config))
+        self.store.put(prompt_key(prompt, generation_config), response.text)
+        metrics.incr("llm.recorded")
+        return response
+
+    def _record_stream(self, response, key):
+        # Recorded under the same key as a non-streamed call, once the stream completes
+        parts = []
+        for chunk in response:
+            try:
+                parts.append(chunk.text)
+            except ValueError:
+                pass
+            yield chunk
+        self.store.put(key, "".join(parts))
+        metrics.incr("llm.recorded")
+
+
+class ReplayModel:
+    """Serves recorded responses after latency_ms; no network or API key needed."""
+
+    STREAM_CHUNK_CHARS = 64
+
+    def __init__(self, store, latency_ms=0.0):
+        self.store = store
+        self.latency_ms = latency_ms
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        text = self.store.get(prompt_key(prompt, generation_config))
+        if text is None:
+            metrics.incr("llm.replay.miss")
+            raise ReplayMissError(f"No recording for prompt ({len(prompt)} chars) in {self.store.path}")
+        metrics.incr("llm.replay.hit")
+        if stream:
+            n = self.STREAM_CHUNK_CHARS
+            return [ReplayResponse(text[i:i + n]) for i in range(0, len(text), n)]
+        return ReplayResponse(text)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None):
+    """Shared store per recordings file, so every wrapped model sees the same recordings."""
+    path = path or settings.LLM_RECORDINGS_PATH
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = RecordingStore(path)
+        return store
+
+
+def wrap_model(model, mode=None):
+    """The model to call for the configured LLM_MODE.
+
+    live returns model unchanged; record wraps it (None stays None); replay
+    ignores it and answers from the recordings even without an API key.
+    """
+    mode = (mode or settings.LLM_MODE).lower()
+    if mode == REPLAY:
+        return ReplayModel(get_store(), settings.LLM_REPLAY_LATENCY_MS)
+    if mode == RECORD and model is not None:
+        return RecordingModel(model, get_store())
+    if mode not in MODES:
+        logger.error(f"Unknown LLM_MODE '{mode}', calling the model directly")
+    return model
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.core.config import settings
+
+# Classification lifecycle counters; the backlog is queued - done - failed
+CLASSIFICATION_QUEUED = "classification.queued"
+CLASSIFICATION_DONE = "classification.done"
+CLASSIFICATION_FAILED = "classification.failed"
+
+
+def is_rate_limit_error(error):
+    """True for Gemini / Sheets quota errors (HTTP 429, RESOURCE_EXHAUSTED)."""
+    text = str(error)
+    return "429" in text or "RATE_LIMIT" in text.upper() or "RESOURCE_EXHAUSTED" in text or "Quota" in text
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[idx] * 1000, 1)
+
+
+def _hit_rate(stats):
+    total = stats["hit"] + stats["miss"]
+    stats["hit_rate"] = round(stats["hit"] / total, 3) if total else None
+    return stats
+
+
+class Metrics:
+    """In-process counters and latency ring buffers for the admin dashboard.
+
+    Writers on the hot path only bump a counter or append to a bounded deque,
+    and snapshot() reads those fixed-size structures, so neither side touches
+    the sheets. Values are per process and reset on restart.
+    """
+
+    def __init__(self, sample_size=512, window_hours=48):
+        self._lock = threading.Lock()
+        self._sample_size = sample_size
+        self._counters = Counter()
+        self._latencies = {}
+        self._hourly = deque(maxlen=window_hours)  # [hour_label, orders, items]
+        self._orders_by_location = Counter()
+        self._orders_by_user = Counter()
+        self._started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            samples = self._latencies.get(name)
+            if samples is None:
+                samples = self._latencies[name] = deque(maxlen=self._sample_size)
+            samples.append(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def cache(self, name, hit):
+        self.incr(f"cache.{name}.{'hit' if hit else 'miss'}")
+
+    def cache_stats(self, name):
+        with self._lock:
+            hit = self._counters.get(f"cache.{name}.hit", 0)
+            miss = self._counters.get(f"cache.{name}.miss", 0)
+        return _hit_rate({"hit": hit, "miss": miss})
+
+    def record_order(self, location, user_code, items):
+        hour = datetime.now().strftime("%Y-%m-%d %H:00")
+        with self._lock:
+            if not self._hourly or self._hourly[-1][0] != hour:
+                self._hourly.append([hour, 0, 0])
+            self._hourly[-1][1] += 1
+            self._hourly[-1][2] += items
+            self._orders_by_location[location or ""] += 1
+            self._orders_by_user[user_code or ""] += 1
+            self._counters["orders"] += 1
+            self._counters["order_items"] += items
+
+    def snapshot(self, top=20):
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = {name: sorted(samples) for name, samples in self._latencies.items()}
+            hourly = [{"hour": h, "orders": o, "items": i} for h, o, i in self._hourly]
+            by_location = self._orders_by_location.most_common(top)
+            by_user = self._orders_by_user.most_common(top)
+
+        caches = {}
+        for key, count in counters.items():
+            if key.startswith("cache."):
+                name, kind = key[len("cache."):].rsplit(".", 1)
+                if kind in ("hit", "miss"):
+                    caches.setdefault(name, {"hit": 0, "miss": 0})[kind] = count
+        for stats in caches.values():
+            _hit_rate(stats)
+
+        queued = counters.get(CLASSIFICATION_QUEUED, 0)
+        done = counters.get(CLASSIFICATION_DONE, 0)
+        failed = counters.get(CLASSIFICATION_FAILED, 0)
+
+        return {
+            "since": self._started_at,
+            "orders": {
+                "total": counters.get("orders", 0),
+                "items": counters.get("order_items", 0),
+                "per_hour": hourly,
+                "by_location": [{"location": k, "orders": v} for k, v in by_location],
+                "by_user": [{"user": k, "orders": v} for k, v in by_user],
+            },
+            "classification": {
+                "queued": queued, "done": done, "failed": failed,
+                "backlog": max(0, queued - done - failed),
+            },
+            "caches": caches,
+            "latency_ms": {
+                name: {
+                    "count": len(values),
+                    "p50": _percentile(values, 50),
+                    "p95": _percentile(values, 95),
+                    "p99": _percentile(values, 99),
+                }
+                for name, values in latencies.items()
+            },
+            "rate_limited": {
+                "gemini": counters.get("gemini.429", 0),
+                "sheets": counters.get("sheets.429", 0),
+            },
+            "counters": counters,
+        }
+
+
+metrics = Metrics(settings.METRICS_SAMPLE_SIZE, settings.METRICS_WINDOW_HOURS)
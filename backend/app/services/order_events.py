@@ -0,0 +1,50 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ORDER_SAVED = "order_saved"
+CLASSIFICATION_COMPLETE = "classification_complete"
+
+
+class OrderEvents:
+    """Pushes order status events to a user's open chat WebSockets.
+
+    Each connection subscribes with its event loop and an asyncio.Queue.
+    publish() may be called from any thread (order saves and classification
+    run in worker threads) and never blocks; users without a connection are
+    skipped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user code -> [(loop, queue)]
+
+    def subscribe(self, user_code, loop, queue):
+        with self._lock:
+            self._subscribers.setdefault(user_code, []).append((loop, queue))
+
+    def unsubscribe(self, user_code, queue):
+        with self._lock:
+            subs = [s for s in self._subscribers.get(user_code, []) if s[1] is not queue]
+            if subs:
+                self._subscribers[user_code] = subs
+            else:
+                self._subscribers.pop(user_code, None)
+
+    def publish(self, user_code, event):
+        with self._lock:
+            subs = list(self._subscribers.get(user_code, ()))
+        for loop, queue in subs:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError as e:
+                # Loop already closed: the connection is going away
+                logger.debug(f"Dropped {event.get('type')} event for {user_code}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._subscribers), "connections": sum(len(s) for s in self._subscribers.values())}
+
+
+order_events = OrderEvents()
@@ -0,0 +1,165 @@
+import logging
+import re
+
+from pydantic import ValidationError
+
+from app.schemas.order import Order
+
+logger = logging.getLogger(__name__)
+
+DATA_START = "###DATA_START###"
+DATA_END = "###DATA_END###"
+
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class OrderStreamParser:
+    """Incremental parser for chat replies that may carry an order block.
+
+    Feed it the reply as it streams in; ``feed`` returns the text that is safe
+    to show the user (everything outside the data block), and ``finish``
+    validates the captured block exactly once and returns the order dict.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._block = []
+        self._state = "text"  # text -> data -> done
+
+    def feed(self, chunk: str) -> str:
+        self._pending += chunk
+        visible = []
+        while self._pending:
+            if self._state == "text":
+                idx = self._pending.find(DATA_START)
+                if idx >= 0:
+                    visible.append(self._pending[:idx])
+                    self._pending = self._pending[idx + len(DATA_START):]
+                    self._state = "data"
+                    continue
+                # Hold back a possible partial marker at the end of the chunk
+                keep = len(DATA_START) - 1
+                if len(self._pending) > keep:
+                    visible.append(self._pending[:-keep])
+                    self._pending = self._pending[-keep:]
+                break
+            if self._state == "data":
+                idx = self._pending.find(DATA_END)
+                if idx >= 0:
+                    self._block.append(self._pending[:idx])
+                    self._pending = self._pending[idx + len(DATA_END):]
+                    self._state = "done"
+                    continue
+                keep = len(DATA_END) - 1
+                if len(self._pending) > keep:
+                    self._block.append(self._pending[:-keep])
+                    self._pending = self._pending[-keep:]
+                break
+            # Anything after the data block is model chatter; drop it
+            self._pending = ""
+        return "".join(visible)
+
+    @property
+    def has_order_block(self) -> bool:
+        return self._state != "text"
+
+    def flush(self) -> str:
+        """Return held-back visible text once the stream has ended."""
+        if self._state == "text":
+            tail, self._pending = self._pending, ""
+            return tail
+        if self._state == "data":
+            # Model forgot ###DATA_END###; take the rest as the block
+            self._block.append(self._pending)
+            self._pending = ""
+        return ""
+
+    def finish(self, allowed_locations: list = None) -> dict:
+        self.flush()
+        if not self.has_order_block:
+            return None
+        return parse_order_block("".join(self._block), allowed_locations)
+
+
+def parse_order_block(block: str, allowed_locations: list = None) -> dict:
+    """Parse the text between the data markers, JSON first, legacy pipe format as fallback."""
+    block = _CODE_FENCE_RE.sub("", block.strip()).strip()
+    if block.startswith("{"):
+        data = parse_json_block(block)
+    else:
+        data = parse_pipe_block(block)
+    if data and allowed_locations:
+        data["c"]["a"] = _canonical_location(data["c"]["a"], allowed_locations)
+    return data
+
+
+def parse_json_block(block: str) -> dict:
+    try:
+        return Order.model_validate_json(block).to_order_data()
+    except ValidationError as e:
+        logger.error(f"Order JSON validation failed: {e.errors()[:3]}")
+    except ValueError as e:
+        logger.error(f"Order JSON decode failed: {e}")
+    return None
+
+
+def parse_pipe_block(data_block: str) -> dict:
+    """Legacy ITEMS/CUSTOMER pipe format."""
+    try:
+        items = []
+        parts = data_block.split("CUSTOMER:")
+        if len(parts) < 2: return None
+
+        items_part = parts[0].replace("ITEMS:", "").strip()
+        cust_part = parts[1].strip()
+
+        for line in items_part.split("\n"):
+            if "|" in line and "فئة|" not in line:
+                p = [x.strip() for x in line.split("|")]
+                if len(p) >= 5:
+                    cat = p[0]
+                    item = p[1]
+                    s1_name = p[2] if len(p) > 2 else ""
+                    s1_val = p[3] if len(p) > 3 else ""
+                    s2_name = p[4] if len(p) > 4 else ""
+                    s2_val = p[5] if len(p) > 5 else ""
+                    s3_name = p[6] if len(p) > 6 else ""
+                    s3_val = p[7] if len(p) > 7 else ""
+                    qty = p[8] if len(p) >= 9 else ""
+                    unit = p[9] if len(p) >= 10 else ""
+
+                    if len(p) >= 11:
+                        full_tech_desc = " ".join([part.strip() for part in p[10:] if part.strip()]).strip()
+                    else:
+                        parts_list = [item, s1_val, s2_val]
+                        if s3_val: parts_list.append(s3_val)
+                        parts_list.extend([qty, unit])
+                        full_tech_desc = " ".join([x for x in parts_list if x]).strip()
+
+                    items.append({
+                        "cat": cat, "item": item,
+                        "s1_n": s1_name, "s1_v": s1_val,
+                        "s2_n": s2_name, "s2_v": s2_val,
+                        "s3_n": s3_name, "s3_v": s3_val,
+                        "qty": qty, "unit": unit, "tech_desc": full_tech_desc
+                    })
+
+        addr = re.search(r"العنوان:\s*(.+)", cust_part)
+        if addr and items and len(addr.group(1).strip()) > 2:
+            location = addr.group(1).strip()
+            return {"items": items, "c": {"a": location}}
+        return None
+    except Exception as e:
+        logger.error(f"Extract error: {e}")
+        return None
+
+
+def _canonical_location(location: str, allowed_locations: list) -> str:
+    """Snap the model's location to the allowed spelling when they only differ in Arabic normalization."""
+    from app.services.ai_service import normalize_arabic
+
+    target = normalize_arabic(location)
+    for allowed in allowed_locations:
+        if normalize_arabic(allowed) == target:
+            return allowed
+    return location
@@ -0,0 +1,363 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.db import models, session
+from app.services import sheet_mirror, sheets_service
+from app.services.circuit_breaker import sheets_breaker
+from app.services.metrics import CLASSIFICATION_QUEUED, metrics
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+class OrderSink(ABC):
+    """Where confirmed orders and their classification rows are stored.
+
+    Rows use the column layout of the "الشات" / "التصنيفات" worksheets
+    (see sheet_mirror.ORDER_COLUMNS and CLASSIFICATION_COLUMNS).
+    """
+
+    name = "base"
+
+    def ready(self) -> bool:
+        return True
+
+    @abstractmethod
+    def next_order_number(self) -> int:
+        ...
+
+    @abstractmethod
+    def write_order(self, order_num, rows):
+        ...
+
+    @abstractmethod
+    def write_classification(self, sh, row):
+        ...
+
+    def write_classifications(self, sh, rows):
+        """Write an order's classification rows together; sinks override this to batch."""
+        for row in rows:
+            self.write_classification(sh, row)
+
+
+class SheetsOrderSink(OrderSink):
+    """Google Sheets, the original behavior."""
+
+    name = "sheets"
+
+    def ready(self):
+        return sheets_service.get_worksheet() is not None
+
+    def next_order_number(self):
+        return sheets_service.get_next_order_number()
+
+    def write_order(self, order_num, rows):
+        sheets_service.append_order_rows(order_num, rows)
+
+    def write_classification(self, sh, row):
+        sheets_service.append_classification_row(sh, row)
+
+    def write_classifications(self, sh, rows):
+        sheets_service.append_classification_rows(sh, rows)
+
+
+class MirrorPushSink(OrderSink):
+    """Replicates rows that SQLOrderSink stored locally by pushing the mirror to Sheets."""
+
+    name = "sheets"
+
+    def ready(self):
+        return SheetsOrderSink().ready()
+
+    def next_order_number(self):
+        # Only used if configured as the primary; the sheet then numbers the orders
+        return SheetsOrderSink().next_order_number()
+
+    def write_order(self, order_num, rows):
+        if self.ready():
+            sheet_mirror.push(sheets_service.worksheet)
+
+    def write_classification(self, sh, row):
+        sheet_mirror.push(sheets_service._sheets_request_with_retry(sh.worksheet, sheet_mirror.CLASSIFICATIONS_WORKSHEET))
+
+    def write_classifications(self, sh, rows):
+        self.write_classification(sh, None)
+
+
+class SQLOrderSink(OrderSink):
+    """The app database (SQLite/Postgres), using the indexed sheet mirror tables.
+
+    Rows are stored with synced=0 so sheet_mirror.push() (or a "sheets" replica)
+    can append them to Google Sheets later.
+    """
+
+    name = "sql"
+
+    def next_order_number(self):
+        db = session.SessionLocal()
+        try:
+            last = db.query(func.max(models.SheetOrderRow.order_num)).scalar()
+            return (last or 1000) + 1
+        finally:
+            db.close()
+
+    def write_order(self, order_num, rows):
+        sheet_mirror.insert_local(sheet_mirror.ORDERS_WORKSHEET, rows)
+
+    def write_classification(self, sh, row):
+        sheet_mirror.insert_local(sheet_mirror.CLASSIFICATIONS_WORKSHEET, [row])
+
+    def write_classifications(self, sh, rows):
+        sheet_mirror.insert_local(sheet_mirror.CLASSIFICATIONS_WORKSHEET, rows)
+
+
+class DegradingOrderSink(OrderSink):
+    """Google Sheets, falling back to the local mirror tables while Sheets is down.
+
+    When the Sheets circuit is open or a Sheets call fails, orders are numbered
+    from the local mirror and stored with synced=0, so customers can still
+    order. Once Sheets answers again the pending rows are pushed in the
+    background on a single worker thread; until that replay finishes, new
+    rows queue behind them locally so the sheet keeps order-number order.
+    Replayed orders whose items were never classified (the taxonomy was
+    unreachable) are classified before the classification rows are pushed.
+    """
+
+    name = "sheets"
+    PENDING_CHECK_SECONDS = 30
+
+    def __init__(self):
+        self.sheets = SheetsOrderSink()
+        self.local = SQLOrderSink()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-replay")
+        self._replay_lock = threading.Lock()
+        self._replay_scheduled = False
+        self._pending = False
+        self._last_pending_check = 0.0
+
+    def _sheets_up(self):
+        return not sheets_breaker.is_open() and self.sheets.ready()
+
+    def next_order_number(self):
+        if self._sheets_up():
+            try:
+                return self.sheets.next_order_number()
+            except Exception as e:
+                logger.warning(f"Sheets order numbering failed, numbering locally: {e}")
+        return self.local.next_order_number()
+
+    def _write(self, method, *args):
+        sheets_up = self._sheets_up()
+        if sheets_up and not self._pending:
+            try:
+                getattr(self.sheets, method)(*args)
+                self._check_pending()
+                return
+            except Exception as e:
+                logger.warning(f"Sheets {method} failed, storing locally: {e}")
+                sheets_up = False
+        getattr(self.local, method)(*args)
+        metrics.incr(f"orders.degraded.{method}")
+        self._pending = True
+        if sheets_up:
+            self._schedule_replay()
+
+    def write_order(self, order_num, rows):
+        self._write("write_order", order_num, rows)
+
+    def write_classification(self, sh, row):
+        self._write("write_classification", sh, row)
+
+    def write_classifications(self, sh, rows):
+        self._write("write_classifications", sh, rows)
+
+    def _check_pending(self):
+        # Rows left unsynced by an earlier process; the check is rate-limited
+        now = time.time()
+        with self._replay_lock:
+            if now - self._last_pending_check < self.PENDING_CHECK_SECONDS:
+                return
+            self._last_pending_check = now
+        if sheet_mirror.pending_titles():
+            self._pending = True
+            self._schedule_replay()
+
+    def _schedule_replay(self):
+        with self._replay_lock:
+            if self._replay_scheduled:
+                return
+            self._replay_scheduled = True
+        self._executor.submit(self._replay)
+
+    def _classify_replayed(self, sh, orders):
+        from app.services.classifier import process_order_classifications
+
+        # Items may have been classified already if Sheets failed only for the order write
+        done = sheet_mirror.classified_item_ids(item_id for items in orders.values() for item_id, _ in items)
+        # Runs on the replay thread while _pending is set, so the rows are stored
+        # locally and go out with the classification push that follows
+        for order_num, items in orders.items():
+            items = [(item_id, text) for item_id, text in items if str(item_id) not in done]
+            if not items:
+                continue
+            try:
+                metrics.incr(CLASSIFICATION_QUEUED, len(items))
+                process_order_classifications(sh, order_num, items)
+            except Exception as e:
+                logger.error(f"Classification of replayed order {order_num} failed: {e}")
+
+    def _replay(self):
+        try:
+            orders = sheet_mirror.pending_order_items()
+            ws = sheets_service.get_worksheet()
+            metrics.incr("orders.replayed", sheet_mirror.push(ws))
+            if orders:
+                self._classify_replayed(ws.spreadsheet, orders)
+            # Orders first (again, for any stored meanwhile) so classification rows never precede their order
+            titles = sheet_mirror.pending_titles()
+            for title in sorted(titles, key=lambda t: t != sheet_mirror.ORDERS_WORKSHEET):
+                if title == sheet_mirror.ORDERS_WORKSHEET:
+                    target = ws
+                else:
+                    target = sheets_service._sheets_request_with_retry(ws.spreadsheet.worksheet, title)
+                pushed = sheet_mirror.push(target)
+                metrics.incr("orders.replayed", pushed)
+        except Exception as e:
+            logger.error(f"Replay of locally stored rows failed: {e}")
+        finally:
+            with self._replay_lock:
+                self._replay_scheduled = False
+        if self._pending and not sheet_mirror.pending_titles():
+            self._pending = False
+
+
+class JsonlOrderSink(OrderSink):
+    """Append-only JSON Lines file, one record per order / classification row."""
+
+    name = "jsonl"
+
+    def __init__(self, path=None):
+        path = Path(path or settings.ORDER_SINK_JSONL_PATH)
+        self.path = path if path.is_absolute() else BACKEND_DIR / path
+        self._lock = threading.Lock()
+        self._last_order_num = None
+
+    def _append(self, record):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def next_order_number(self):
+        with self._lock:
+            if self._last_order_num is None:
+                last = 1000
+                if self.path.exists():
+                    with open(self.path, encoding="utf-8") as f:
+                        for line in f:
+                            rec = json.loads(line)
+                            if rec.get("type") == "order":
+                                last = max(last, int(rec["order_num"]))
+                self._last_order_num = last
+            return self._last_order_num + 1
+
+    def write_order(self, order_num, rows):
+        self._append({"type": "order", "order_num": order_num, "rows": rows})
+        with self._lock:
+            self._last_order_num = max(self._last_order_num or 0, int(order_num))
+
+    def write_classification(self, sh, row):
+        self._append({"type": "classification", "row": row})
+
+
+class FanoutOrderSink(OrderSink):
+    """Writes to the primary sink synchronously and replicates to the others in the background.
+
+    The primary allocates order numbers. Replication runs on a single worker
+    thread so replicas see writes in the same order as the primary.
+    """
+
+    name = "fanout"
+
+    def __init__(self, primary, replicas):
+        self.primary = primary
+        self.replicas = replicas
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-replica")
+
+    def ready(self):
+        return self.primary.ready()
+
+    def next_order_number(self):
+        return self.primary.next_order_number()
+
+    def _replicate(self, method, *args):
+        for replica in self.replicas:
+            def run(replica=replica):
+                try:
+                    getattr(replica, method)(*args)
+                except Exception as e:
+                    logger.error(f"Order replica '{replica.name}' {method} failed: {e}")
+            self._executor.submit(run)
+
+    def write_order(self, order_num, rows):
+        self.primary.write_order(order_num, rows)
+        self._replicate("write_order", order_num, rows)
+
+    def write_classification(self, sh, row):
+        self.primary.write_classification(sh, row)
+        self._replicate("write_classification", sh, row)
+
+    def write_classifications(self, sh, rows):
+        self.primary.write_classifications(sh, rows)
+        self._replicate("write_classifications", sh, rows)
+
+
+_SINK_TYPES = {
+    "sheets": SheetsOrderSink,
+    "sql": SQLOrderSink,
+    "jsonl": JsonlOrderSink,
+}
+
+_order_sink = None
+_order_sink_lock = threading.Lock()
+
+
+def build_order_sink(spec: str) -> OrderSink:
+    """Build a sink from a comma-separated list; the first entry is the primary."""
+    names = [n.strip().lower() for n in (spec or "").split(",") if n.strip()] or ["sheets"]
+    unknown = [n for n in names if n not in _SINK_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown ORDER_SINKS entries: {', '.join(unknown)}")
+    if names[0] == "sheets" and "sql" in names:
+        # The Sheets sink already records its rows in the mirror tables (synced=1); an SQL
+        # replica would store them again as unsynced and the next push would append them twice
+        logger.info("ORDER_SINKS: 'sql' after 'sheets' is covered by the sheet mirror, skipping it")
+        names = [n for n in names if n != "sql"]
+    sinks = []
+    for n in names:
+        # Local SQL rows are replicated by pushing the mirror, so they are not appended twice
+        if n == "sheets" and names[0] == "sql":
+            sinks.append(MirrorPushSink())
+        elif n == "sheets" and n == names[0] and settings.DEGRADED_ORDER_MODE:
+            sinks.append(DegradingOrderSink())
+        else:
+            sinks.append(_SINK_TYPES[n]())
+    if len(sinks) == 1:
+        return sinks[0]
+    return FanoutOrderSink(sinks[0], sinks[1:])
+
+
+def get_order_sink() -> OrderSink:
+    global _order_sink
+    if _order_sink is None:
+        with _order_sink_lock:
+            if _order_sink is None:
+                _order_sink = build_order_sink(settings.ORDER_SINKS)
+    return _order_sink
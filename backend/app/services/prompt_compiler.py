@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+
+TAXONOMY_PLACEHOLDER = "{{TAXONOMY_SUMMARY}}"
+LOCATIONS_PLACEHOLDER = "{{ALLOWED_LOCATIONS}}"
+NO_TAXONOMY = "لا توجد قيود إضافية."
+NO_LOCATIONS = "لا توجد مواقع مقيدة"
+
+
+class PromptCompiler:
+    """Assembles the chat prompt from pre-rendered segments.
+
+    The system prompt is split once per save format around the taxonomy
+    placeholder. The part after it (locations, save format) plus the customer
+    info is rendered once per user and cached; a turn then only joins
+    [head, taxonomy summary, user suffix, history summary, history].
+    Cached users expire after ttl_seconds, and admin changes to users or
+    locations call invalidate().
+    """
+
+    def __init__(self, max_users=1000, ttl_seconds=300):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._templates = {}  # save format -> (head, tail)
+        self._users = OrderedDict()  # user code -> [locations, {save format: suffix}, name, phone, created_at]
+
+    def _template(self, save_format):
+        parts = self._templates.get(save_format)
+        if parts is None:
+            from app.services.ai_service import JSON_SAVE_FORMAT, SAVE_FORMATS, SYSTEM_PROMPT
+            template = SYSTEM_PROMPT + SAVE_FORMATS.get(save_format, JSON_SAVE_FORMAT)
+            head, _, tail = template.partition(TAXONOMY_PLACEHOLDER)
+            parts = self._templates[save_format] = (head, tail)
+        return parts
+
+    def _entry(self, user):
+        # Caller holds self._lock; returns the live entry for this user or None
+        entry = self._users.get(user.code)
+        if entry is None:
+            return None
+        if time.time() - entry[4] > self.ttl_seconds or entry[2] != user.name or entry[3] != user.phone:
+            del self._users[user.code]
+            return None
+        self._users.move_to_end(user.code)
+        return entry
+
+    def _store(self, user, locations):
+        # Caller holds self._lock
+        entry = [locations, {}, user.name, user.phone, time.time()]
+        self._users[user.code] = entry
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return entry
+
+    def locations(self, user):
+        """The user's location names, loaded from the ORM relationship only on a cache miss."""
+        with self._lock:
+            entry = self._entry(user)
+        if entry is None:
+            locations = [loc.name for loc in user.locations]
+            with self._lock:
+                entry = self._store(user, locations)
+        return entry[0]
+
+    def user_suffix(self, user, allowed_locations, save_format):
+        """Everything after the taxonomy summary that is fixed for this user: locations, save format, customer info."""
+        allowed_locations = list(allowed_locations or [])
+        with self._lock:
+            entry = self._entry(user)
+            if entry is None or entry[0] != allowed_locations:
+                entry = self._store(user, allowed_locations)
+            suffix = entry[1].get(save_format)
+            if suffix is not None:
+                return suffix
+        _, tail = self._template(save_format)
+        suffix = (
+            tail.replace(LOCATIONS_PLACEHOLDER, ", ".join(allowed_locations) if allowed_locations else NO_LOCATIONS)
+            + f"\nالاسم: {user.name}\nالجوال: {user.phone}\n"
+        )
+        with self._lock:
+            entry[1][save_format] = suffix
+        return suffix
+
+    def build(self, user, allowed_locations, taxonomy_summary, history_summary, recent_history, save_format):
+        head, _ = self._template(save_format)
+        segments = [head, taxonomy_summary or NO_TAXONOMY, self.user_suffix(user, allowed_locations, save_format)]
+        if history_summary:
+            segments.append(history_summary)
+            segments.append("\n")
+        segments.append("\n".join(recent_history))
+        segments.append("\nالبائع:")
+        return "".join(segments)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            ages = [now - entry[4] for entry in self._users.values()]
+        return {
+            "users": len(ages),
+            "max_users": self.max_users,
+            "ttl_seconds": self.ttl_seconds,
+            "oldest_age_seconds": int(max(ages)) if ages else None,
+        }
+
+    def invalidate(self, user_code=None):
+        with self._lock:
+            if user_code is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_code, None)
+
+
+prompt_compiler = PromptCompiler(settings.PROMPT_CACHE_MAX_USERS, settings.PROMPT_CACHE_TTL_SECONDS)
@@ -0,0 +1,95 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.services.metrics import metrics
+
+# Replies that carry order state are never cached
+_ORDER_STATE_MARKERS = ("DATA_START", "ASK_LOCATION", "ITEM_READY")
+
+
+def normalize_message(text):
+    from app.services.ai_service import normalize_arabic
+    return normalize_arabic(re.sub(r"[^\w\s]", " ", str(text or "").lower()))
+
+
+class ResponseCache:
+    """LRU + TTL cache of chat replies for stateless opening turns.
+
+    Only turns with at most max_history earlier messages are cacheable, so a
+    reply never depends on items or a location collected earlier. The key
+    covers the normalized message, the earlier messages, the taxonomy version
+    and the user's location set.
+    """
+
+    def __init__(self, max_entries=500, ttl_seconds=3600, max_history=2):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> [reply, created_at, hits, message]
+
+    def key_for(self, message, prior_history, taxonomy_version, locations):
+        """Cache key for this turn, or None when the turn depends on conversation state."""
+        if self.max_entries <= 0 or len(prior_history) > self.max_history:
+            return None
+        normalized = normalize_message(message)
+        if not normalized:
+            return None
+        history_hash = hashlib.blake2b(
+            "\n".join(normalize_message(m) for m in prior_history).encode("utf-8"), digest_size=8
+        ).hexdigest()
+        location_set = "|".join(sorted(locations or []))
+        return f"{normalized}\x1f{history_hash}\x1f{taxonomy_version}\x1f{location_set}"
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                entry[2] += 1
+                self._entries.move_to_end(key)
+        metrics.cache("chat_response", hit=entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, reply, user_info=None):
+        """Store a reply unless it carries order state or this customer's details."""
+        if key is None or not reply or any(m in reply for m in _ORDER_STATE_MARKERS):
+            return False
+        if user_info is not None and any(v and v in reply for v in (user_info.name, user_info.phone)):
+            return False
+        with self._lock:
+            self._entries[key] = [reply, time.time(), 0, key.split("\x1f", 1)[0]]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self, top=20):
+        """Size and the most-hit entries (normalized message, hits, age in seconds)."""
+        now = time.time()
+        with self._lock:
+            entries = [(msg, hits, now - created) for _, created, hits, msg in self._entries.values()]
+        entries.sort(key=lambda e: e[1], reverse=True)
+        return {
+            "size": len(entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "entries": [{"message": m, "hits": h, "age_seconds": int(a)} for m, h, a in entries[:top]],
+        }
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_MAX_ENTRIES, settings.RESPONSE_CACHE_TTL_SECONDS, settings.RESPONSE_CACHE_MAX_HISTORY
+)
@@ -0,0 +1,88 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_A1_RANGE_RE = re.compile(r"^([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+BORDER_COLOR = {"red": 0.8, "green": 0.8, "blue": 0.8}
+
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+
+def grid_range(sheet_id, updated_range):
+    """Convert an append response's updatedRange ("'الشات'!A12:K14") to a GridRange dict."""
+    a1 = updated_range.split("!")[-1].replace("$", "")
+    m = _A1_RANGE_RE.match(a1)
+    if not m:
+        return None
+    start_col, start_row, end_col, end_row = m.group(1), int(m.group(2)), m.group(3) or m.group(1), int(m.group(4) or m.group(2))
+    return {
+        "sheetId": sheet_id,
+        "startRowIndex": start_row - 1,
+        "endRowIndex": end_row,
+        "startColumnIndex": _col_index(start_col) - 1,
+        "endColumnIndex": _col_index(end_col),
+    }
+
+
+def updated_range_of(append_response):
+    if not append_response:
+        return None
+    return (append_response.get("updates") or {}).get("updatedRange")
+
+
+class SheetFormatQueue:
+    """Collects row formatting for freshly appended rows and sends it as one batch_update.
+
+    Ranges come straight from the append response, so no extra reads are
+    needed to find where the rows landed.
+    """
+
+    def __init__(self, spreadsheet, request_runner=None):
+        self.spreadsheet = spreadsheet
+        self._requests = []
+        # Optional wrapper such as sheets_service._sheets_request_with_retry
+        self._run = request_runner or (lambda func, *args, **kwargs: func(*args, **kwargs))
+
+    def __len__(self):
+        return len(self._requests)
+
+    def background(self, ws, updated_range, color):
+        rng = grid_range(ws.id, updated_range) if updated_range else None
+        if rng:
+            self._requests.append({
+                "repeatCell": {
+                    "range": rng,
+                    "cell": {"userEnteredFormat": {"backgroundColor": color}},
+                    "fields": "userEnteredFormat.backgroundColor",
+                }
+            })
+
+    def borders(self, ws, updated_range, color=BORDER_COLOR):
+        rng = grid_range(ws.id, updated_range) if updated_range else None
+        if rng:
+            style = {"style": "SOLID", "color": color}
+            self._requests.append({
+                "updateBorders": {
+                    "range": rng,
+                    "top": style, "bottom": style, "left": style, "right": style,
+                    "innerHorizontal": style, "innerVertical": style,
+                }
+            })
+
+    def flush(self):
+        """Send all queued formatting in a single API call."""
+        if not self._requests:
+            return None
+        requests, self._requests = self._requests, []
+        try:
+            return self._run(self.spreadsheet.batch_update, {"requests": requests})
+        except Exception as e:
+            logger.error(f"Error applying {len(requests)} queued format requests: {e}")
+            return None
@@ -0,0 +1,333 @@
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import func, insert
+
+from app.db import models, session
+from app.services import sheet_writes
+from app.services.taxonomy_learner import sub_key
+
+logger = logging.getLogger(__name__)
+
+ORDERS_WORKSHEET = "الشات"
+CLASSIFICATIONS_WORKSHEET = "التصنيفات"
+
+# Column order as written by sheets_service.save_to_sheet
+ORDER_COLUMNS = [
+    "order_num", "timestamp", "customer_name", "phone", "location", "summary",
+    "category", "short_desc", "quantity", "unit", "tech_desc",
+]
+# Column order as written by classifier.process_order_classifications
+CLASSIFICATION_COLUMNS = [
+    "item_id", "original", "basic_ar", "basic_en", "main_ar", "main_en", "sub_ar", "sub_en",
+    "spec1_name", "spec1_val", "spec2_name", "spec2_val", "spec3_name", "spec3_val",
+    "code", "classified_at",
+]
+
+# Only append-only worksheets are mirrored; "الاساسي" is edited in place by admins.
+MIRRORS = {
+    ORDERS_WORKSHEET: (models.SheetOrderRow, ORDER_COLUMNS),
+    CLASSIFICATIONS_WORKSHEET: (models.SheetClassificationRow, CLASSIFICATION_COLUMNS),
+}
+
+_locks = {title: threading.Lock() for title in MIRRORS}
+
+
+def _col_letter(n):
+    result = ""
+    while n > 0:
+        n -= 1
+        result = chr(65 + n % 26) + result
+        n //= 26
+    return result
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _row_values(title, row, sheet_row, synced=1):
+    model, columns = MIRRORS[title]
+    values = {col: (str(row[i]) if i < len(row) and row[i] is not None else "") for i, col in enumerate(columns)}
+    if model is models.SheetOrderRow:
+        values["order_num"] = _to_int(values["order_num"])
+    else:
+        values["sub_key"] = sub_key(values["sub_en"])
+    values["sheet_row"] = sheet_row
+    values["synced"] = synced
+    return values
+
+
+def _first_row_of(updated_range):
+    a1 = updated_range.split("!")[-1].split(":")[0]
+    return int("".join(ch for ch in a1 if ch.isdigit()))
+
+
+def _get_state(db, title):
+    state = db.get(models.SheetSyncState, title)
+    if state is None:
+        state = models.SheetSyncState(worksheet=title, last_row=1)
+        db.add(state)
+        db.flush()
+    return state
+
+
+def _sheets_call(func, *args):
+    # Only the gspread call goes through the Sheets retry/circuit breaker, not the local database work
+    from app.services import sheets_service
+    return sheets_service._sheets_request_with_retry(func, *args)
+
+
+def pull(ws, db=None):
+    """Mirror rows appended to the worksheet since the last sync. Returns the number of new rows."""
+    title = ws.title
+    model, columns = MIRRORS[title]
+    own_db = db is None
+    db = db or session.SessionLocal()
+    try:
+        with _locks[title]:
+            state = _get_state(db, title)
+            start = state.last_row + 1
+            values = _sheets_call(ws.get, f"A{start}:{_col_letter(len(columns))}") or []
+            if not values:
+                db.commit()
+                return 0
+            end = start + len(values) - 1
+            known = {r for (r,) in db.query(model.sheet_row).filter(model.sheet_row.between(start, end))}
+            new_rows = [
+                _row_values(title, row, start + offset)
+                for offset, row in enumerate(values)
+                if start + offset not in known and any(str(v).strip() for v in row)
+            ]
+            if new_rows:
+                db.execute(insert(model), new_rows)
+            state.last_row = end
+            state.last_synced_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            db.commit()
+            if new_rows:
+                logger.info(f"Mirror pulled {len(new_rows)} rows from '{title}' (rows {start}-{end})")
+            return len(new_rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if own_db:
+            db.close()
+
+
+def resync(ws):
+    """Drop the local mirror of a worksheet and pull it again from row 2."""
+    title = ws.title
+    model, _ = MIRRORS[title]
+    db = session.SessionLocal()
+    try:
+        with _locks[title]:
+            db.query(model).filter(model.synced == 1).delete()
+            _get_state(db, title).last_row = 1
+            db.commit()
+        return pull(ws, db)
+    finally:
+        db.close()
+
+
+def record_appended(title, rows, updated_range):
+    """Store rows we just appended to the sheet so the next pull does not download them again."""
+    if not rows or not updated_range:
+        return
+    model, _ = MIRRORS[title]
+    first = _first_row_of(updated_range)
+    db = session.SessionLocal()
+    try:
+        with _locks[title]:
+            # A pull running between the append and this call may have mirrored the rows already
+            end = first + len(rows) - 1
+            known = {r for (r,) in db.query(model.sheet_row).filter(model.sheet_row.between(first, end))}
+            new_rows = [_row_values(title, row, first + i) for i, row in enumerate(rows) if first + i not in known]
+            if new_rows:
+                db.execute(insert(model), new_rows)
+            state = _get_state(db, title)
+            if state.last_row == first - 1:
+                state.last_row = first + len(rows) - 1
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Mirror record error for '{title}': {e}")
+    finally:
+        db.close()
+
+
+def insert_local(title, rows):
+    """Queue rows locally (synced=0); push() appends them to the sheet later."""
+    model, _ = MIRRORS[title]
+    db = session.SessionLocal()
+    try:
+        db.execute(insert(model), [_row_values(title, row, None, synced=0) for row in rows])
+        db.commit()
+    finally:
+        db.close()
+
+
+def pending_titles():
+    """Worksheets that have locally inserted rows not pushed yet."""
+    db = session.SessionLocal()
+    try:
+        return [
+            title for title, (model, _) in MIRRORS.items()
+            if db.query(model.id).filter(model.synced == 0).first() is not None
+        ]
+    finally:
+        db.close()
+
+
+def pending_order_items():
+    """{order_num: [(item_id, tech_desc), ...]} for order rows inserted locally and not pushed yet.
+
+    Item ids follow the ones sheets_service gives an order's items: the order
+    number alone for a single item, "<order>-<n>" otherwise.
+    """
+    db = session.SessionLocal()
+    try:
+        orders = {}
+        for order_num, tech_desc in (
+            db.query(models.SheetOrderRow.order_num, models.SheetOrderRow.tech_desc)
+            .filter(models.SheetOrderRow.synced == 0)
+            .order_by(models.SheetOrderRow.id)
+        ):
+            orders.setdefault(order_num, []).append(tech_desc or "")
+        return {
+            order_num: [(f"{order_num}-{i + 1}" if len(descs) > 1 else order_num, desc) for i, desc in enumerate(descs)]
+            for order_num, descs in orders.items()
+        }
+    finally:
+        db.close()
+
+
+def classified_item_ids(item_ids):
+    """The given item ids (as strings) that already have a mirrored classification row."""
+    item_ids = [str(item_id) for item_id in item_ids]
+    if not item_ids:
+        return set()
+    db = session.SessionLocal()
+    try:
+        model = models.SheetClassificationRow
+        return {item_id for (item_id,) in db.query(model.item_id).filter(model.item_id.in_(item_ids))}
+    finally:
+        db.close()
+
+
+def stats(title):
+    """Row counts and sync position of one mirrored worksheet."""
+    model, _ = MIRRORS[title]
+    db = session.SessionLocal()
+    try:
+        state = db.get(models.SheetSyncState, title)
+        return {
+            "rows": db.query(func.count(model.id)).scalar(),
+            "pending_push": db.query(func.count(model.id)).filter(model.synced == 0).scalar(),
+            "last_row": state.last_row if state else None,
+            "last_synced_at": state.last_synced_at if state else None,
+        }
+    finally:
+        db.close()
+
+
+def push(ws):
+    """Append locally inserted rows to the worksheet and mark them synced. Returns rows pushed."""
+    title = ws.title
+    model, columns = MIRRORS[title]
+    db = session.SessionLocal()
+    try:
+        with sheet_writes.writer(title).turn(), _locks[title]:
+            pending = db.query(model).filter(model.synced == 0).order_by(model.id).all()
+            if not pending:
+                return 0
+            rows = [[getattr(obj, col) if getattr(obj, col) is not None else "" for col in columns] for obj in pending]
+            res = _sheets_call(ws.append_rows, rows)
+            updated_range = (res or {}).get("updates", {}).get("updatedRange")
+            first = _first_row_of(updated_range) if updated_range else None
+            for i, obj in enumerate(pending):
+                obj.sheet_row = first + i if first else None
+                obj.synced = 1
+            state = _get_state(db, title)
+            if first and state.last_row == first - 1:
+                state.last_row = first + len(rows) - 1
+            db.commit()
+            logger.info(f"Mirror pushed {len(rows)} local rows to '{title}'")
+            return len(rows)
+    finally:
+        db.close()
+
+
+def next_order_number(ws):
+    """Next order number from the mirror after an incremental pull of the orders sheet."""
+    db = session.SessionLocal()
+    try:
+        pull(ws, db)
+        last = db.query(func.max(models.SheetOrderRow.order_num)).scalar()
+        return (last or 1000) + 1
+    finally:
+        db.close()
+
+
+_sub_keys_checked = False
+
+
+def rekey_classifications(db=None):
+    """Rewrite sub_key on mirrored classification rows keyed by another normalization. Returns rows changed.
+
+    Rows mirrored before sub_key matched the code index's normalization were
+    keyed by strip().lower() only.
+    """
+    global _sub_keys_checked
+    own_db = db is None
+    db = db or session.SessionLocal()
+    try:
+        model = models.SheetClassificationRow
+        with _locks[CLASSIFICATIONS_WORKSHEET]:
+            changed = [
+                {"id": row_id, "sub_key": sub_key(sub_en)}
+                for row_id, sub_en, key in db.query(model.id, model.sub_en, model.sub_key)
+                if sub_key(sub_en) != key
+            ]
+            if changed:
+                db.bulk_update_mappings(model, changed)
+                db.commit()
+                logger.info(f"Re-keyed {len(changed)} mirrored classification rows")
+        _sub_keys_checked = True
+        return len(changed)
+    finally:
+        if own_db:
+            db.close()
+
+
+def find_classification_codes(sub_en):
+    """Indexed lookup of (spec1_val, spec2_val, spec3_val, code) already assigned to a sub-category."""
+    db = session.SessionLocal()
+    try:
+        if not _sub_keys_checked:
+            rekey_classifications(db)
+        return db.query(
+            models.SheetClassificationRow.spec1_val,
+            models.SheetClassificationRow.spec2_val,
+            models.SheetClassificationRow.spec3_val,
+            models.SheetClassificationRow.code,
+        ).filter(
+            models.SheetClassificationRow.sub_key == sub_key(sub_en),
+            models.SheetClassificationRow.code != "",
+        ).order_by(models.SheetClassificationRow.sheet_row).all()
+    finally:
+        db.close()
+
+
+def row_count(ws):
+    """Number of worksheet rows (including the header) after an incremental pull."""
+    db = session.SessionLocal()
+    try:
+        pull(ws, db)
+        return _get_state(db, ws.title).last_row
+    finally:
+        db.close()
@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+from app.services.sheet_mirror import CLASSIFICATION_COLUMNS
+from app.services.taxonomy_learner import TAXONOMY_FIELDS
+
+# Fixed-width, immutable rows for "الاساسي" and "التصنيفات". They are tuples, so
+# code that indexes rows by the current layout (row[5], len(row) >= 6) works
+# unchanged, and fields can also be read by name (row.sub_en). Rows are padded
+# or cut to that layout, so readers of other column layouts need the raw rows.
+TaxonomyRow = namedtuple("TaxonomyRow", TAXONOMY_FIELDS)
+ClassificationRow = namedtuple("ClassificationRow", CLASSIFICATION_COLUMNS)
+
+# Classification columns that repeat across rows (categories, spec names and
+# values, codes); item ids, originals and timestamps are mostly unique.
+_CLASSIFICATION_SHARED = tuple(
+    name not in ("item_id", "original", "classified_at") for name in CLASSIFICATION_COLUMNS
+)
+_TAXONOMY_SHARED = (True,) * len(TAXONOMY_FIELDS)
+
+
+class StringPool:
+    """Interns repeated cell values so equal strings share one object.
+
+    One pool per snapshot: the strings go away with the snapshot, unlike
+    sys.intern.
+    """
+
+    def __init__(self):
+        self._strings = {}
+
+    def __call__(self, value):
+        return self._strings.setdefault(value, value)
+
+    def __len__(self):
+        return len(self._strings)
+
+
+def _records(record, shared, values, pool):
+    pool = StringPool() if pool is None else pool  # an empty pool is falsy (__len__)
+    intern = pool._strings.setdefault
+    width = len(shared)
+    padding = [""] * width
+    records = []
+    for row in values:
+        if not any(str(cell).strip() for cell in row):
+            continue
+        cells = [str(cell) for cell in row[:width]] + padding[len(row):]
+        records.append(record._make([intern(c, c) if s else c for c, s in zip(cells, shared)]))
+    return records
+
+
+def taxonomy_rows(values, pool=None):
+    """TaxonomyRow records for "الاساسي" rows from get_all_values() (header excluded); blank rows are dropped."""
+    return _records(TaxonomyRow, _TAXONOMY_SHARED, values, pool)
+
+
+def classification_rows(values, pool=None):
+    """ClassificationRow records for "التصنيفات" rows from get_all_values() (header excluded)."""
+    return _records(ClassificationRow, _CLASSIFICATION_SHARED, values, pool)
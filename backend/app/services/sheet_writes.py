@@ -0,0 +1,89 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class WorksheetWriter:
+    """Orders writes to one worksheet.
+
+    Each write takes a ticket and runs when its ticket comes up, so appends
+    land in the order they were reserved and the mirror's row tracking stays
+    contiguous. Writes to different worksheets do not wait for each other.
+    The thread holding the turn may re-enter it (e.g. a sink pushing the
+    mirror from inside an order write).
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._owner = None
+
+    def reserve(self):
+        """Take a place in line; the caller must enter turn(ticket) afterwards."""
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            return ticket
+
+    @contextmanager
+    def turn(self, ticket=None):
+        if self._owner == threading.get_ident():
+            yield
+            return
+        if ticket is None:
+            ticket = self.reserve()
+        with self._cond:
+            self._cond.wait_for(lambda: self._serving == ticket)
+            self._owner = threading.get_ident()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._owner = None
+                self._serving += 1
+                self._cond.notify_all()
+
+    def queued(self):
+        with self._cond:
+            return self._next_ticket - self._serving
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def writer(title):
+    """The WorksheetWriter for a worksheet title."""
+    w = _writers.get(title)
+    if w is None:
+        with _writers_lock:
+            w = _writers.setdefault(title, WorksheetWriter(title))
+    return w
+
+
+class OrderNumberAllocator:
+    """The one serialized step of saving an order.
+
+    Numbers come from the sink, but never go below the last number handed out
+    by this process, so an order still being written cannot be numbered twice.
+    The worksheet ticket is reserved under the same lock, so orders are
+    appended in number order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = 0
+
+    def allocate(self, next_number, title):
+        """Returns (order_num, ticket); enter writer(title).turn(ticket) right after."""
+        with self._lock:
+            order_num = max(int(next_number()), self._last + 1)
+            self._last = order_num
+            return order_num, writer(title).reserve()
+
+
+order_numbers = OrderNumberAllocator()
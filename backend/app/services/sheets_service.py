@@ -1,21 +1,37 @@
-import gspread
 import logging
 import json
-import os
 import time
 import threading
 from datetime import datetime
-from google.oauth2.service_account import Credentials
 from app.core.config import settings
+from concurrent.futures import ThreadPoolExecutor
+from app.services import sheet_mirror, sheet_writes
+from app.services.circuit_breaker import CircuitOpenError, sheets_breaker
+from app.services.metrics import metrics, is_rate_limit_error, CLASSIFICATION_QUEUED
+from app.services.order_events import CLASSIFICATION_COMPLETE, ORDER_SAVED, order_events
+from app.services.sheet_formatter import SheetFormatQueue, updated_range_of
 
 logger = logging.getLogger(__name__)
 
 worksheet = None
-_sheets_lock = threading.Lock()  # Prevent concurrent writes
+_format_pool = None  # Row colouring runs off the write path
+_format_pool_lock = threading.Lock()
 _gc_client = None  # Shared gspread client
+_init_lock = threading.Lock()
+_last_init_attempt = 0.0
 
 _FORMULA_PREFIXES = ("=", "+", "-", "@")
 
+# Alternating background colors so rows of the same order stand out
+ORDER_COLORS = [
+    {"red": 0.95, "green": 0.98, "blue": 1.0},
+    {"red": 1.0, "green": 0.98, "blue": 0.95},
+    {"red": 0.95, "green": 1.0, "blue": 0.95},
+    {"red": 0.98, "green": 0.95, "blue": 1.0},
+    {"red": 1.0, "green": 0.95, "blue": 0.98},
+    {"red": 1.0, "green": 1.0, "blue": 1.0},
+]
+
 def _sanitize_for_sheets(value):
     """
     Prevent Google Sheets from interpreting untrusted text as formulas.
@@ -31,6 +47,7 @@ def _sanitize_for_sheets(value):
 def init_google_sheets():
     global worksheet, _gc_client
     try:
+        import gspread  # deferred: pulls in google-auth and requests
         creds_json = settings.GOOGLE_CREDENTIALS_JSON
         if creds_json:
             # Handle Base64 encoding if the user used it for Vercel
@@ -60,25 +77,55 @@ def init_google_sheets():
     except Exception as e:
         logger.error(f"❌ Sheets Init Error: {e}")
 
+def get_worksheet():
+    """The "الشات" worksheet, connecting on first use.
+
+    After a failed attempt, callers get None until SHEETS_INIT_RETRY_SECONDS
+    have passed, so an outage does not add a credentials round-trip to every request.
+    """
+    global _last_init_attempt
+    if worksheet is None:
+        with _init_lock:
+            if worksheet is None and time.time() - _last_init_attempt >= settings.SHEETS_INIT_RETRY_SECONDS:
+                _last_init_attempt = time.time()
+                init_google_sheets()
+    return worksheet
+
 def get_next_order_number():
     if not worksheet: return 1001
+    try:
+        # Incremental pull into the local mirror (the sheet read goes through the breaker), then an indexed MAX(order_num)
+        return sheet_mirror.next_order_number(worksheet)
+    except CircuitOpenError:
+        raise  # the caller numbers the order locally instead
+    except Exception as e:
+        logger.error(f"Mirror order number error, falling back to sheet read: {e}")
     try:
         # Use retry mechanism since we are hitting the API
         values = _sheets_request_with_retry(worksheet.col_values, 1)
         if not values or len(values) <= 1: return 1001
         return int(values[-1]) + 1
+    except CircuitOpenError:
+        raise
     except:
         return 1001
 
 def _sheets_request_with_retry(func, *args, max_retries=4, **kwargs):
-    """Execute a Google Sheets API call with exponential backoff for rate limiting."""
+    """Execute a Google Sheets API call with exponential backoff for rate limiting.
+
+    Calls go through the Sheets circuit breaker; while it is open this raises
+    CircuitOpenError at once instead of waiting through the backoff.
+    """
+    import gspread
     delay = 2
     for attempt in range(max_retries):
         try:
-            return func(*args, **kwargs)
+            with metrics.timed("sheets"):
+                return sheets_breaker.call(func, *args, **kwargs)
         except gspread.exceptions.APIError as e:
-            if '429' in str(e) or 'RATE_LIMIT' in str(e).upper() or 'Quota' in str(e):
-                if attempt < max_retries - 1:
+            if is_rate_limit_error(e):
+                metrics.incr("sheets.429")
+                if attempt < max_retries - 1 and not sheets_breaker.is_open():
                     logger.warning(f"⚠️ Google Sheets rate limit hit. Retrying in {delay}s... (attempt {attempt+1})")
                     time.sleep(delay)
                     delay *= 2  # Exponential backoff
@@ -87,19 +134,91 @@ def _sheets_request_with_retry(func, *args, max_retries=4, **kwargs):
     return None
 
 
-def save_to_sheet(data, summary, user_info, background_tasks=None):
-    global worksheet
-    if not worksheet:
-        init_google_sheets()
-        if not worksheet: return None
+def append_order_rows(order_num, rows):
+    """Append an order's rows to "الشات", colour them, and record them in the local mirror."""
+    if not worksheet or not rows:
+        return None
+    ws = worksheet
+    with sheet_writes.writer(sheet_mirror.ORDERS_WORKSHEET).turn():
+        res = _sheets_request_with_retry(ws.append_rows, rows)
+        updated_range = updated_range_of(res)
+        if updated_range:
+            sheet_mirror.record_appended(sheet_mirror.ORDERS_WORKSHEET, rows, updated_range)
+
+    # Apply color to the appended rows based on order_num (one batch_update, range from the append
+    # response). It does not affect other writes, so it runs in the background.
+    if updated_range:
+        color = ORDER_COLORS[order_num % len(ORDER_COLORS)]
+        formatter = SheetFormatQueue(ws.spreadsheet, _sheets_request_with_retry)
+        formatter.background(ws, updated_range, color)
+        _get_format_pool().submit(formatter.flush)
+    return res
+
+
+def _get_format_pool():
+    global _format_pool
+    if _format_pool is None:
+        with _format_pool_lock:
+            if _format_pool is None:
+                _format_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sheet-format")
+    return _format_pool
+
+
+def append_classification_row(sh, row):
+    """Append one classification row to "التصنيفات" and record it in the local mirror."""
+    return append_classification_rows(sh, [row])
+
+
+def append_classification_rows(sh, rows):
+    """Append classification rows to "التصنيفات" in one call and record them in the local mirror."""
+    if not rows:
+        return None
+    ws = _sheets_request_with_retry(sh.worksheet, sheet_mirror.CLASSIFICATIONS_WORKSHEET)
+    with sheet_writes.writer(sheet_mirror.CLASSIFICATIONS_WORKSHEET).turn():
+        res = _sheets_request_with_retry(ws.append_rows, rows)
+        sheet_mirror.record_appended(sheet_mirror.CLASSIFICATIONS_WORKSHEET, rows, updated_range_of(res))
+    return res
+
+
+def save_to_sheet(data, summary, user_info, background_tasks=None, idempotency_key=None, history=None):
+    """Save an order and queue its classification; returns the order number or None.
+
+    A retried chat turn does not write the same order (same items and
+    location) again but gets the first order number back. The turn is the
+    client's idempotency_key (kept IDEMPOTENCY_WINDOW_SECONDS) or, without
+    one, the conversation history that produced the order (kept
+    IDEMPOTENCY_RETRY_SECONDS). Without either the order is always written.
+    """
+    from app.services.idempotency import ORDER, idempotency, order_fingerprint
+
+    if idempotency_key:
+        key, window = order_fingerprint(data, f"key:{idempotency_key}"), None
+    elif history is not None:
+        key, window = order_fingerprint(data, "history:" + "\n".join(history)), settings.IDEMPOTENCY_RETRY_SECONDS
+    else:
+        return _save_order(data, summary, user_info, background_tasks)
+    order_num, replayed = idempotency.run(
+        ORDER, user_info.code, key, lambda: _save_order(data, summary, user_info, background_tasks),
+        window_seconds=window,
+    )
+    if replayed:
+        logger.info(f"Duplicate order from {user_info.code}, returning order {order_num}")
+    return order_num
+
+
+def _save_order(data, summary, user_info, background_tasks=None):
+    from app.services.order_sinks import get_order_sink
+
+    sink = get_order_sink()
+    if not sink.ready():
+        return None
 
     try:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-        res = None
 
-        # ✅ Lock ensures only one write happens at a time AND numbering is sequential
-        with _sheets_lock:
-            order_num = get_next_order_number()
+        # Only numbering is serialized; the ticket keeps appends to "الشات" in number order
+        order_num, ticket = sheet_writes.order_numbers.allocate(sink.next_order_number, sheet_mirror.ORDERS_WORKSHEET)
+        with sheet_writes.writer(sheet_mirror.ORDERS_WORKSHEET).turn(ticket):
             rows = []
 
             for item in data.get('items', []):
@@ -121,35 +240,43 @@ def save_to_sheet(data, summary, user_info, background_tasks=None):
                 rows.append(row)
 
             if rows:
-                res = _sheets_request_with_retry(worksheet.append_rows, rows)
-            
-            # Apply color to the appended rows based on order_num
-            if res:
-                try:
-                    updated_range = res.get('updates', {}).get('updatedRange')
-                    if updated_range:
-                        colors = [
-                            {"red": 0.95, "green": 0.98, "blue": 1.0},
-                            {"red": 1.0, "green": 0.98, "blue": 0.95},
-                            {"red": 0.95, "green": 1.0, "blue": 0.95},
-                            {"red": 0.98, "green": 0.95, "blue": 1.0},
-                            {"red": 1.0, "green": 0.95, "blue": 0.98},
-                            {"red": 1.0, "green": 1.0, "blue": 1.0},
-                        ]
-                        color = colors[order_num % len(colors)]
-                        clean_range = updated_range.split("!")[-1] if "!" in updated_range else updated_range
-                        _sheets_request_with_retry(worksheet.format, clean_range, {"backgroundColor": color})
-                except Exception as e:
-                    logger.error(f"Error styling rows: {e}")
-
-            # Classification in background (non-blocking)
-            from app.services.classifier import process_and_save_classification
-            for idx, row in enumerate(rows):
-                item_id = f"{order_num}-{idx+1}" if len(rows) > 1 else order_num
-                if background_tasks:
-                    background_tasks.add_task(process_and_save_classification, worksheet.spreadsheet, item_id, row[10])
+                sink.write_order(order_num, rows)
+                metrics.record_order(data.get('c', {}).get('a', ''), user_info.code, len(rows))
+        if rows:
+            order_events.publish(user_info.code, {"type": ORDER_SAVED, "order_num": order_num, "items": len(rows)})
+
+        # Classification needs the taxonomy in the spreadsheet.
+        # One task per order: its items are classified in parallel on the classifier pool.
+        from app.services.speculative_classifier import speculative_classifier
+        ws = get_worksheet() if background_tasks and rows else None
+        if ws and sheets_breaker.is_open():
+            # Degraded: the order was stored locally and the taxonomy is unreachable;
+            # DegradingOrderSink classifies it when it replays the order
+            metrics.incr("classification.skipped_degraded", len(rows))
+            ws = None
+        if ws:
+            items = [
+                (f"{order_num}-{idx+1}" if len(rows) > 1 else order_num, row[10])
+                for idx, row in enumerate(rows)
+            ]
+            metrics.incr(CLASSIFICATION_QUEUED, len(items))
+            # Items classified speculatively during the chat are picked up here; the "التصنيفات"
+            # write always runs after the reply, even when every result is already in
+            prefetched = speculative_classifier.take(user_info.code, items)
+            background_tasks.add_task(_classify_order, ws.spreadsheet, order_num, items, prefetched, user_info.code)
         
         return order_num
     except Exception as e:
         logger.error(f"Sheet error: {e}")
         return None
+
+
+def _classify_order(sh, order_num, items, prefetched, user_code):
+    """Classify an order's items, then tell the user's open chat connections."""
+    from app.services.classifier import process_order_classifications
+
+    saved = process_order_classifications(sh, order_num, items, prefetched)
+    order_events.publish(user_code, {
+        "type": CLASSIFICATION_COMPLETE, "order_num": order_num, "classified": saved, "total": len(items),
+    })
+    return saved
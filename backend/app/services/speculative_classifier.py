@@ -0,0 +1,148 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.services.metrics import metrics
+from app.services.taxonomy_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Hidden line the chat model adds when an item's specs and quantity are complete:
+#   ###ITEM_READY### <the item's full technical description>
+ITEM_READY = "###ITEM_READY###"
+_ITEM_READY_RE = re.compile(r"#*ITEM_READY#*[ \t]*:?[ \t]*(.*)")
+
+
+def extract_ready_items(reply):
+    """Strip ITEM_READY lines from a chat reply. Returns (visible_reply, [descriptions])."""
+    if "ITEM_READY" not in reply:
+        return reply, []
+    kept, items = [], []
+    for line in reply.splitlines():
+        m = _ITEM_READY_RE.search(line)
+        if not m:
+            kept.append(line)
+            continue
+        desc = m.group(1).strip().strip("`").strip()
+        if desc:
+            items.append(desc)
+        before = line[:m.start()].rstrip()
+        if before:
+            kept.append(before)
+    return "\n".join(kept).strip(), items
+
+
+class ReadyItemFilter:
+    """Drops ITEM_READY lines from a reply as it streams in.
+
+    Text is passed through as it arrives, except for the current line while it
+    could still turn into a marker; that part is held until the line ends.
+    """
+
+    def __init__(self):
+        self._line = ""
+
+    @staticmethod
+    def _may_be_marker(text):
+        if "#" in text or "ITEM_READY" in text:
+            return True
+        return any(text.endswith("ITEM_READY"[:i]) for i in range(1, len("ITEM_READY")))
+
+    @staticmethod
+    def _visible(line):
+        m = _ITEM_READY_RE.search(line)
+        return line if not m else line[:m.start()].rstrip()
+
+    def feed(self, chunk):
+        self._line += chunk
+        visible = []
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            if _ITEM_READY_RE.search(line):
+                line = self._visible(line)
+                if not line:
+                    continue
+            visible.append(line + "\n")
+        if self._line and not self._may_be_marker(self._line):
+            visible.append(self._line)
+            self._line = ""
+        return "".join(visible)
+
+    def flush(self):
+        line, self._line = self._line, ""
+        return self._visible(line)
+
+
+class SpeculativeClassifier:
+    """Classifies items while the customer is still chatting, before the order is saved.
+
+    Results are Futures from classifier.submit_classification, kept per user
+    and keyed by the normalized description. When the order is saved, items
+    whose final description matches reuse the Future instead of calling
+    Gemini again. Anything not claimed within the TTL is dropped.
+    """
+
+    def __init__(self, ttl_seconds=1800, max_per_user=50):
+        self.ttl_seconds = ttl_seconds
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._entries = {}  # user code -> OrderedDict(desc key -> (future, created_at))
+
+    def _prune(self, now):
+        # Caller holds self._lock
+        for user_code in list(self._entries):
+            entries = self._entries[user_code]
+            for key in [k for k, (_, created) in entries.items() if now - created > self.ttl_seconds]:
+                del entries[key]
+            if not entries:
+                del self._entries[user_code]
+
+    def schedule(self, user_code, sh, descriptions):
+        """Start classifying descriptions that are not already in flight. Returns how many were started."""
+        from app.services.classifier import submit_classification
+
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            known = set(self._entries.get(user_code, ()))
+        new = {}
+        for desc in descriptions:
+            key = normalize_text(desc)
+            if key and key not in known and key not in new:
+                new[key] = desc
+
+        # Submitting may read the taxonomy, so it happens outside the lock
+        futures = {key: submit_classification(sh, f"spec-{user_code}", desc) for key, desc in new.items()}
+        started = len(futures)
+        with self._lock:
+            entries = self._entries.setdefault(user_code, OrderedDict())
+            for key, future in futures.items():
+                entries.setdefault(key, (future, now))
+            while len(entries) > self.max_per_user:
+                entries.popitem(last=False)
+        if started:
+            metrics.incr("speculative.started", started)
+            logger.info(f"Speculative classification started for {started} item(s) of user {user_code}")
+        return started
+
+    def take(self, user_code, items):
+        """Claim results for (item_id, text) pairs of a saved order. Returns {item_id: future}."""
+        claimed = {}
+        with self._lock:
+            self._prune(time.time())
+            entries = self._entries.pop(user_code, {})
+        for item_id, text in items:
+            entry = entries.pop(normalize_text(text), None)
+            metrics.cache("speculative", hit=entry is not None)
+            if entry is not None:
+                claimed[item_id] = entry[0]
+        if entries:
+            # Items discussed but not ordered
+            metrics.incr("speculative.unused", len(entries))
+        return claimed
+
+
+speculative_classifier = SpeculativeClassifier(settings.SPECULATIVE_TTL_SECONDS)
@@ -0,0 +1,127 @@
+import math
+import re
+from collections import defaultdict
+
+NGRAM = 3
+
+# Column layout of "الاساسي": [BasicAr, BasicEn, MainAr, MainEn, SubAr, SubEn, Spec1, Spec2, Spec3]
+# Sub-category names are what customers actually type, so they count double.
+_FIELD_WEIGHTS = ((0, 1), (1, 1), (2, 1), (3, 1), (4, 2), (5, 2))
+
+
+def normalize_text(text):
+    text = str(text or "").lower()
+    text = re.sub("[إأآا]", "ا", text)
+    text = re.sub("ى", "ي", text)
+    text = re.sub("ة", "ه", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def char_ngrams(text):
+    """Character n-grams per word, padded so short words and word edges still match."""
+    grams = []
+    for word in normalize_text(text).split():
+        if word.isdigit():
+            continue  # bare quantities/sizes match everything
+        # Arabic definite article "ال" should not dominate matches
+        if len(word) > 4 and word.startswith("ال"):
+            word = word[2:]
+        padded = f" {word} "
+        if len(padded) <= NGRAM:
+            grams.append(padded)
+            continue
+        grams.extend(padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1))
+    return grams
+
+
+def _term_freqs(row):
+    tf = defaultdict(float)
+    for col, weight in _FIELD_WEIGHTS:
+        for gram in char_ngrams(row[col]):
+            tf[gram] += weight
+    return tf
+
+
+def format_taxonomy_row(row):
+    """Prompt line for one taxonomy row: 'BasicAr (BasicEn) > MainAr (MainEn) > SubAr (SubEn) | Needs: ...'"""
+    line = f"{row[0]} ({row[1]}) > {row[2]} ({row[3]}) > {row[4]} ({row[5]})"
+    needs = [row[i].strip() for i in (6, 7, 8) if len(row) > i and row[i]]
+    if needs:
+        line += f" | Needs: {' & '.join(needs)}"
+    return line
+
+
+class TaxonomyIndex:
+    """Char n-gram TF-IDF index over the bilingual taxonomy names.
+
+    Built once per taxonomy snapshot; ``search`` scores only the rows that
+    share at least one n-gram with the query via an inverted index, so lookup
+    cost tracks the query length rather than the catalog size.
+    """
+
+    def __init__(self, rows):
+        self.rows = [r for r in rows if len(r) >= 6]
+        self.lines = [format_taxonomy_row(r) for r in self.rows]
+        doc_tfs = [_term_freqs(row) for row in self.rows]
+        df = defaultdict(int)
+        for tf in doc_tfs:
+            for gram in tf:
+                df[gram] += 1
+
+        n_docs = len(self.rows) or 1
+        self.idf = {gram: math.log((1 + n_docs) / (1 + count)) + 1 for gram, count in df.items()}
+        self.postings = defaultdict(list)  # gram -> [(doc_idx, normalized weight)]
+        for doc_idx, tf in enumerate(doc_tfs):
+            self._post(doc_idx, tf)
+
+    def _post(self, doc_idx, tf):
+        weights = {gram: (1 + math.log(count)) * self.idf[gram] for gram, count in tf.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for gram, w in weights.items():
+            self.postings[gram].append((doc_idx, w / norm))
+
+    def add(self, row):
+        """Index one more row in place. Returns its formatted line, or None for short rows.
+
+        The IDF of known n-grams is kept as is (new ones get the IDF of a
+        single-row n-gram), so scores drift slightly from a full rebuild until
+        the next snapshot rebuilds the index. Concurrent searches are safe: the
+        row is visible before any posting points at it.
+        """
+        if len(row) < 6:
+            return None
+        tf = _term_freqs(row)
+        n_docs = len(self.rows) + 1
+        for gram in tf:
+            if gram not in self.idf:
+                self.idf[gram] = math.log((1 + n_docs) / 2) + 1
+        line = format_taxonomy_row(row)
+        self.rows.append(row)
+        self.lines.append(line)
+        self._post(len(self.rows) - 1, tf)
+        return line
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query, k=10):
+        """Return up to k (score, row_index) pairs, best first."""
+        q_tf = defaultdict(float)
+        for gram in char_ngrams(query):
+            if gram in self.idf:
+                q_tf[gram] += 1
+        if not q_tf:
+            return []
+        q_weights = {gram: (1 + math.log(c)) * self.idf[gram] for gram, c in q_tf.items()}
+        q_norm = math.sqrt(sum(w * w for w in q_weights.values())) or 1.0
+
+        scores = defaultdict(float)
+        for gram, qw in q_weights.items():
+            for doc_idx, dw in self.postings[gram]:
+                scores[doc_idx] += qw * dw
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [(score / q_norm, doc_idx) for doc_idx, score in best]
+
+    def relevant_lines(self, query, k=10):
+        return [self.lines[idx] for _, idx in self.search(query, k)]
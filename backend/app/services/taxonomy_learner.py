@@ -0,0 +1,148 @@
+import logging
+import threading
+
+from app.core.config import settings
+from app.services import sheet_writes
+from app.services.sheet_formatter import SheetFormatQueue, updated_range_of
+from app.services.taxonomy_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+TAXONOMY_WORKSHEET = "الاساسي"
+
+# Column layout of "الاساسي"
+TAXONOMY_FIELDS = (
+    "basic_ar", "basic_en", "main_ar", "main_en", "sub_ar", "sub_en",
+    "spec1_name", "spec2_name", "spec3_name",
+)
+
+
+def sub_key(sub_en):
+    """Dedup key for a sub-category: case, punctuation and spacing insensitive."""
+    return normalize_text(sub_en)
+
+
+def taxonomy_row(res):
+    """"الاساسي" row for a classification result."""
+    return [str(res.get(field) or "") for field in TAXONOMY_FIELDS]
+
+
+class TaxonomyLearner:
+    """Collects new sub-categories proposed by classification and writes them in batches.
+
+    Every row is keyed by sub_key(sub_en). learn() decides under a lock whether
+    a proposal is new, so concurrent classifications of the same new item add
+    one row. A new row is visible at once through lookup() and through the
+    listeners (which patch the callers' cached snapshots), and is appended to
+    the sheet by flush() together with any other pending rows: when the batch
+    is full, after TAXONOMY_LEARN_FLUSH_SECONDS, or when a caller flushes at
+    the end of its unit of work.
+    """
+
+    def __init__(self, batch_size=20, flush_seconds=10.0):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rows = {}  # sub key -> row, from sheet snapshots and learned rows
+        self._pending = []
+        self._spreadsheet = None
+        self._timer = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(row) runs for every newly learned row, e.g. to patch a cache in place."""
+        self._listeners.append(callback)
+
+    def observe(self, rows):
+        """Replace the known rows with a fresh sheet snapshot (pending rows are kept)."""
+        known = {}
+        for row in rows:
+            if len(row) >= 6 and row[5]:
+                known.setdefault(sub_key(row[5]), row)
+        with self._lock:
+            for row in self._pending:
+                known.setdefault(sub_key(row[5]), row)
+            self._rows = known
+
+    def merge(self, rows):
+        """Observe a sheet snapshot and return it with pending (unwritten) rows appended."""
+        self.observe(rows)
+        with self._lock:
+            present = {sub_key(r[5]) for r in rows if len(r) >= 6 and r[5]}
+            return list(rows) + [r for r in self._pending if sub_key(r[5]) not in present]
+
+    def lookup(self, sub_en):
+        with self._lock:
+            return self._rows.get(sub_key(sub_en))
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def learn(self, sh, res):
+        """Propose a sub-category. Returns (row, created); created is False for known ones."""
+        key = sub_key(res.get("sub_en"))
+        if not key:
+            return None, False
+        with self._lock:
+            existing = self._rows.get(key)
+            if existing is not None:
+                return existing, False
+            row = taxonomy_row(res)
+            self._rows[key] = row
+            self._pending.append(row)
+            self._spreadsheet = sh
+            full = len(self._pending) >= self.batch_size
+            if not full:
+                self._schedule_flush()
+
+        for callback in self._listeners:
+            try:
+                callback(row)
+            except Exception as e:
+                logger.error(f"Taxonomy learner listener failed: {e}")
+        logger.info(f"Learned new sub-category '{res.get('sub_en')}' ({self.pending_count()} pending write)")
+        if full:
+            self.flush()
+        return row, True
+
+    def _schedule_flush(self):
+        # Caller holds self._lock
+        if self._timer is None and self.flush_seconds > 0:
+            self._timer = threading.Timer(self.flush_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, sh=None, format_queue=None):
+        """Append all pending rows in one call. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                rows, self._pending = self._pending, []
+                sh = sh or self._spreadsheet
+            if not rows:
+                return 0
+            from app.services.sheets_service import _sheets_request_with_retry
+            try:
+                ws = _sheets_request_with_retry(sh.worksheet, TAXONOMY_WORKSHEET)
+                with sheet_writes.writer(TAXONOMY_WORKSHEET).turn():
+                    res = _sheets_request_with_retry(ws.append_rows, rows)
+            except Exception as e:
+                logger.error(f"Failed to write {len(rows)} learned taxonomy rows, will retry: {e}")
+                with self._lock:
+                    self._pending = rows + self._pending
+                    self._schedule_flush()
+                return 0
+            # Table borders for the new rows; callers can pass their queue to share its batch_update
+            queue = format_queue if format_queue is not None else SheetFormatQueue(sh, _sheets_request_with_retry)
+            queue.borders(ws, updated_range_of(res))
+            if format_queue is None:
+                queue.flush()
+            logger.info(f"Wrote {len(rows)} learned taxonomy rows to '{TAXONOMY_WORKSHEET}'")
+            return len(rows)
+
+
+taxonomy_learner = TaxonomyLearner(settings.TAXONOMY_LEARN_BATCH_SIZE, settings.TAXONOMY_LEARN_FLUSH_SECONDS)
@@ -0,0 +1,158 @@
+import logging
+import random
+import threading
+import time
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """One cached value loaded by loader(*args), for data read from Sheets.
+
+    - Single-flight: concurrent misses share one loader call.
+    - Stale-while-revalidate: once the TTL expires, callers keep getting the
+      old value for up to stale_seconds while one background thread reloads it.
+    - Jitter: each load's TTL is spread by +/- jitter so caches filled
+      together do not all expire together.
+    - Negative caching: after a failed load no new attempt is made for
+      error_seconds; callers get the stale value, or default if there is none.
+    """
+
+    def __init__(self, name, loader, ttl_seconds=300, jitter=0.1, stale_seconds=600, error_seconds=30, default=None):
+        self.name = name
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.jitter = jitter
+        self.stale_seconds = stale_seconds
+        self.error_seconds = error_seconds
+        self.default = default
+        self._lock = threading.Lock()  # guards the fields below
+        self._load_lock = threading.Lock()  # one loader call at a time
+        self._value = _MISSING
+        self._loaded_at = 0.0
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        self._refreshing = False
+        self._errors = 0
+        self._last_error = None
+
+    def _load(self, args):
+        # Caller holds self._load_lock
+        try:
+            value = self.loader(*args)
+        except Exception as e:
+            with self._lock:
+                self._retry_at = time.time() + self.error_seconds
+                self._errors += 1
+                self._last_error = str(e)
+            metrics.incr(f"cache.{self.name}.error")
+            logger.error(f"Cache '{self.name}' load failed, retrying in {self.error_seconds}s: {e}")
+            raise
+        now = time.time()
+        ttl = self.ttl_seconds * (1 + random.uniform(-self.jitter, self.jitter))
+        with self._lock:
+            self._value = value
+            self._loaded_at = now
+            self._expires_at = now + ttl
+            self._retry_at = 0.0
+        metrics.incr(f"cache.{self.name}.load")
+        return value
+
+    def get(self, *args):
+        now = time.time()
+        with self._lock:
+            value, expires_at, retry_at = self._value, self._expires_at, self._retry_at
+        if value is not _MISSING and now < expires_at:
+            metrics.cache(self.name, hit=True)
+            return value
+        metrics.cache(self.name, hit=False)
+
+        if value is not _MISSING and now < expires_at + self.stale_seconds:
+            if now >= retry_at:
+                self._refresh_in_background(args)
+            return value
+
+        with self._load_lock:
+            with self._lock:
+                value, expires_at, retry_at = self._value, self._expires_at, self._retry_at
+            now = time.time()
+            # Loaded by the caller we queued behind, or failed too recently to try again
+            if value is not _MISSING and now < expires_at:
+                return value
+            if now < retry_at:
+                return self.default if value is _MISSING else value
+            try:
+                return self._load(args)
+            except Exception:
+                return self.default if value is _MISSING else value
+
+    def refresh(self, *args):
+        """Reload now and return the value; raises if the loader fails.
+
+        A caller that waits behind a load started after its own request
+        reuses that result instead of loading again.
+        """
+        requested_at = time.time()
+        with self._load_lock:
+            with self._lock:
+                if self._value is not _MISSING and self._loaded_at >= requested_at:
+                    return self._value
+            return self._load(args)
+
+    def _refresh_in_background(self, args):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(*args)
+            except Exception:
+                pass  # logged and negative-cached by _load
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name=f"refresh-{self.name}", daemon=True).start()
+
+    def peek(self, default=None):
+        """The cached value, fresh or stale, without loading."""
+        value = self._value
+        return default if value is _MISSING else value
+
+    def update(self, func):
+        """Replace the cached value with func(value), keeping its expiry. No-op when empty."""
+        with self._lock:
+            if self._value is not _MISSING:
+                self._value = func(self._value)
+
+    def invalidate(self):
+        """Expire the value; the next get serves it stale while one refresh runs."""
+        with self._lock:
+            self._expires_at = min(self._expires_at, time.time())
+            self._retry_at = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._value = _MISSING
+            self._expires_at = self._retry_at = 0.0
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            loaded = self._value is not _MISSING
+            return {
+                "loaded": loaded,
+                "age_seconds": int(now - self._loaded_at) if loaded else None,
+                "expires_in_seconds": int(self._expires_at - now) if loaded else None,
+                "ttl_seconds": self.ttl_seconds,
+                "refreshing": self._refreshing,
+                "load_errors": self._errors,
+                "last_error": self._last_error,
+                "retry_in_seconds": max(0, int(self._retry_at - now)),
+            }
@@ -0,0 +1,56 @@
+"""
+Populate the canonical product code index from the existing "التصنيفات" sheet.
+
+Pulls new classification rows into the local mirror, then registers one base
+code per sub-category and one code per (sub-category, spec values), taking the
+first occurrence in sheet order. Safe to run again; indexed entries are kept.
+
+Usage:
+    python backfill_codes.py
+"""
+
+import json
+import os
+
+import gspread
+
+from app.db import models, session
+from app.services import code_index, sheet_mirror
+
+CREDENTIALS_FILE = "credentials.json"
+SHEET_NAME = "الشات والتصنيفات"
+
+
+def main():
+    if not os.path.exists(CREDENTIALS_FILE):
+        print(f"❌ لم يتم العثور على ملف {CREDENTIALS_FILE}")
+        return
+
+    with open(CREDENTIALS_FILE, 'r', encoding='utf-8') as f:
+        creds = json.load(f)
+    gc = gspread.service_account_from_dict(creds)
+    sh = gc.open(SHEET_NAME)
+
+    models.Base.metadata.create_all(bind=session.engine)
+
+    pulled = sheet_mirror.pull(sh.worksheet(sheet_mirror.CLASSIFICATIONS_WORKSHEET))
+    print(f"📋 {sheet_mirror.CLASSIFICATIONS_WORKSHEET}: pulled {pulled} new rows into the mirror")
+    rekeyed = sheet_mirror.rekey_classifications()
+    if rekeyed:
+        print(f"🔑 Re-keyed {rekeyed} mirrored rows to the code index's sub-category normalization")
+
+    db = session.SessionLocal()
+    try:
+        row = models.SheetClassificationRow
+        rows = db.query(row.sub_en, row.spec1_val, row.spec2_val, row.spec3_val, row.code).filter(
+            row.code != ""
+        ).order_by(row.sheet_row.is_(None), row.sheet_row, row.id).all()
+    finally:
+        db.close()
+
+    bases, codes = code_index.backfill(rows)
+    print(f"✅ Indexed {bases} new base codes and {codes} new product codes from {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
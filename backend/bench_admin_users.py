@@ -0,0 +1,111 @@
+"""
+Benchmark for the admin user listing.
+
+Seeds an in-memory SQLite database with 10k users and 100 locations, then
+compares the legacy listing (offset + lazy-loaded locations per user) with the
+keyset listing that eager-loads locations via selectinload.
+
+Usage:
+    python bench_admin_users.py [--users 10000] [--locations 100] [--page 100]
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.db import crud, models
+from app.db.session import Base
+from app.schemas import user as user_schema
+
+
+def seed(db, num_users, num_locations):
+    rnd = random.Random(42)
+    db.execute(insert(models.Location), [{"id": i + 1, "name": f"Site {i + 1}"} for i in range(num_locations)])
+    db.execute(insert(models.User), [
+        {
+            "code": f"U{i:06d}",
+            "secret_hash": "x",
+            "name": f"Contractor {i}",
+            "phone": f"05{i:08d}",
+            "is_admin": 0,
+        }
+        for i in range(num_users)
+    ])
+    links = []
+    for i in range(num_users):
+        for loc_id in rnd.sample(range(1, num_locations + 1), 3):
+            links.append({"user_code": f"U{i:06d}", "location_id": loc_id})
+    db.execute(models.user_locations.insert(), links)
+    db.commit()
+
+
+def serialize(users):
+    return [user_schema.User.model_validate(u).model_dump() for u in users]
+
+
+def run(label, db, fetch, statements):
+    db.expunge_all()
+    statements[0] = 0
+    start = time.perf_counter()
+    rows = fetch()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<38} {elapsed * 1000:9.1f} ms  {statements[0]:6d} queries  {len(rows):6d} users")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--page", type=int, default=100)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statements(*_):
+        statements[0] += 1
+
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    seed(db, args.users, args.locations)
+    print(f"Seeded {args.users} users, {args.locations} locations\n")
+
+    run("legacy first page (lazy locations)", db,
+        lambda: serialize(crud.get_users(db, limit=args.page)), statements)
+    run("keyset first page (selectinload)", db,
+        lambda: serialize(crud.get_users_page(db, limit=args.page)), statements)
+
+    def legacy_walk():
+        out, skip = [], 0
+        while True:
+            page = serialize(crud.get_users(db, skip=skip, limit=args.page))
+            if not page:
+                return out
+            out.extend(page)
+            skip += args.page
+
+    def keyset_walk():
+        out, after = [], None
+        while True:
+            page = serialize(crud.get_users_page(db, after_code=after, limit=args.page))
+            if not page:
+                return out
+            out.extend(page)
+            after = page[-1]["code"]
+
+    run("legacy full walk (offset)", db, legacy_walk, statements)
+    run("keyset full walk", db, keyset_walk, statements)
+    run("search 'Contractor 99' (keyset)", db,
+        lambda: serialize(crud.get_users_page(db, limit=args.page, search="Contractor 99")), statements)
+
+    start = time.perf_counter()
+    total = crud.count_users(db)
+    print(f"{'count_users':<38} {(time.perf_counter() - start) * 1000:9.1f} ms  total={total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Benchmark: offline accuracy and code stability of the classification pipeline.
+
+Runs every item of a labelled corpus through the production path (taxonomy
+retrieval, classify_item_ai with its retry loop, taxonomy override, canonical
+code index, append to "التصنيفات") against a frozen taxonomy held in an
+in-process fake spreadsheet and a temporary SQLite database. Gemini is
+replaced by one of:
+
+    oracle   answers from the corpus labels, so its accuracy is 100% by
+             construction: a plumbing smoke test of the pipeline, not a
+             measure of prompt or retrieval quality. --drift makes it vary
+             the shorthands and sub-category spelling the way the live model
+             does, to check that normalization and the code index absorb it
+    replay   LLM_MODE=replay: answers from the recordings file, keyed by
+             prompt hash; prompts that were not recorded count as misses
+    record   LLM_MODE=record: calls the real model (GEMINI_API_KEY) and
+             writes the recordings that replay uses
+
+Reported: sub-category accuracy, code accuracy, code stability (labelled
+codes whose items all got one predicted code), model calls per item and
+p50/p95 time per item. With replay, exits with status 1 when code accuracy
+is below --min-accuracy, so it can gate changes to retrieval, normalization
+and the code index (--min-accuracy is refused with the oracle backend).
+
+Recordings are keyed by the exact prompt, so any change to the classify
+prompt or to the taxonomy lines retrieved into it misses every recording:
+re-record with --backend record (GEMINI_API_KEY needed) after such a change,
+and review the new accuracy before using it as the gate.
+
+--export writes a new corpus from the live classifications (local mirror)
+and the live taxonomy, to be reviewed and corrected by hand before use.
+
+Usage:
+    python bench_classification_eval.py [--backend oracle|replay|record] [--drift 0.3] [--seed 1]
+                                        [--latency 0] [--recordings bench_data/eval_recordings.jsonl]
+                                        [--min-accuracy 0]
+    python bench_classification_eval.py --export [--limit 500]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+BENCH_DATA = Path(__file__).resolve().parent / "bench_data"
+TAXONOMY_CSV = BENCH_DATA / "eval_taxonomy.csv"
+CORPUS_CSV = BENCH_DATA / "eval_corpus.csv"
+RECORDINGS = BENCH_DATA / "eval_recordings.jsonl"
+
+CORPUS_FIELDS = [
+    "original", "basic_ar", "basic_en", "main_ar", "main_en", "sub_ar", "sub_en",
+    "spec1_name", "spec1_val", "spec2_name", "spec2_val", "spec3_name", "spec3_val", "code",
+]
+ITEM_RE = re.compile(r'Classify item: "(.*)"\n')
+UNIT_SPELLINGS = {"IN": "INCH", "M": "METER", "MM": "MILLIMETER", "CM": "CENTIMETER", "W": "WATT", "KG": "KILOGRAM"}
+
+
+def read_csv(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+class OracleModel:
+    """Answers classify prompts from the corpus labels, like a model that is always right."""
+
+    def __init__(self, corpus, taxonomy, drift=0.0, seed=1, latency=0.0):
+        self.labels = {row["original"]: row for row in corpus}
+        self.known_subs = {row["SubEn"].strip().lower() for row in taxonomy}
+        self.drift = drift
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.calls = 0
+
+    def _drifted(self, shorthand):
+        if self.random.random() >= self.drift:
+            return shorthand
+        match = re.match(r"^(\d+[\.\d]*)([A-Z]+)$", shorthand)
+        if match and match.group(2) in UNIT_SPELLINGS and self.random.random() < 0.5:
+            return f"{match.group(1)} {UNIT_SPELLINGS[match.group(2)]}"
+        return shorthand.lower()
+
+    def response(self, prompt):
+        match = ITEM_RE.search(prompt)
+        label = self.labels.get(match.group(1)) if match else None
+        if label is None:
+            return "{}"
+        specs = [label[f"spec{i}_val"] for i in (1, 2, 3)]
+        parts = label["code"].split("-")
+        n_specs = sum(1 for v in specs if v)
+        base, spec_parts = parts[:len(parts) - n_specs], iter(parts[len(parts) - n_specs:])
+        res = {k: label[k] for k in CORPUS_FIELDS if k not in ("original", "code")}
+        res["found"] = label["sub_en"].strip().lower() in self.known_subs
+        res["basic_sh"], res["main_sh"], res["sub_sh"] = base[0], base[1], "-".join(base[2:])
+        for i, value in enumerate(specs, 1):
+            res[f"spec{i}_sh"] = self._drifted(next(spec_parts)) if value else ""
+        if self.drift and self.random.random() < self.drift:
+            res["sub_en"] = f" {res['sub_en'].lower()} "
+        return json.dumps(res, ensure_ascii=False)
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(text=self.response(prompt))
+
+
+class CountingModel:
+    """Counts the calls (and replay misses) that reach the configured transport."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.misses = 0
+
+    def generate_content(self, prompt, **kwargs):
+        from app.services.llm_transport import ReplayMissError
+        self.calls += 1
+        try:
+            return self.model.generate_content(prompt, **kwargs)
+        except ReplayMissError:
+            self.misses += 1
+            raise
+
+
+class NoSleep:
+    """The time module without sleep, for the classifier's retry back-off."""
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def sleep(self, seconds):
+        pass
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows):
+        self.title = title
+        self.id = abs(hash(title)) % 10000
+        self.rows = [list(r) for r in rows]
+
+    def get_all_values(self):
+        return [list(r) for r in self.rows]
+
+    def get(self, rng, **kwargs):
+        start = int(re.match(r"A(\d+)", rng.split("!")[-1]).group(1))
+        return [list(r) for r in self.rows[start - 1:]]
+
+    def append_rows(self, rows, **kwargs):
+        start = len(self.rows) + 1
+        self.rows.extend([[str(v) for v in r] for r in rows])
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:P{len(self.rows)}"}}
+
+
+class FakeSpreadsheet:
+    def __init__(self, taxonomy_rows):
+        from app.services import sheet_mirror
+        from app.services.taxonomy_learner import TAXONOMY_WORKSHEET
+        self.sheets = {
+            TAXONOMY_WORKSHEET: FakeWorksheet(TAXONOMY_WORKSHEET, taxonomy_rows),
+            sheet_mirror.CLASSIFICATIONS_WORKSHEET: FakeWorksheet(
+                sheet_mirror.CLASSIFICATIONS_WORKSHEET, [sheet_mirror.CLASSIFICATION_COLUMNS]
+            ),
+        }
+
+    def worksheet(self, title):
+        return self.sheets[title]
+
+    def batch_update(self, body):
+        return {}
+
+
+def make_model(args, corpus, taxonomy):
+    if args.backend == "oracle":
+        return OracleModel(corpus, taxonomy, args.drift, args.seed, args.latency / 1000)
+    # replay/record go through the app's LLM transport (LLM_MODE, set in main)
+    from app.services import ai_service
+    model = ai_service.get_model()
+    if model is None:
+        sys.exit("record needs GEMINI_API_KEY and the google-generativeai package")
+    return CountingModel(model)
+
+
+def evaluate(args):
+    from app.db import models, session
+    from app.services import ai_service, classifier, sheets_service
+    from app.services.taxonomy_index import normalize_text
+    from app.services.taxonomy_learner import taxonomy_learner
+
+    models.Base.metadata.create_all(bind=session.engine)
+    taxonomy = read_csv(TAXONOMY_CSV)
+    corpus = read_csv(CORPUS_CSV)
+    header = list(taxonomy[0].keys())
+    sh = FakeSpreadsheet([header] + [[row[h] for h in header] for row in taxonomy])
+
+    model = make_model(args, corpus, taxonomy)
+    ai_service.model, ai_service._model_checked = model, True
+    classifier.time = NoSleep()  # the retry back-off only slows the run down
+
+    timings, results = [], []
+    for n, label in enumerate(corpus, 1):
+        text = label["original"]
+        start = time.perf_counter()
+        classifier.get_taxonomy_snapshot(sh)
+        res = classifier._classify_with_retries(f"EVAL-{n}", text, classifier.get_relevant_taxonomy(sh, text))
+        row = classifier._build_classification_row(sh, f"EVAL-{n}", text, res) if res else None
+        if row:
+            sheets_service.append_classification_rows(sh, [row])
+        taxonomy_learner.flush(sh)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append((label, row))
+
+    total = len(results)
+    sub_ok = sum(1 for label, row in results if row and normalize_text(row[7]) == normalize_text(label["sub_en"]))
+    code_ok = sum(1 for label, row in results if row and row[14] == label["code"])
+    groups = {}
+    for label, row in results:
+        groups.setdefault(label["code"], []).append(row[14] if row else None)
+    multi = {code: got for code, got in groups.items() if len(got) > 1}
+    stable = sum(1 for got in multi.values() if None not in got and len(set(got)) == 1)
+    p50 = statistics.median(timings)
+    p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+
+    print(f"backend={args.backend} items={total} taxonomy={len(taxonomy)} sub-categories")
+    if args.backend == "oracle":
+        print("  (oracle answers from the labels: checks the pipeline plumbing, not prompt or retrieval quality)")
+    print(f"  sub-category accuracy {sub_ok / total:7.1%}  ({sub_ok}/{total})")
+    print(f"  code accuracy         {code_ok / total:7.1%}  ({code_ok}/{total})")
+    print(f"  code stability        {stable / max(1, len(multi)):7.1%}  ({stable}/{len(multi)} codes with several items)")
+    print(f"  model calls per item  {model.calls / total:7.2f}")
+    if args.backend == "replay":
+        print(f"  replay misses         {model.misses:7d}")
+        if model.misses:
+            print("  (prompts changed since recording? re-record with --backend record)")
+    print(f"  time per item         p50 {p50:.1f} ms  p95 {p95:.1f} ms")
+
+    for label, row in results:
+        if not row or row[14] != label["code"]:
+            print(f"  ✗ {label['original']}: expected {label['code']}, got {row[14] if row else 'no classification'}")
+    return code_ok / total
+
+
+def export(args):
+    from sqlalchemy import desc
+
+    from app.db import models, session
+    from app.services import sheet_mirror, sheets_service
+
+    ws = sheets_service.get_worksheet()
+    if ws is None:
+        sys.exit("Google Sheets is not available")
+    sh = ws.spreadsheet
+    sheet_mirror.pull(sh.worksheet(sheet_mirror.CLASSIFICATIONS_WORKSHEET))
+    taxonomy = sh.worksheet("الاساسي").get_all_values()
+    with open(TAXONOMY_CSV, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerows(taxonomy)
+
+    db = session.SessionLocal()
+    try:
+        rows = (db.query(models.SheetClassificationRow)
+                .order_by(desc(models.SheetClassificationRow.sheet_row)).limit(args.limit).all())
+    finally:
+        db.close()
+    with open(CORPUS_CSV, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CORPUS_FIELDS)
+        for row in reversed(rows):
+            if row.code:
+                writer.writerow([getattr(row, field) or "" for field in CORPUS_FIELDS])
+    print(f"Wrote {len(taxonomy) - 1} taxonomy rows to {TAXONOMY_CSV} and {len(rows)} items to {CORPUS_CSV}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("oracle", "replay", "record"), default="oracle")
+    parser.add_argument("--drift", type=float, default=0.0, help="Oracle: chance of a reformatted shorthand or sub-category")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0, help="Simulated model latency in ms (oracle/replay)")
+    parser.add_argument("--recordings", default=str(RECORDINGS))
+    parser.add_argument("--min-accuracy", type=float, default=0.0,
+                        help="Exit 1 when code accuracy is below this (0-1); replay/record only")
+    parser.add_argument("--export", action="store_true", help="Write the corpus from the live sheets instead")
+    parser.add_argument("--limit", type=int, default=500, help="Export: most recent classifications to keep")
+    args = parser.parse_args()
+
+    if args.export:
+        export(args)
+        return
+    if args.min_accuracy and args.backend == "oracle":
+        parser.error("--min-accuracy needs --backend replay or record: the oracle answers from the labels")
+
+    db_dir = tempfile.mkdtemp(prefix="bench_eval_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    os.environ["TAXONOMY_LEARN_FLUSH_SECONDS"] = "0"
+    os.environ["BREAKER_FAILURE_THRESHOLD"] = str(10 ** 9)  # replay misses must not fail the rest fast
+    if args.backend != "oracle":
+        os.environ["LLM_MODE"] = args.backend
+        os.environ["LLM_RECORDINGS_PATH"] = args.recordings
+        os.environ["LLM_REPLAY_LATENCY_MS"] = str(args.latency)
+    accuracy = evaluate(args)
+    if accuracy < args.min_accuracy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark: API cold start.
+
+Spawns fresh interpreters and measures
+  * import time of app.main, with the slowest modules from `python -X importtime`
+  * wall time from process start until GET / has been served
+  * wall time until the first request that touches the database (a rejected
+    login) has been served, which triggers the lazy schema check and seeding
+
+Exits with status 1 when the median import time exceeds --max-import-ms, so it
+can gate a deploy. Sheets and Gemini are not contacted: warmup is disabled and
+the database is a throwaway SQLite file.
+
+Usage:
+    python bench_cold_start.py [--runs 5] [--top 15] [--max-import-ms 1500]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+FIRST_REQUEST = """
+import time
+t0 = time.perf_counter()
+from fastapi.testclient import TestClient
+import app.main
+t_import = time.perf_counter()
+with TestClient(app.main.app) as client:
+    client.get("/")
+    t_root = time.perf_counter()
+    client.post("/api/v1/auth/login_json", json={"code": "cold-start-probe"})
+    t_db = time.perf_counter()
+print(f"{(t_import - t0) * 1000:.1f} {(t_root - t0) * 1000:.1f} {(t_db - t0) * 1000:.1f}")
+"""
+
+
+def child_env(db_path):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{db_path}"
+    env["WARMUP_ON_STARTUP"] = "false"
+    env["GEMINI_API_KEY"] = ""
+    return env
+
+
+def import_profile(env):
+    """Run `-X importtime` and return (total_ms, [(cumulative_ms, module)])."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative_us) / 1000, name.rstrip()))
+    # Nested imports are indented by two extra spaces per level; sum the top-level ones
+    total = sum(ms for ms, name in modules if not name.startswith("  "))
+    return total, modules
+
+
+def first_request(env):
+    proc = subprocess.run(
+        [sys.executable, "-c", FIRST_REQUEST],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return [float(x) for x in proc.stdout.split()[-3:]]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--top", type=int, default=15)
+    arg_parser.add_argument("--max-import-ms", type=float, default=None)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        totals, timings, modules = [], [], []
+        for i in range(args.runs):
+            env = child_env(Path(tmp) / f"cold_{i}.db")
+            total, modules = import_profile(env)
+            totals.append(total)
+            timings.append(first_request(env))
+
+    print("Slowest imports (cumulative, last run):")
+    by_name = {}
+    for ms, name in modules:
+        by_name[name.strip()] = max(ms, by_name.get(name.strip(), 0))
+    for name, ms in sorted(by_name.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    import_ms = statistics.median(totals)
+    print()
+    print(f"import app.main (importtime)   median {import_ms:8.1f} ms   ({args.runs} runs)")
+    for label, col in (("import incl. TestClient", 0), ("first GET /", 1), ("first DB-backed request", 2)):
+        print(f"{label:<30} median {statistics.median(t[col] for t in timings):8.1f} ms")
+
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"\nFAIL: import time {import_ms:.1f} ms exceeds budget of {args.max_import_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
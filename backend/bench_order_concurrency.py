@@ -0,0 +1,152 @@
+"""
+Benchmark: orders/sec against concurrent clients.
+
+Saves orders through sheets_service.save_to_sheet into an in-process fake
+spreadsheet that sleeps --latency ms per API call, with a temporary SQLite
+mirror. Every client also writes classification rows for its orders, like
+the classifier does. Two write paths are compared:
+
+    global   one lock around numbering, append and colouring (the old _sheets_lock)
+    sharded  only numbering is serialized; appends are ordered per worksheet
+             and colouring runs in the background
+
+After each run the order numbers are checked for duplicates and for rows
+appended out of number order.
+
+Usage:
+    python bench_order_concurrency.py [--clients 1,4,16] [--orders 40] [--latency 80] [--items 3]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+_db_dir = tempfile.mkdtemp(prefix="bench_orders_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+os.environ["ORDER_SINKS"] = "sheets"
+
+from app.db import models, session  # noqa: E402
+from app.services import order_sinks, sheet_mirror, sheet_writes, sheets_service  # noqa: E402
+from app.services.idempotency import idempotency  # noqa: E402
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, width, latency):
+        self.spreadsheet, self.title, self.latency = spreadsheet, title, latency
+        self.id = len(spreadsheet.sheets)
+        self.width = width
+        self.rows = [["header"] * width]
+        self._lock = threading.Lock()
+
+    def get(self, rng, **kwargs):
+        time.sleep(self.latency)
+        start = int(re.match(r"A(\d+)", rng.split("!")[-1]).group(1))
+        with self._lock:
+            return [list(r) for r in self.rows[start - 1:]]
+
+    def col_values(self, col):
+        time.sleep(self.latency)
+        with self._lock:
+            return [r[col - 1] for r in self.rows]
+
+    def append_rows(self, rows, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            start = len(self.rows) + 1
+            self.rows.extend([[str(v) for v in r] for r in rows])
+            end = len(self.rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{sheet_mirror._col_letter(self.width)}{end}"}}
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency):
+        self.sheets = {}
+        self.latency = latency
+        for title, columns in ((sheet_mirror.ORDERS_WORKSHEET, sheet_mirror.ORDER_COLUMNS),
+                               (sheet_mirror.CLASSIFICATIONS_WORKSHEET, sheet_mirror.CLASSIFICATION_COLUMNS)):
+            self.sheets[title] = FakeWorksheet(self, title, len(columns), latency)
+
+    def worksheet(self, title):
+        return self.sheets[title]
+
+    def batch_update(self, body):
+        time.sleep(self.latency)
+        return {}
+
+
+class _Inline:
+    """Runs submitted work on the caller's thread, as the old write path did."""
+
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+def reset(latency):
+    models.Base.metadata.drop_all(bind=session.engine)
+    models.Base.metadata.create_all(bind=session.engine)
+    sheet_writes._writers.clear()
+    idempotency.clear()
+    sheet_writes.order_numbers = sheet_writes.OrderNumberAllocator()
+    sh = FakeSpreadsheet(latency)
+    sheets_service.worksheet = sh.worksheet(sheet_mirror.ORDERS_WORKSHEET)
+    order_sinks._order_sink = order_sinks.SheetsOrderSink()
+    return sh
+
+
+def run(mode, clients, orders_per_client, items, latency):
+    sh = reset(latency)
+    global_lock = threading.Lock()
+    sheets_service._format_pool = _Inline() if mode == "global" else None
+
+    def save(client, n):
+        data = {
+            "items": [{"item": f"item {i}", "tech_desc": f"item {i} of order {n} (client {client})"} for i in range(items)],
+            "c": {"a": "Riyadh"},
+        }
+        user = SimpleNamespace(name=f"Client {client}", phone="0500000000", code=f"C{client}")
+        if mode == "global":
+            with global_lock:
+                order_num = sheets_service.save_to_sheet(data, "summary", user)
+        else:
+            order_num = sheets_service.save_to_sheet(data, "summary", user)
+        # The classifier writes one batch per order to "التصنيفات"
+        rows = [[f"{order_num}-{i + 1}", f"item {i}"] + [""] * 14 for i in range(items)]
+        sheets_service.append_classification_rows(sh, rows)
+        return order_num
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        futures = [pool.submit(save, c, n) for c in range(clients) for n in range(orders_per_client)]
+        numbers = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    appended = [int(r[0]) for r in sh.worksheet(sheet_mirror.ORDERS_WORKSHEET).rows[1:]]
+    distinct = len(set(numbers))
+    in_order = all(a <= b for a, b in zip(appended, appended[1:]))
+    total = clients * orders_per_client
+    print(f"{mode:<8} {clients:4d} clients  {total:5d} orders  {elapsed:7.2f} s  {total / elapsed:8.1f} orders/s"
+          f"  unique={distinct == total and None not in numbers}  appended in order={in_order}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,4,16", help="Comma-separated client counts")
+    parser.add_argument("--orders", type=int, default=40, help="Orders in total per run")
+    parser.add_argument("--latency", type=float, default=80, help="Simulated Sheets API latency in ms")
+    parser.add_argument("--items", type=int, default=3, help="Items per order")
+    args = parser.parse_args()
+
+    latency = args.latency / 1000
+    for clients in [int(c) for c in args.clients.split(",")]:
+        per_client = max(1, args.orders // clients)
+        for mode in ("global", "sharded"):
+            run(mode, clients, per_client, args.items, latency)
+
+
+if __name__ == "__main__":
+    main()
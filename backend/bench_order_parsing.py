@@ -0,0 +1,165 @@
+"""
+Benchmark: structured JSON order block vs legacy pipe format.
+
+Generates synthetic chat replies in both formats, injects the kinds of
+formatting slips the model makes in practice, and reports parse time and
+failure rate (order dropped or items lost) for each parser, overall and per
+slip. The JSON replies are also fed through OrderStreamParser in small
+chunks to mimic streaming.
+
+Both formats get the slips they share (code fence, missing end marker, a
+reply cut off mid-block, a closing remark inside the block) plus their own:
+a "|" in the description or a dropped column for pipes; a trailing comma,
+an unescaped '"' in tech_desc (4" for inches) or a numeric quantity for JSON.
+
+Usage:
+    python bench_order_parsing.py [--replies 2000] [--items 12]
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+
+from app.services.order_parser import OrderStreamParser
+
+LOCATIONS = ["مشروع الرياض", "موقع جدة", "مستودع الدمام"]
+PRODUCTS = [
+    ("بناء", "ماسورة", "خامة", "PVC", "قطر", "4 بوصة", "الضغط", "10 بار"),
+    ("كهرباء", "كابل", "مقاس", "4 مم", "نوع", "نحاس", "طول", "100 متر"),
+    ("مكتبي", "ورق", "مقاس", "A4", "نوع", "80 جرام", "", ""),
+    ("بناء", "حديد تسليح", "قطر", "16 مم", "درجة", "60", "طول", "12 متر"),
+]
+
+SUMMARY = "تمام ✅ — تم اعتماد طلبك.\n\n📦 ماسورة | PVC | الكمية: 10\n"
+
+
+def make_items(rnd, n):
+    items = []
+    for _ in range(n):
+        cat, prod, n1, v1, n2, v2, n3, v3 = rnd.choice(PRODUCTS)
+        qty = str(rnd.randint(1, 500))
+        items.append({
+            "category": cat, "product": prod,
+            "spec1_name": n1, "spec1_value": v1, "spec2_name": n2, "spec2_value": v2,
+            "spec3_name": n3, "spec3_value": v3, "quantity": qty, "unit": "حبة",
+            "tech_desc": f"{prod} {v1} {v2} {v3} لون أبيض".strip(),
+        })
+    return items
+
+
+def pipe_reply(items, location, slip):
+    lines = []
+    for it in items:
+        tech = it["tech_desc"]
+        if slip == "pipe_in_desc":
+            tech += " | ماركة جيدة"
+        if slip == "inch_quote":
+            tech += ' 4"'
+        cols = [it["category"], it["product"], it["spec1_name"], it["spec1_value"], it["spec2_name"],
+                it["spec2_value"], it["spec3_name"], it["spec3_value"], it["quantity"], it["unit"], tech]
+        if slip == "missing_column":
+            cols.pop(6)
+        lines.append("|".join(cols))
+    customer = f"CUSTOMER:\nالاسم: \nالجوال: \nالعنوان: {location}"
+    if slip == "customer_label":
+        customer = customer.replace("CUSTOMER:", "العميل:")
+    if slip == "address_label":
+        customer = customer.replace("العنوان:", "الموقع:")
+    block = "ITEMS:\n" + "\n".join(lines) + "\n" + customer
+    return _wrap(block, slip, "```\n")
+
+
+def json_reply(items, location, slip):
+    order = {"items": items, "location": location}
+    if slip == "numeric_quantity":
+        order["items"] = [{**it, "quantity": int(it["quantity"])} for it in items]
+    if slip == "inch_quote":
+        order["items"] = [{**it, "tech_desc": it["tech_desc"] + ' 4"'} for it in items]
+    block = json.dumps(order, ensure_ascii=False, indent=1 if slip == "pretty" else None)
+    if slip == "inch_quote":
+        block = block.replace('4\\"', '4"')  # the model does not escape it
+    if slip == "trailing_comma":
+        block = block[:-1].rstrip() + ",}"
+    return _wrap(block, slip, "```json\n")
+
+
+def _wrap(block, slip, fence):
+    """Slips shared by both formats, applied around the data block."""
+    if slip == "code_fence":
+        block = fence + block + "\n```"
+    if slip == "prose_after":
+        block += "\nهل تحتاج شيء آخر؟"
+    if slip == "truncated":
+        # Output stopped mid-block (token limit or dropped stream)
+        return SUMMARY + "###DATA_START###\n" + block[:len(block) * 3 // 4]
+    if slip == "missing_end":
+        return SUMMARY + "###DATA_START###\n" + block
+    return SUMMARY + "###DATA_START###\n" + block + "\n###DATA_END###"
+
+
+SHARED_SLIPS = ["code_fence", "missing_end", "truncated", "prose_after", "inch_quote"]
+PIPE_SLIPS = [None, None, None, "pipe_in_desc", "missing_column", "customer_label", "address_label"] + SHARED_SLIPS
+JSON_SLIPS = [None, None, None, "numeric_quantity", "pretty", "trailing_comma"] + SHARED_SLIPS
+
+
+def parse_full(reply):
+    parser = OrderStreamParser()
+    parser.feed(reply)
+    return parser.finish(LOCATIONS)
+
+
+def parse_streamed(reply, chunk=24):
+    parser = OrderStreamParser()
+    for i in range(0, len(reply), chunk):
+        parser.feed(reply[i:i + chunk])
+    return parser.finish(LOCATIONS)
+
+
+def is_ok(expected_items, expected_loc, data):
+    if not data or data["c"]["a"] != expected_loc or len(data["items"]) != len(expected_items):
+        return False
+    return all(got["item"] == exp["product"] and got["qty"] == exp["quantity"]
+               for got, exp in zip(data["items"], expected_items))
+
+
+def bench(label, cases, parse):
+    start = time.perf_counter()
+    results = [parse(reply) for reply, _, _, _ in cases]
+    elapsed = time.perf_counter() - start
+    by_slip = {}  # slip -> [failures, cases]
+    for (_, items, loc, slip), data in zip(cases, results):
+        counts = by_slip.setdefault(slip or "none", [0, 0])
+        counts[0] += not is_ok(items, loc, data)
+        counts[1] += 1
+    failures = sum(f for f, _ in by_slip.values())
+    per_reply_us = elapsed / len(cases) * 1e6
+    print(f"{label:<28} {per_reply_us:9.1f} us/reply   failures {failures:5d}/{len(cases)} ({failures / len(cases):.1%})")
+    for slip, (failed, total) in sorted(by_slip.items()):
+        print(f"    {slip:<24} {failed:5d}/{total:<5d} ({failed / total:.0%})")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--replies", type=int, default=2000)
+    arg_parser.add_argument("--items", type=int, default=12)
+    args = arg_parser.parse_args()
+
+    rnd = random.Random(7)
+    pipe_cases, json_cases = [], []
+    for _ in range(args.replies):
+        items = make_items(rnd, rnd.randint(1, args.items))
+        loc = rnd.choice(LOCATIONS)
+        pipe_slip, json_slip = rnd.choice(PIPE_SLIPS), rnd.choice(JSON_SLIPS)
+        pipe_cases.append((pipe_reply(items, loc, pipe_slip), items, loc, pipe_slip))
+        json_cases.append((json_reply(items, loc, json_slip), items, loc, json_slip))
+
+    logging.disable(logging.CRITICAL)  # parsers log every failure
+    bench("pipe format", pipe_cases, parse_full)
+    bench("json format", json_cases, parse_full)
+    bench("json format (streamed)", json_cases, parse_streamed)
+
+
+if __name__ == "__main__":
+    main()
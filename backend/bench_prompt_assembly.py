@@ -0,0 +1,85 @@
+"""
+Benchmark: chat prompt assembly, string replaces vs the prompt compiler.
+
+The legacy path is the one get_ai_response used before: two str.replace
+passes over SYSTEM_PROMPT + save format, then concatenation of customer
+info, history summary and history. The compiled path is
+prompt_compiler.build with the user's suffix already cached. Both outputs are
+checked to be identical before timing.
+
+Usage:
+    python bench_prompt_assembly.py [--history 10,100,1000] [--rounds 2000] [--locations 20]
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from app.services.ai_service import SAVE_FORMATS, SYSTEM_PROMPT
+from app.services.prompt_compiler import NO_LOCATIONS, NO_TAXONOMY, PromptCompiler
+
+SAVE_FORMAT = "json"
+TAXONOMY = "\n".join(
+    f"- بناء > سباكة > مواسير {i}: خامة, قطر, الضغط" for i in range(40)
+)
+SUMMARY = "ملخص ما سبق: طلب العميل مواسير PVC قطر 4 بوصة وكابلات نحاس 4 مم."
+
+
+def legacy(history, user, locations, taxonomy_summary, history_summary):
+    customer_info = f"الاسم: {user.name}\nالجوال: {user.phone}\n"
+    prompt = (SYSTEM_PROMPT + SAVE_FORMATS[SAVE_FORMAT]).replace("{{TAXONOMY_SUMMARY}}", taxonomy_summary or NO_TAXONOMY)
+    if locations:
+        prompt = prompt.replace("{{ALLOWED_LOCATIONS}}", ", ".join(locations))
+    else:
+        prompt = prompt.replace("{{ALLOWED_LOCATIONS}}", NO_LOCATIONS)
+    if history_summary:
+        customer_info += history_summary + "\n"
+    return prompt + "\n" + customer_info + "\n".join(history) + "\nالبائع:"
+
+
+def make_history(n):
+    history = []
+    for i in range(n):
+        if i % 2 == 0:
+            history.append(f"العميل: ابي ماسورة PVC قطر {i % 8 + 1} بوصة ضغط 10 بار عدد {i}")
+        else:
+            history.append(f"البائع: تمام، ماسورة PVC {i % 8 + 1} بوصة × {i}. هل لديك أي طلبات أخرى؟")
+    return history
+
+
+def bench(label, func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<10} {elapsed / rounds * 1e6:9.1f} us/prompt")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", default="10,100,1000", help="Comma-separated history lengths")
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--locations", type=int, default=20)
+    args = parser.parse_args()
+
+    user = SimpleNamespace(code="U000001", name="مؤسسة البناء", phone="0500000000")
+    locations = [f"مشروع {i}" for i in range(args.locations)]
+    compiler = PromptCompiler()
+
+    for n in [int(h) for h in args.history.split(",")]:
+        history = make_history(n)
+        expected = legacy(history, user, locations, TAXONOMY, SUMMARY)
+        got = compiler.build(user, locations, TAXONOMY, SUMMARY, history, SAVE_FORMAT)
+        assert got == expected, "compiled prompt differs from the legacy prompt"
+
+        print(f"history={n} messages, prompt={len(expected):,} chars")
+        t_legacy = bench("legacy", lambda: legacy(history, user, locations, TAXONOMY, SUMMARY), args.rounds)
+        t_compiled = bench(
+            "compiled", lambda: compiler.build(user, locations, TAXONOMY, SUMMARY, history, SAVE_FORMAT), args.rounds
+        )
+        print(f"  speedup    {t_legacy / t_compiled:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark: memory held by taxonomy and classification rows.
+
+Builds synthetic "التصنيفات" and "الاساسي" rows the way gspread returns them
+(lists of lists, every cell its own string object, via a JSON round trip)
+and measures with tracemalloc what stays allocated after loading them as:
+
+    lists      the get_all_values() rows as they are
+    records    fixed-width namedtuples, no interning
+    interned   sheet_rows records, repeated cells share one string per snapshot
+
+The taxonomy part builds a full TaxonomySnapshot (rows, TF-IDF index, prompt
+summary) from each representation.
+
+Usage:
+    python bench_row_memory.py [--rows 100000] [--subs 400] [--taxonomy 5000]
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from app.services import classifier
+from app.services.sheet_mirror import CLASSIFICATION_COLUMNS
+from app.services.sheet_rows import ClassificationRow, TaxonomyRow, classification_rows, taxonomy_rows
+
+NOUNS = ["ماسورة", "كوع", "محبس", "لمبة", "كابل", "مفتاح", "خلاط", "صامولة", "برغي", "شريط"]
+MATERIALS = ["PVC", "PPR", "نحاس", "حديد", "ستيل", "LED", "بلاستيك"]
+SIZES = ["1/2 بوصة", "3/4 بوصة", "1 بوصة", "2 بوصة", "4 بوصة", "10 متر", "25 متر", "12W", "18W", "16 بار"]
+SPEC_NAMES = ["المقاس", "الخامة", "الضغط", "الطول", "القدرة", "اللون"]
+
+
+def make_taxonomy(n, rng):
+    rows = []
+    for i in range(n):
+        basic, main = i % 12, i % 60
+        rows.append([
+            f"قسم {basic}", f"Basic {basic}", f"فئة {main}", f"Main {main}",
+            f"{rng.choice(NOUNS)} {i}", f"Sub item {i}",
+            *rng.sample(SPEC_NAMES, 3),
+        ])
+    return rows
+
+
+def make_classifications(n, taxonomy, rng):
+    rows = []
+    for i in range(n):
+        tax = taxonomy[rng.randrange(len(taxonomy))]
+        specs = [rng.choice(SIZES), rng.choice(MATERIALS), rng.choice(SIZES)]
+        code = "-".join(["B" + tax[1][6:], "M" + tax[3][5:], "S" + tax[5][9:]] + [s.split()[0] for s in specs])
+        rows.append([
+            f"{1000 + i // 3}-{i % 3 + 1}", f"{tax[4]} {specs[0]} {specs[1]}", *tax[:6],
+            tax[6], specs[0], tax[7], specs[1], tax[8], specs[2],
+            code, f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+        ])
+    return rows
+
+
+def measure(build):
+    """(result, bytes still allocated, peak bytes, seconds) for build(); timed without tracing."""
+    gc.collect()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def report(title, n, builds):
+    print(f"\n{title} ({n:,} rows)")
+    print(f"{'':<10} {'retained':>10} {'per row':>9} {'peak':>10} {'build':>9}")
+    baseline = None
+    for name, build in builds:
+        result, current, peak, elapsed = measure(build)
+        baseline = baseline or current
+        print(f"{name:<10} {current / 2**20:>8.1f}MB {current / n:>8.0f}B {peak / 2**20:>8.1f}MB {elapsed * 1000:>7.0f}ms"
+              f"  ({current / baseline:.0%})")
+        del result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000, help="Classification rows")
+    parser.add_argument("--subs", type=int, default=400, help="Sub-categories the classification rows use")
+    parser.add_argument("--taxonomy", type=int, default=5000, help="Taxonomy rows for the snapshot")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # Serialized once; each build decodes its own copy, so no cell is shared up front
+    classification_json = json.dumps(make_classifications(args.rows, make_taxonomy(args.subs, rng), rng))
+    taxonomy_json = json.dumps(make_taxonomy(args.taxonomy, rng))
+    assert len(CLASSIFICATION_COLUMNS) == len(json.loads(classification_json)[0])
+
+    report("Classification rows", args.rows, [
+        ("lists", lambda: json.loads(classification_json)),
+        ("records", lambda: [ClassificationRow._make(r) for r in json.loads(classification_json)]),
+        ("interned", lambda: classification_rows(json.loads(classification_json))),
+    ])
+    report("Taxonomy snapshot", args.taxonomy, [
+        ("lists", lambda: classifier.TaxonomySnapshot(json.loads(taxonomy_json))),
+        ("records", lambda: classifier.TaxonomySnapshot([TaxonomyRow._make(r) for r in json.loads(taxonomy_json)])),
+        ("interned", lambda: classifier.TaxonomySnapshot(taxonomy_rows(json.loads(taxonomy_json)))),
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ import logging
 import time
 from dotenv import load_dotenv
 
+from app.db import models, session
+from app.services import sheet_mirror
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,7 +31,6 @@ model = genai.GenerativeModel('gemini-2.5-flash-lite')
 EXCEL_PATH = r"c:\Abdalla\chatbot\طلبات.xlsx"
 EXCEL_SHEET = "التصنيفات الفرعية " # Note the space
 GS_SHEET_NAME = "الشات والتصنيفات"
-SOURCE_WORKSHEET = "Sheet1"
 TARGET_WORKSHEET = "تصنيفات"
 CREDENTIALS_FILE = "credentials.json"
 
@@ -132,18 +134,20 @@ def main():
         logger.error(f"GSpread Connect Error: {e}")
         return
 
-    # 2. Get Source Data
+    # 2. Get Source Data: incremental pull of "الشات" into the local mirror, then read it from there
     try:
-        src_ws = sh.worksheet(SOURCE_WORKSHEET)
-        # Assuming the LAST column (12th, or column L) has the full desc
-        # Or better: Read all values and take the last element of each row
-        all_rows = src_ws.get_all_values()
-        if len(all_rows) < 2:
+        models.Base.metadata.create_all(bind=session.engine)
+        sheet_mirror.pull(sh.worksheet(sheet_mirror.ORDERS_WORKSHEET))
+        db = session.SessionLocal()
+        try:
+            data_rows = (db.query(models.SheetOrderRow.order_num, models.SheetOrderRow.short_desc,
+                                  models.SheetOrderRow.tech_desc)
+                         .order_by(models.SheetOrderRow.sheet_row).all())
+        finally:
+            db.close()
+        if not data_rows:
              logger.info("Source sheet is empty.")
              return
-             
-        headers = all_rows[0]
-        data_rows = all_rows[1:]
     except Exception as e:
         logger.error(f"Error reading source sheet: {e}")
         return
@@ -158,11 +162,7 @@ def main():
             logger.info(f"Created new worksheet: {TARGET_WORKSHEET}")
             
         # Read existing IDs in target to avoid duplicates
-        target_rows = target_ws.get_all_values()
-        processed_ids = set()
-        if len(target_rows) > 1:
-            for r in target_rows[1:]:
-                if r: processed_ids.add(r[0]) # Assuming Order ID is first col
+        processed_ids = set(target_ws.col_values(1)[1:]) # Order ID column only
     except Exception as e:
         logger.error(f"Error setup target sheet: {e}")
         return
@@ -177,25 +177,10 @@ def main():
     
     logger.info(f"Processing {len(data_rows)} rows...")
     
-    for row in data_rows:
-        if not row: continue
-        
-        # Adjust indices based on your sheet structure
-        # In save_to_sheet: 
-        # 0: OrderNum, 1: Time, 2:Name, 3:Phone, 4:Cat, 5:Desc, 6:Qty, 7:Unit, 8:Sum, 9:Stat, 10:Addr, 11: FULL_DESC
-        
-        # Check if row has enough columns. Since we just added col 12, old rows might not have it.
-        # If row length is < 12, we might not have the full desc.
-        # Fallback to column 5 (Desc) if 11 is missing
-        
-        order_id = row[0]
-        
-        if len(row) >= 12:
-            full_desc = row[11]
-        elif len(row) >= 6:
-            full_desc = row[5] # Fallback to normal desc
-        else:
-            full_desc = "Unknown"
+    for order_num, short_desc, tech_desc in data_rows:
+        order_id = str(order_num)
+        # Full technical description, falling back to the short one
+        full_desc = tech_desc or short_desc or "Unknown"
         
         if order_id in processed_ids and str(order_id) != "1000":
             continue
@@ -8,6 +8,10 @@ import json
 import re
 from datetime import datetime
 from dotenv import load_dotenv
+from app.services.llm_transport import wrap_model
+from app.services.sheet_formatter import SheetFormatQueue, updated_range_of
+from app.services.taxonomy_learner import taxonomy_learner
+from app.services.ttl_cache import TTLCache
 
 load_dotenv()
 
@@ -21,24 +25,17 @@ WORKSHEET_RESULTS = "التصنيفات" # Where we save results
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Global Cache
-_TAXONOMY_CACHE = None
-_TAXONOMY_SUMMARY_CACHE = None
-_EXISTING_SUBS_CACHE = None
-_SPECS_BY_SUB_CACHE = None  # sub_en -> (spec1_name, spec2_name, spec3_name)
-_CODES_BY_SUB_CACHE = None  # sub_en -> existing code from taxonomy sheet
-_LAST_CACHE_UPDATE = 0
-_LAST_SUMMARY_CACHE_UPDATE = 0
-_LAST_SUBS_CACHE_UPDATE = 0
 CACHE_TTL = 300 # Refresh every 5 minutes
 
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
     # Using gemini-2.5-flash-lite per user request
-    model = genai.GenerativeModel('gemini-2.5-flash') 
+    model = wrap_model(genai.GenerativeModel('gemini-2.5-flash'))
 else:
-    model = None
-    logger.warning("GEMINI_API_KEY not found in classifier.")
+    # LLM_MODE=replay answers from recordings without an API key
+    model = wrap_model(None)
+    if model is None:
+        logger.warning("GEMINI_API_KEY not found in classifier.")
 
 def get_google_sheet_client():
     if not os.path.exists(CREDENTIALS_FILE):
@@ -53,99 +50,109 @@ def get_google_sheet_client():
         logger.error(f"GSpread Connect Error: {e}")
         return None
 
-def get_taxonomy(force_refresh=False):
-    global _TAXONOMY_CACHE, _LAST_CACHE_UPDATE
+def _taxonomy_line(row):
+    """Taxonomy reference line for the classification prompt, or None for rows without a code."""
+    if len(row) < 7:
+        return None
+    b_ar, b_en = row[0], row[1]
+    m_ar, m_en = row[2], row[3]
+    s_ar, s_en = row[4], row[5]
+    code = row[6]
     
-    # Check Cache
-    if _TAXONOMY_CACHE and not force_refresh and (time.time() - _LAST_CACHE_UPDATE < CACHE_TTL):
-        return _TAXONOMY_CACHE
+    # Load Spec Names if they exist (up to 3)
+    spec1_name = row[7] if len(row) > 7 else ""
+    spec2_name = row[8] if len(row) > 8 else ""
+    spec3_name = row[9] if len(row) > 9 else ""
+
+    if not code or code == "Code": # verify not header
+        return None
+    # Include both languages and SPEC NAMES for AI context
+    line = f"[{code}] {b_ar} ({b_en}) > {m_ar} ({m_en}) > {s_ar} ({s_en})"
+    if spec1_name: line += f" | Needs: {spec1_name}"
+    if spec2_name: line += f" & {spec2_name}"
+    if spec3_name: line += f" & {spec3_name}"
+    return line
+
+def _summary_line(row):
+    """'- SubAr: اطلب من العميل (specs)' line for the chat summary, or None without specs."""
+    if len(row) < 7:
+        return None, None
+    cat_key = row[4] or row[2] # SubAr or MainAr
+    spec1 = row[6] if len(row) > 6 else ""
+    spec2 = row[7] if len(row) > 7 else ""
+    spec3 = row[8] if len(row) > 8 else ""
+    if not cat_key or not (spec1 or spec2):
+        return None, None
+    specs_str = spec1
+    if spec2: specs_str += f" و {spec2}"
+    if spec3: specs_str += f" و {spec3}"
+    return cat_key, specs_str
+
+class TaxonomyViews:
+    """Everything this module derives from one read of the taxonomy sheet."""
+
+    def __init__(self, rows):
+        self.text = ""  # reference lines for the classification prompt
+        self.categories = {}  # SubAr/MainAr -> required specs, for the chat summary
+        self.subs = set()  # existing sub_en names (lower case)
+        self.specs_by_sub = {}  # sub_en -> (spec1_name, spec2_name, spec3_name)
+        self.codes_by_sub = {}  # Empty since code column is removed from Taxonomy
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        line = _taxonomy_line(row)
+        if line:
+            self.text += line + "\n"
+        cat_key, specs_str = _summary_line(row)
+        if cat_key:
+            self.categories[cat_key] = specs_str
+        if len(row) >= 6 and row[5]:  # sub_en in col 5
+            key = row[5].strip().lower()
+            self.subs.add(key)
+            spec1 = row[6].strip() if len(row) > 6 else ''
+            spec2 = row[7].strip() if len(row) > 7 else ''
+            spec3 = row[8].strip() if len(row) > 8 else ''
+            if spec1 or spec2:
+                self.specs_by_sub[key] = (spec1, spec2, spec3)
+        return self
+
+    @property
+    def summary(self):
+        summary = "مواصفات المنتجات المطلوبة:\n"
+        for cat, specs in self.categories.items():
+            summary += f"- {cat}: اطلب من العميل ({specs})\n"
+        return summary
 
+def _load_taxonomy_views():
     logger.info("Loading taxonomy from Google Sheets...")
     gc = get_google_sheet_client()
-    if not gc: return None
+    if not gc:
+        raise RuntimeError("Google Sheets client unavailable")
+    sh = gc.open(SHEET_NAME)
+    rows = sh.worksheet(WORKSHEET_TAXONOMY).get_all_values()
+    data_rows = rows[1:] # Skip header; kept as read, _taxonomy_line expects the older 10-column layout
+    views = TaxonomyViews(taxonomy_learner.merge(data_rows))
+    logger.info(f"Taxonomy loaded ({len(data_rows)} items).")
+    return views
+
+# One sheet read feeds every view; single-flight, stale-while-revalidate, jittered TTL
+_taxonomy = TTLCache("legacy_taxonomy", _load_taxonomy_views, ttl_seconds=CACHE_TTL)
 
-    try:
-        sh = gc.open(SHEET_NAME)
-        ws = sh.worksheet(WORKSHEET_TAXONOMY)
-        rows = ws.get_all_values()
-        
-        if len(rows) < 2:
+def get_taxonomy(force_refresh=False):
+    if force_refresh:
+        try:
+            return _taxonomy.refresh().text
+        except Exception as e:
+            logger.error(f"Failed to load taxonomy: {e}")
             return ""
-
-        data_rows = rows[1:] # Skip header
-        
-        taxonomy_text = ""
-        for row in data_rows:
-            try:
-                if len(row) >= 7:
-                    b_ar, b_en = row[0], row[1]
-                    m_ar, m_en = row[2], row[3]
-                    s_ar, s_en = row[4], row[5]
-                    code = row[6]
-                    
-                    # Load Spec Names if they exist (up to 3)
-                    spec1_name = row[7] if len(row) > 7 else ""
-                    spec2_name = row[8] if len(row) > 8 else ""
-                    spec3_name = row[9] if len(row) > 9 else ""
-
-                    if code and code != "Code": # verify not header
-                        # Include both languages and SPEC NAMES for AI context
-                        line = f"[{code}] {b_ar} ({b_en}) > {m_ar} ({m_en}) > {s_ar} ({s_en})"
-                        if spec1_name: line += f" | Needs: {spec1_name}"
-                        if spec2_name: line += f" & {spec2_name}"
-                        if spec3_name: line += f" & {spec3_name}"
-                        taxonomy_text += line + "\n"
-            except IndexError:
-                continue
-        
-        _TAXONOMY_CACHE = taxonomy_text
-        _LAST_CACHE_UPDATE = time.time()
-        logger.info(f"Taxonomy loaded ({len(data_rows)} items).")
-        return taxonomy_text
-    except Exception as e:
-        logger.error(f"Failed to load taxonomy: {e}")
-        return ""
+    views = _taxonomy.get()
+    return views.text if views else None
 
 def get_taxonomy_summary():
     """Returns a concise list of categories and their required specs for the Chat AI. Cached."""
-    global _TAXONOMY_SUMMARY_CACHE, _LAST_SUMMARY_CACHE_UPDATE
-    
-    # Return cached version if still fresh
-    if _TAXONOMY_SUMMARY_CACHE and (time.time() - _LAST_SUMMARY_CACHE_UPDATE < CACHE_TTL):
-        return _TAXONOMY_SUMMARY_CACHE
-    
-    gc = get_google_sheet_client()
-    if not gc: return _TAXONOMY_SUMMARY_CACHE or ""
-    try:
-        sh = gc.open(SHEET_NAME)
-        ws = sh.worksheet(WORKSHEET_TAXONOMY)
-        rows = ws.get_all_values()
-        if len(rows) < 2: return ""
-        
-        categories = {}
-        for row in rows[1:]:
-            if len(row) >= 7:
-                cat_key = row[4] or row[2] # SubAr or MainAr
-                spec1 = row[6] if len(row) > 6 else ""
-                spec2 = row[7] if len(row) > 7 else ""
-                spec3 = row[8] if len(row) > 8 else ""
-                if cat_key and (spec1 or spec2):
-                    specs_str = spec1
-                    if spec2: specs_str += f" و {spec2}"
-                    if spec3: specs_str += f" و {spec3}"
-                    categories[cat_key] = specs_str
-        
-        summary = "مواصفات المنتجات المطلوبة:\n"
-        for cat, specs in categories.items():
-            summary += f"- {cat}: اطلب من العميل ({specs})\n"
-        
-        _TAXONOMY_SUMMARY_CACHE = summary
-        _LAST_SUMMARY_CACHE_UPDATE = time.time()
-        logger.info("Taxonomy summary cache refreshed.")
-        return summary
-    except Exception as e:
-        logger.error(f"Error getting taxonomy summary: {e}")
-        return _TAXONOMY_SUMMARY_CACHE or ""
+    views = _taxonomy.get()
+    return views.summary if views else ""
 
 # Helper for code generation
 def generate_base_code(b_sh, m_sh, s_sh):
@@ -261,7 +268,6 @@ def add_new_item_to_taxonomy(data, item_name):
 
     try:
         sh = gc.open(SHEET_NAME)
-        ws = sh.worksheet(WORKSHEET_TAXONOMY)
         
         # Calculate BASE code only (without specs) for the taxonomy row
         b_sh = data.get('basic_sh', '') or data.get('basic_en', '')[:3]
@@ -269,50 +275,21 @@ def add_new_item_to_taxonomy(data, item_name):
         s_sh = data.get('sub_sh', '') or data.get('sub_en', '')[:4]
         code = generate_base_code(b_sh, m_sh, s_sh)
         
-        # Append [BasicAr, BasicEn, MainAr, MainEn, SubAr, SubEn, Spec1Name, Spec2Name, Spec3Name]
-        b_en = data.get('basic_en', '')
-        m_en = data.get('main_en', '')
-        s_en = data.get('sub_en', '')
-        row = [
-            data.get('basic_ar', ''), b_en,
-            data.get('main_ar', ''), m_en,
-            data.get('sub_ar', ''), s_en,
-            data.get('spec1_name', ''),
-            data.get('spec2_name', ''),
-            data.get('spec3_name', '')
-        ]
-        
-        ws.append_row(row)
-        
-        # Apply table borders to the new taxonomy row
-        try:
-            new_row_num = len(ws.get_all_values())
-            end_col_letter = chr(64 + len(row))
-            cell_range = f"A{new_row_num}:{end_col_letter}{new_row_num}"
-            ws.format(cell_range, {
-                "borders": {
-                    "top": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "bottom": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "left": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "right": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                }
-            })
-        except Exception as fmt_err:
-            logger.warning(f"Failed to format taxonomy row: {fmt_err}")
-        
-        # Force cache refresh for ALL caches next time
-        global _LAST_CACHE_UPDATE, _LAST_SUMMARY_CACHE_UPDATE, _LAST_SUBS_CACHE_UPDATE, _SPECS_BY_SUB_CACHE
-        _LAST_CACHE_UPDATE = 0
-        _LAST_SUMMARY_CACHE_UPDATE = 0
-        _LAST_SUBS_CACHE_UPDATE = 0
-        _SPECS_BY_SUB_CACHE = None  # Force rebuild of specs cache
-        _CODES_BY_SUB_CACHE = None  # Force rebuild of codes cache
-        logger.info(f"All taxonomy caches invalidated after adding new item.")
+        # Row [BasicAr, BasicEn, MainAr, MainEn, SubAr, SubEn, Spec1Name, Spec2Name, Spec3Name] is
+        # deduplicated and batched by the learner, which also adds the borders when it writes;
+        # _apply_learned_row patches the caches in place
+        taxonomy_learner.learn(sh, data)
         return code
     except Exception as e:
         logger.error(f"Failed to learn new item: {e}")
         return "UNKNOWN"
 
+def _apply_learned_row(row):
+    """Patch the cached taxonomy views with a newly learned row instead of invalidating them."""
+    _taxonomy.update(lambda views: views.add(row))
+
+taxonomy_learner.add_listener(_apply_learned_row)
+
 def classify_item_ai(item_desc):
     if not model: return None
     
@@ -363,7 +340,7 @@ def classify_item_ai(item_desc):
             current_model = model
             if attempt > 0:
                  logger.info("Retrying with gemini-2.5-flash...")
-                 current_model = genai.GenerativeModel('gemini-2.5-flash')
+                 current_model = wrap_model(genai.GenerativeModel('gemini-2.5-flash'))
 
             response = current_model.generate_content(prompt, generation_config={"response_mime_type": "application/json", "temperature": 0})
             text_resp = response.text.strip()
@@ -406,85 +383,32 @@ def classify_item_ai(item_desc):
 
 def get_existing_sub_categories():
     """Returns a set of existing (sub_en) sub-category names. Cached for 5 minutes."""
-    global _EXISTING_SUBS_CACHE, _LAST_SUBS_CACHE_UPDATE
-    
-    if _EXISTING_SUBS_CACHE is not None and (time.time() - _LAST_SUBS_CACHE_UPDATE < CACHE_TTL):
-        return _EXISTING_SUBS_CACHE
-    
-    gc = get_google_sheet_client()
-    if not gc: return _EXISTING_SUBS_CACHE or set()
-    try:
-        sh = gc.open(SHEET_NAME)
-        ws = sh.worksheet(WORKSHEET_TAXONOMY)
-        rows = ws.get_all_values()
-        existing = set()
-        for row in rows[1:]:  # skip header
-            if len(row) >= 6 and row[5]:  # sub_en is col index 5
-                existing.add(row[5].strip().lower())
-        _EXISTING_SUBS_CACHE = existing
-        _LAST_SUBS_CACHE_UPDATE = time.time()
-        logger.info(f"Sub-categories cache refreshed ({len(existing)} items).")
-        return existing
-    except Exception as e:
-        logger.error(f"Error fetching existing sub-categories: {e}")
-        return _EXISTING_SUBS_CACHE or set()
-
-def _build_taxonomy_lookup_caches():
-    """Builds both specs and codes caches from the taxonomy sheet in ONE read."""
-    global _SPECS_BY_SUB_CACHE, _CODES_BY_SUB_CACHE
-    
-    gc = get_google_sheet_client()
-    if not gc: return
-    try:
-        sh = gc.open(SHEET_NAME)
-        ws = sh.worksheet(WORKSHEET_TAXONOMY)
-        rows = ws.get_all_values()
-        specs_cache = {}
-        codes_cache = {}
-        for row in rows[1:]:
-            if len(row) >= 6 and row[5]:  # sub_en in col 5
-                key = row[5].strip().lower()
-                spec1 = row[6].strip() if len(row) > 6 else ''
-                spec2 = row[7].strip() if len(row) > 7 else ''
-                spec3 = row[8].strip() if len(row) > 8 else ''
-                if spec1 or spec2:
-                    specs_cache[key] = (spec1, spec2, spec3)
-        _SPECS_BY_SUB_CACHE = specs_cache
-        _CODES_BY_SUB_CACHE = {} # Empty since code column is removed from Taxonomy
-        logger.info(f"Taxonomy lookup caches built ({len(specs_cache)} specs).")
-    except Exception as e:
-        logger.error(f"Error building taxonomy caches: {e}")
+    views = _taxonomy.get()
+    return views.subs if views else set()
 
 def get_taxonomy_specs_for_sub(sub_en_key):
     """Returns (spec1_name, spec2_name, spec3_name) from the taxonomy sheet for a known sub-category. Cached."""
-    global _SPECS_BY_SUB_CACHE
-    
-    if _SPECS_BY_SUB_CACHE is None:
-        _build_taxonomy_lookup_caches()
-    
-    if _SPECS_BY_SUB_CACHE is None:
+    views = _taxonomy.get()
+    if views is None:
         return None, None, None
     
     key = (sub_en_key or '').strip().lower()
-    entry = _SPECS_BY_SUB_CACHE.get(key)
+    entry = views.specs_by_sub.get(key)
     if entry:
         return entry[0], entry[1], entry[2]
     return None, None, None
 
 def get_taxonomy_code_for_sub(sub_en_key):
     """Returns the existing code from the taxonomy sheet for a known sub-category. Cached."""
-    global _CODES_BY_SUB_CACHE
-    
-    if _CODES_BY_SUB_CACHE is None:
-        _build_taxonomy_lookup_caches()
-    
-    if _CODES_BY_SUB_CACHE is None:
+    views = _taxonomy.get()
+    if views is None:
         return None
     
     key = (sub_en_key or '').strip().lower()
-    return _CODES_BY_SUB_CACHE.get(key)
+    return views.codes_by_sub.get(key)
 
 def process_and_save_classification(sh, order_id, full_desc):
+    format_queue = SheetFormatQueue(sh)
     try:
         # Classify
         result = classify_item_ai(full_desc)
@@ -501,13 +425,10 @@ def process_and_save_classification(sh, order_id, full_desc):
             
         if is_truly_new:
             logger.info(f"Adding TRULY NEW category to taxonomy: {result.get('sub_ar')} ({sub_en})")
-            new_code = add_new_item_to_taxonomy(result, full_desc)
+            add_new_item_to_taxonomy(result, full_desc)
             base_code = generate_base_code(
                 result.get('basic_sh', 'XXX'), result.get('main_sh', 'XXX'), result.get('sub_sh', 'XXX')
             )
-            # Invalidate specs cache too
-            global _SPECS_BY_SUB_CACHE
-            _SPECS_BY_SUB_CACHE = None
         else:
             logger.info(f"Category already exists in sheet, skipping add: {result.get('sub_ar')} ({sub_en})")
             # Override spec names with sheet-defined values for consistency
@@ -573,23 +494,13 @@ def process_and_save_classification(sh, order_id, full_desc):
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ]
         
-        target_ws.append_row(row)
+        res = target_ws.append_row(row)
         
-        # Apply table borders to the new row
-        try:
-            new_row_num = len(target_ws.get_all_values())
-            end_col_letter = chr(64 + len(row))  # Convert column count to letter
-            cell_range = f"A{new_row_num}:{end_col_letter}{new_row_num}"
-            target_ws.format(cell_range, {
-                "borders": {
-                    "top": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "bottom": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "left": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                    "right": {"style": "SOLID", "color": {"red": 0.8, "green": 0.8, "blue": 0.8}},
-                }
-            })
-        except Exception as fmt_err:
-            logger.warning(f"Failed to format classification row: {fmt_err}")
+        # Write any learned taxonomy row now (this script may exit before the learner's timer fires);
+        # its borders and the new row's go out in one batch_update
+        taxonomy_learner.flush(sh, format_queue)
+        format_queue.borders(target_ws, updated_range_of(res))
+        format_queue.flush()
         
         return True
     except Exception as e:
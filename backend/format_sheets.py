@@ -11,6 +11,9 @@ import gspread
 import os
 import time
 
+from app.db import models, session
+from app.services import sheet_mirror
+
 CREDENTIALS_FILE = "credentials.json"
 SHEET_NAME = "الشات والتصنيفات"
 
@@ -59,14 +62,18 @@ def col_letter(n):
 def format_sheet_as_table(ws, sheet_name):
     """Apply table formatting to a worksheet using batch_update for efficiency"""
     
-    all_data = ws.get_all_values()
-    if not all_data:
+    if sheet_name in sheet_mirror.MIRRORS:
+        # Row count from the local mirror (incremental pull) instead of downloading the sheet
+        num_rows = sheet_mirror.row_count(ws)
+        num_cols = len(ws.row_values(1))
+    else:
+        all_data = ws.get_all_values()
+        num_rows = len(all_data)
+        num_cols = len(all_data[0]) if all_data else 0
+    if not num_cols:
         print(f"  ⚠️ الشيت '{sheet_name}' فارغ")
         return
     
-    num_rows = len(all_data)
-    num_cols = len(all_data[0])
-    
     headers = HEADERS.get(sheet_name)
     header_color = HEADER_COLORS.get(sheet_name, {"red": 0.2, "green": 0.4, "blue": 0.7})
     
@@ -237,6 +244,9 @@ def run_formatting():
     
     gc = gspread.service_account_from_dict(creds)
     sh = gc.open(SHEET_NAME)
+
+    # Row counts come from the local mirror tables
+    models.Base.metadata.create_all(bind=session.engine)
     
     sheets_to_format = ["الشات", "الاساسي", "التصنيفات"]
     
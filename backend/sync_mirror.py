@@ -0,0 +1,49 @@
+"""
+Sync the local mirror of the append-only worksheets ("الشات", "التصنيفات").
+
+By default only rows appended since the last sync are downloaded, and rows
+inserted locally are pushed to the sheet. Use --full to rebuild the mirror
+from scratch.
+
+Usage:
+    python sync_mirror.py [--full]
+"""
+
+import argparse
+import json
+import os
+
+import gspread
+
+from app.db import models, session
+from app.services import sheet_mirror
+
+CREDENTIALS_FILE = "credentials.json"
+SHEET_NAME = "الشات والتصنيفات"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="drop and rebuild the mirror")
+    args = parser.parse_args()
+
+    if not os.path.exists(CREDENTIALS_FILE):
+        print(f"❌ لم يتم العثور على ملف {CREDENTIALS_FILE}")
+        return
+
+    with open(CREDENTIALS_FILE, 'r', encoding='utf-8') as f:
+        creds = json.load(f)
+    gc = gspread.service_account_from_dict(creds)
+    sh = gc.open(SHEET_NAME)
+
+    models.Base.metadata.create_all(bind=session.engine)
+
+    for title in sheet_mirror.MIRRORS:
+        ws = sh.worksheet(title)
+        pushed = sheet_mirror.push(ws)
+        pulled = sheet_mirror.resync(ws) if args.full else sheet_mirror.pull(ws)
+        print(f"📋 {title}: pushed {pushed}, pulled {pulled}")
+
+
+if __name__ == "__main__":
+    main()
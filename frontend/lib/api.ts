@@ -53,3 +53,39 @@ export const api = {
   put: (endpoint: string, body: any) => apiFetch(endpoint, { method: "PUT", body }),
   delete: (endpoint: string) => apiFetch(endpoint, { method: "DELETE" }),
 };
+
+export type ChatSocketEvent =
+  | { type: "ready"; locations: string[] }
+  | { type: "delta"; text: string }
+  | { type: "reply"; reply: string; order_placed: boolean }
+  | { type: "order_saved"; order_num: number; items: number }
+  | { type: "classification_complete"; order_num: number; classified: number; total: number }
+  | { type: "error"; detail: string };
+
+const WS_UNAUTHORIZED = 4401;
+
+// Chat over one WebSocket: the server keeps the conversation, streams the reply as
+// "delta" events followed by the final "reply", and pushes order status events.
+// history seeds the server-side conversation, e.g. when reconnecting.
+export function openChatSocket(onEvent: (event: ChatSocketEvent) => void, history: string[] = []) {
+  const token = typeof window !== "undefined" ? localStorage.getItem("token") : null;
+  const socket = new WebSocket(`${API_BASE_URL.replace(/^http/, "ws")}/chat/ws`);
+
+  socket.onopen = () => socket.send(JSON.stringify({ type: "auth", token, history }));
+  socket.onmessage = (message) => onEvent(JSON.parse(message.data));
+  socket.onclose = (event) => {
+    if (event.code === WS_UNAUTHORIZED && typeof window !== "undefined") {
+      localStorage.removeItem("token");
+      localStorage.removeItem("user");
+      window.location.href = "/";
+    }
+  };
+
+  return {
+    socket,
+    send: (text: string, idempotencyKey?: string) =>
+      socket.send(JSON.stringify({ type: "message", text, idempotency_key: idempotencyKey })),
+    reset: () => socket.send(JSON.stringify({ type: "reset" })),
+    close: () => socket.close(),
+  };
+}